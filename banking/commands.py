@@ -0,0 +1,101 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+import json
+
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("banking-benchmark-reconciliation")
+@click.option("--company", help="Company to seed. Defaults to the site's default company.")
+@click.option("--transactions", default=1000, help="Number of Bank Transactions.")
+@click.option("--payments", default=500, help="Number of Payment Entries and Journal Entries.")
+@click.option(
+	"--invoices",
+	default=100,
+	help="Number of unpaid Sales Invoices, Purchase Invoices and Expense Claims, each.",
+)
+@click.option("--sample", default=50, help="Number of Bank Transactions to match manually.")
+@click.option("--seed", default=0, help="Seed for reproducible data.")
+@click.option("--keep", is_flag=True, help="Commit the generated data instead of rolling it back.")
+@click.option("--output", type=click.Path(dir_okay=False), help="Write the results to this file.")
+@pass_context
+def benchmark_reconciliation(
+	context, company, transactions, payments, invoices, sample, seed, keep, output
+):
+	"""Seed synthetic data and time the Bank Reconciliation Tool Beta. Prints JSON results."""
+	from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.benchmark import (
+		run_benchmark,
+	)
+
+	frappe.init(site=get_site(context))
+	frappe.connect()
+	try:
+		results = run_benchmark(
+			company=company,
+			keep=keep,
+			transactions=transactions,
+			payments=payments,
+			invoices=invoices,
+			sample=sample,
+			seed=seed,
+		)
+	finally:
+		frappe.destroy()
+
+	results = json.dumps(results, indent=1)
+	if output:
+		with open(output, "w") as f:
+			f.write(results)
+	else:
+		click.echo(results)
+
+
+@click.command("banking-index-report")
+@click.option("--create", is_flag=True, help="Create the missing indexes.")
+@pass_context
+def index_report(context, create):
+	"""Report the indexes of the matching queries and the rows scanned without them."""
+	from banking.indexes import create_indexes, get_index_report
+
+	frappe.init(site=get_site(context))
+	frappe.connect()
+	try:
+		if create:
+			create_indexes()
+		report = get_index_report()
+	finally:
+		frappe.destroy()
+
+	for row in report:
+		click.echo(
+			f"{row['status']:<15}{row['doctype']:<25}{row['index']:<30}"
+			f"{row['estimated_rows'] or '':>12}  ({', '.join(row['fields'])})"
+		)
+
+	if any(row["status"] == "Missing" for row in report):
+		click.echo("Run with --create or `bench migrate` to create the missing indexes.")
+
+
+@click.command("banking-replay-ebics-downloads")
+@click.argument("ebics_user")
+@click.option("--from-date", help="Only documents downloaded on or after this date.")
+@click.option("--to-date", help="Only documents downloaded on or before this date.")
+@pass_context
+def replay_ebics_downloads(context, ebics_user, from_date, to_date):
+	"""Create Bank Transactions from the archived EBICS downloads of an EBICS User."""
+	from banking.ebics.utils import replay_ebics_downloads
+
+	frappe.init(site=get_site(context))
+	frappe.connect()
+	try:
+		transactions = replay_ebics_downloads(ebics_user, from_date, to_date)
+		frappe.db.commit()
+	finally:
+		frappe.destroy()
+
+	click.echo(f"Processed {transactions} new transactions.")
+
+
+commands = [benchmark_reconciliation, index_report, replay_ebics_downloads]
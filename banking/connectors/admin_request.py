@@ -1,9 +1,20 @@
 # Copyright (c) 2023, ALYF GmbH and contributors
 # For license information, please see license.txt
+import gzip
 import json
 from typing import Dict, Optional
+
+import frappe
 import requests
 
+from banking.connectors.rate_limit import RateLimiter, get_retry_after
+
+# Request bodies smaller than this are not worth compressing
+COMPRESSION_MIN_SIZE = 1024
+
+THROTTLE_STATUS_CODES = (429, 503)
+MAX_RETRIES = 3
+
 
 class AdminRequest:
 	def __init__(
@@ -14,6 +25,7 @@ class AdminRequest:
 		url: str,
 		customer_id: str,
 		use_test_environment: bool,
+		compress_requests: bool = False,
 	) -> None:
 		self.ip_address = ip_address
 		self.user_agent = user_agent
@@ -21,10 +33,14 @@ class AdminRequest:
 		self.url = url
 		self.customer_id = customer_id
 		self.use_test_environment = use_test_environment
+		self.compress_requests = compress_requests
 
 	@property
 	def headers(self):
-		return {"Alyf-Banking-Authorization": f"Token {self.api_token}"}
+		return {
+			"Alyf-Banking-Authorization": f"Token {self.api_token}",
+			"Content-Type": "application/json",
+		}
 
 	@property
 	def data(self):
@@ -55,18 +71,14 @@ class AdminRequest:
 		)
 
 		method = "banking_admin.api.get_client_token"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		return self._post(method, data)
 
 	def flow_accounts(self, session_id: str, flow_id: str):
 		data = self.data
 		data.update({"session_id": session_id, "flow_id": flow_id})
 
 		method = "banking_admin.api.fetch_accounts_and_bank"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		return self._post(method, data)
 
 	def flow_transactions(
 		self,
@@ -81,25 +93,22 @@ class AdminRequest:
 		)
 
 		method = "banking_admin.api.fetch_flow_transactions"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		# Streamed, so that transactions can be decoded one by one
+		return self._post(method, data, stream=True)
 
 	def end_session(self, session_id: str):
 		data = self.data
 		data.update({"session_id": session_id})
 
 		method = "banking_admin.api.end_session"
-		requests.post(url=self.url + method, headers=self.headers, data=json.dumps(data))
+		self._post(method, data)
 
 	def consent_accounts(self, consent_id: str, consent_token: str):
 		data = self.data
 		data.update({"consent_id": consent_id, "consent_token": consent_token})
 
 		method = "banking_admin.api.fetch_consent_accounts"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		return self._post(method, data)
 
 	def consent_transactions(
 		self,
@@ -123,15 +132,12 @@ class AdminRequest:
 		)
 
 		method = "banking_admin.api.fetch_consent_transactions"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		# Streamed, so that transactions can be decoded one by one
+		return self._post(method, data, stream=True)
 
 	def fetch_subscription(self):
 		method = "banking_admin.api.fetch_subscription_details"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(self.data)
-		)
+		return self._post(method, self.data)
 
 	def get_customer_portal(self):
 		method = "banking_admin.api.get_customer_portal"
@@ -139,26 +145,74 @@ class AdminRequest:
 
 	def get_fintech_license(self):
 		method = "banking_admin.ebics_api.get_fintech_license"
-		return requests.post(
-			url=self.url + method, headers=self.headers, json=self.data.copy()
-		)
+		return self._post(method, self.data)
 
 	def register_ebics_user(self, host_id: str, partner_id: str, user_id: str):
 		data = self.data
 		data.update({"host_id": host_id, "partner_id": partner_id, "user_id": user_id})
 		method = "banking_admin.ebics_api.register_ebics_user"
-		return requests.post(
-			url=self.url + method,
-			headers=self.headers,
-			json=data,
-		)
+		return self._post(method, data)
 
 	def remove_ebics_user(self, host_id: str, partner_id: str, user_id: str):
 		data = self.data
 		data.update({"host_id": host_id, "partner_id": partner_id, "user_id": user_id})
 		method = "banking_admin.ebics_api.remove_ebics_user"
-		return requests.post(
-			url=self.url + method,
-			headers=self.headers,
-			json=data,
-		)
+		return self._post(method, data)
+
+	def _post(self, method: str, data: Dict, stream: bool = False) -> requests.Response:
+		"""POST `data` as JSON to the Admin API `method`.
+
+		The response body may be compressed by the server (gzip/deflate). The request
+		body is gzipped, too, if enabled via `banking_compress_requests` in the site
+		config (the server needs to support it).
+
+		Calls are rate limited per customer and method, see `RateLimiter`. Throttled
+		calls (429/503) are retried up to `MAX_RETRIES` times.
+		"""
+		headers = self.headers
+		body = json.dumps(data).encode()
+		raw_size = len(body)
+		if self.compress_requests and raw_size >= COMPRESSION_MIN_SIZE:
+			body = gzip.compress(body)
+			headers["Content-Encoding"] = "gzip"
+
+		rate_limiter = RateLimiter(self.customer_id, method)
+		for attempt in range(MAX_RETRIES + 1):
+			rate_limiter.acquire()
+			response = requests.post(
+				url=self.url + method, headers=headers, data=body, stream=stream
+			)
+			if response.status_code not in THROTTLE_STATUS_CODES:
+				rate_limiter.on_success()
+				break
+
+			# Slow down all workers of this customer, then retry
+			rate_limiter.on_throttle(get_retry_after(response))
+			if attempt < MAX_RETRIES:
+				response.close()
+
+		response.request_size = raw_size
+		if not stream:
+			log_transfer(response)
+
+		return response
+
+
+def log_transfer(response: requests.Response) -> None:
+	"""Log the bytes sent and received by an Admin API call.
+
+	Streamed responses are logged by the caller, after the body has been consumed.
+	"""
+	request = response.request
+	wire_size = response.raw.tell() if hasattr(response.raw, "tell") else None
+	frappe.logger("banking").info(
+		{
+			"method": request.url.rsplit("/", 1)[-1],
+			"status_code": response.status_code,
+			"request_bytes": getattr(response, "request_size", None),
+			"request_bytes_sent": len(request.body or b""),
+			"response_bytes_received": wire_size,
+			"content_encoding": response.headers.get("Content-Encoding"),
+			"elapsed": response.elapsed.total_seconds(),
+		}
+	)
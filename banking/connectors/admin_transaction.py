@@ -1,8 +1,19 @@
 # Copyright (c) 2022, ALYF GmbH and contributors
 # For license information, please see license.txt
-from typing import Dict
+import shutil
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from typing import IO, Dict, Iterator
 
+import ijson
 from frappe.utils import formatdate, today
+from requests import Response
+
+# Path of a single transaction in the response body, in ijson's prefix notation
+TRANSACTION_PREFIX = "message.result.transactions.item"
+
+# Bodies larger than this are spooled to disk instead of memory
+SPOOL_MAX_SIZE = 1024 * 1024
 
 
 class AdminTransaction:
@@ -30,3 +41,90 @@ class AdminTransaction:
 		}
 
 		return payload
+
+
+class StreamedAdminTransaction(AdminTransaction):
+	"""Decode a transactions response incrementally instead of loading it at once.
+
+	`transaction_list` yields one transaction dict at a time, so that memory stays
+	bounded by a single transaction, regardless of the page size. The rest of the
+	response (`message`, `result`, `pagination`) is available once all transactions
+	have been consumed, or right away if the body was spooled (see `from_response`).
+	"""
+
+	def __init__(self, body: IO[bytes], seekable: bool = False) -> None:
+		self.body = body
+		self.message = {}
+		self.result = {}
+		self.pagination = {}
+
+		if seekable:
+			# Read everything but the transactions now, rewind for `transaction_list`
+			for _ in self.parse(build_transactions=False):
+				pass
+			self.body.seek(0)
+
+	@classmethod
+	def from_response(
+		cls, response: Response, spool: bool = False
+	) -> "StreamedAdminTransaction":
+		"""Read the transactions from a `requests` response opened with `stream=True`.
+
+		:param spool: copy the body to a temporary file first, so that the consent token
+		and pagination can be read before the first transaction is processed.
+
+		Error responses are read completely, so that `response.json()` still works
+		after the response has been closed (see `ExceptionHandler`).
+		"""
+		content = None if response.ok else response.content
+		if "application/json" not in response.headers.get("Content-Type", ""):
+			# Same as `to_json`: treat anything else as an empty response
+			return cls(BytesIO(b"{}"), seekable=spool)
+
+		if content is not None:
+			return cls(BytesIO(content or b"{}"), seekable=spool)
+
+		response.raw.decode_content = True
+		if not spool:
+			return cls(response.raw)
+
+		body = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+		shutil.copyfileobj(response.raw, body)
+		body.seek(0)
+		return cls(body, seekable=True)
+
+	@property
+	def transaction_list(self) -> Iterator[Dict]:
+		return self.parse()
+
+	@property
+	def consent_token(self):
+		return self.message.get("consent_token")
+
+	def parse(self, build_transactions: bool = True) -> Iterator[Dict]:
+		"""Yield the transactions of the body and collect everything else."""
+		rest = ijson.ObjectBuilder()
+		transaction = None
+
+		for prefix, event, value in ijson.parse(self.body, use_float=True):
+			if prefix != TRANSACTION_PREFIX and not prefix.startswith(
+				TRANSACTION_PREFIX + "."
+			):
+				rest.event(event, value)
+				continue
+
+			if not build_transactions:
+				continue
+
+			if transaction is None:
+				transaction = ijson.ObjectBuilder()
+
+			transaction.event(event, value)
+			if prefix == TRANSACTION_PREFIX and event == "end_map":
+				yield transaction.value
+				transaction = None
+
+		self.message = rest.value.get("message") or {}
+		self.result = self.message.get("result") or {}
+		self.pagination = self.result.get("pagination") or {}
+
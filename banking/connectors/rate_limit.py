@@ -0,0 +1,139 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+import time
+from email.utils import parsedate_to_datetime
+
+import frappe
+from requests import Response
+
+# Requests per second and burst size per customer and Admin API method. The rate
+# is halved whenever the backend throttles us and slowly recovers afterwards.
+MAX_RATE = 10.0
+MIN_RATE = 0.2
+RATE_INCREASE = 0.5
+BURST = 10
+
+# Don't wait longer than this for a token, let the backend decide instead
+MAX_WAIT = 60
+
+# Used if the backend throttles us without a `Retry-After` header
+DEFAULT_RETRY_AFTER = 5
+
+BUCKET_TTL = 60 * 60
+
+# Take a token, or return how many seconds to wait for the next one.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at", "rate", "blocked_until")
+local rate = tonumber(bucket[3]) or tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+local blocked_until = tonumber(bucket[4]) or 0
+
+if blocked_until > now then
+	return tostring(blocked_until - now)
+end
+
+tokens = math.min(burst, tokens + (now - updated_at) * rate)
+local wait = 0
+if tokens < 1 then
+	wait = (1 - tokens) / rate
+else
+	tokens = tokens - 1
+end
+
+redis.call("HSET", KEYS[1], "tokens", tokens, "updated_at", now, "rate", rate)
+redis.call("EXPIRE", KEYS[1], ARGV[4])
+return tostring(wait)
+"""
+
+# Additive increase (success) or multiplicative decrease (throttled) of the rate.
+ADAPT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(redis.call("HGET", KEYS[1], "rate")) or tonumber(ARGV[2])
+local retry_after = tonumber(ARGV[5])
+
+if retry_after < 0 then
+	rate = math.min(tonumber(ARGV[2]), rate + tonumber(ARGV[4]))
+	redis.call("HSET", KEYS[1], "rate", rate)
+else
+	rate = math.max(tonumber(ARGV[3]), rate / 2)
+	redis.call("HSET", KEYS[1], "rate", rate, "tokens", 0, "updated_at", now, "blocked_until", now + retry_after)
+end
+
+redis.call("EXPIRE", KEYS[1], ARGV[6])
+return tostring(rate)
+"""
+
+
+class RateLimiter:
+	"""Token bucket in Redis, shared by all workers and sites of an Admin customer.
+
+	The rate adapts to the backend (AIMD): it is halved and the bucket is blocked
+	for `Retry-After` seconds on 429/503 responses, and grows by `RATE_INCREASE`
+	with every successful call.
+	"""
+
+	def __init__(self, customer_id: str, method: str) -> None:
+		self.cache = frappe.cache()
+		self.key = self.cache.make_key(
+			f"banking_rate_limit|{customer_id}|{method}", shared=True
+		)
+		self.max_rate = float(frappe.conf.get("banking_rate_limit") or MAX_RATE)
+
+	def acquire(self) -> None:
+		"""Block until a request may be sent (at most `MAX_WAIT` seconds)."""
+		deadline = time.time() + MAX_WAIT
+		while True:
+			now = time.time()
+			wait = float(
+				self.cache.register_script(ACQUIRE_SCRIPT)(
+					keys=[self.key], args=[now, self.max_rate, BURST, BUCKET_TTL]
+				)
+			)
+			if wait <= 0 or now >= deadline:
+				return
+
+			time.sleep(min(wait, deadline - now))
+
+	def on_success(self) -> float:
+		return self.adapt(retry_after=-1)
+
+	def on_throttle(self, retry_after: float) -> float:
+		return self.adapt(retry_after=retry_after)
+
+	def adapt(self, retry_after: float) -> float:
+		"""Update the shared rate and return it."""
+		return float(
+			self.cache.register_script(ADAPT_SCRIPT)(
+				keys=[self.key],
+				args=[
+					time.time(),
+					self.max_rate,
+					MIN_RATE,
+					RATE_INCREASE,
+					retry_after,
+					BUCKET_TTL,
+				],
+			)
+		)
+
+
+def get_retry_after(response: Response) -> float:
+	"""Return the seconds to wait as requested by the `Retry-After` header."""
+	value = response.headers.get("Retry-After")
+	if not value:
+		return DEFAULT_RETRY_AFTER
+
+	try:
+		return max(float(value), 0)
+	except ValueError:
+		pass
+
+	try:
+		retry_at = parsedate_to_datetime(value).timestamp()
+	except (TypeError, ValueError):
+		return DEFAULT_RETRY_AFTER
+
+	return max(retry_at - time.time(), 0)
@@ -0,0 +1,332 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+"""Local stand-in for the Admin backend, for load tests and benchmarks of syncs.
+
+Implements the `banking_admin.api.*` and `banking_admin.ebics_api.*` methods
+used by `AdminRequest` and answers with synthetic, paginated transactions.
+Only depends on the standard library, so it can also be run on its own:
+
+	python -m banking.demo_responses.mock_admin_server --port 8001 --transactions 100000
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+METHOD_PATH = "/api/method/"
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = 1024
+
+API_METHODS = (
+	"banking_admin.api.get_client_token",
+	"banking_admin.api.fetch_accounts_and_bank",
+	"banking_admin.api.fetch_flow_transactions",
+	"banking_admin.api.end_session",
+	"banking_admin.api.fetch_consent_accounts",
+	"banking_admin.api.fetch_consent_transactions",
+	"banking_admin.api.fetch_subscription_details",
+	"banking_admin.api.get_customer_portal",
+	"banking_admin.ebics_api.get_fintech_license",
+	"banking_admin.ebics_api.register_ebics_user",
+	"banking_admin.ebics_api.remove_ebics_user",
+)
+
+
+@dataclass
+class MockAdminConfig:
+	transactions: int = 100
+	"""Number of transactions per account."""
+	page_size: int = 1000
+	"""Transactions per page."""
+	latency: float = 0.0
+	"""Seconds to wait before answering a request."""
+	error_rate: float = 0.0
+	"""Share of requests (0..1) that are throttled with a 503 response."""
+	throttle_requests: Tuple[int, ...] = ()
+	"""Numbers of the requests (counted from 1) that are throttled, in addition."""
+	retry_after: int = 0
+	"""`Retry-After` header of throttled responses, in seconds."""
+	seed: int = 0
+	"""Seed for amounts, types and error injection, for reproducible runs."""
+
+
+@dataclass
+class MockAdminStats:
+	requests: Dict[str, int] = field(default_factory=dict)
+	errors: int = 0
+	bytes_received: int = 0
+	bytes_sent: int = 0
+
+
+class MockAdminServer:
+	"""Threaded HTTP server in a background thread.
+
+	Use as a context manager and point Banking Settings' `admin_endpoint` at `url`:
+
+		with MockAdminServer(MockAdminConfig(transactions=5000)) as server:
+			...
+	"""
+
+	def __init__(
+		self,
+		config: Optional[MockAdminConfig] = None,
+		host: str = "127.0.0.1",
+		port: int = 0,
+	) -> None:
+		self.config = config or MockAdminConfig()
+		self.stats = MockAdminStats()
+		self.lock = threading.Lock()
+		self.random = random.Random(self.config.seed)
+		self.consent_tokens = 0
+
+		self.httpd = ThreadingHTTPServer((host, port), _RequestHandler)
+		self.httpd.daemon_threads = True
+		self.httpd.mock = self
+		self.thread = None
+
+	@property
+	def url(self) -> str:
+		host, port = self.httpd.server_address[:2]
+		return f"http://{host}:{port}"
+
+	def start(self) -> "MockAdminServer":
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self) -> None:
+		self.httpd.shutdown()
+		self.httpd.server_close()
+		if self.thread:
+			self.thread.join()
+
+	def __enter__(self) -> "MockAdminServer":
+		return self.start()
+
+	def __exit__(self, *args) -> None:
+		self.stop()
+
+	def count(self, method: str, received: int) -> bool:
+		"""Record a request and return whether it should be throttled."""
+		with self.lock:
+			self.stats.requests[method] = self.stats.requests.get(method, 0) + 1
+			self.stats.bytes_received += received
+			throttle = self.random.random() < self.config.error_rate
+			throttle = throttle or sum(self.stats.requests.values()) in self.config.throttle_requests
+			self.stats.errors += throttle
+			return throttle
+
+	def next_consent_token(self) -> str:
+		with self.lock:
+			self.consent_tokens += 1
+			return f"mock-consent-token-{self.consent_tokens}"
+
+	# Admin API methods, return the value of "message"
+
+	def get_client_token(self, data: Dict) -> Dict:
+		return {
+			"session_data": {
+				"session_id": "mock-session",
+				"session_id_short": "MOCK" + str(int(time.time() * 1000))[-6:],
+				"consent_scope": {"accounts": {}, "transactions": {}},
+			},
+			"flow_data": {
+				"client_token": "mock-client-token",
+				"flow_id": "mock-flow",
+				"state": "CONSUMER_INPUT_NEEDED",
+			},
+		}
+
+	def fetch_accounts_and_bank(self, data: Dict) -> Dict:
+		return {
+			"state": "FINISHED",
+			"session_state": "Running",
+			"result": {
+				"accounts": [get_account("mock-account")],
+				"bank_data": {
+					"bank_name": "Mockbank",
+					"bank_code": "88888888",
+					"country_code": "DE",
+				},
+				"consent_data": {
+					"consent_id": "mock-consent",
+					"consent_token": self.next_consent_token(),
+				},
+			},
+		}
+
+	def fetch_consent_accounts(self, data: Dict) -> Dict:
+		return {
+			"consent_token": self.next_consent_token(),
+			"result": {"accounts": [get_account("mock-account")]},
+		}
+
+	def fetch_flow_transactions(self, data: Dict) -> Dict:
+		message = self.get_transactions_page("mock-account", data.get("offset"))
+		message.update({"state": "FINISHED", "session_state": "Running"})
+		return message
+
+	def fetch_consent_transactions(self, data: Dict) -> Dict:
+		message = self.get_transactions_page(data.get("account_id"), data.get("offset"))
+		message["consent_token"] = self.next_consent_token()
+		return message
+
+	def end_session(self, data: Dict) -> Dict:
+		return {}
+
+	def fetch_subscription_details(self, data: Dict) -> Dict:
+		return {"plan": "Mock", "usage": {}}
+
+	def get_customer_portal(self, data: Dict) -> str:
+		return "http://localhost/mock-portal"
+
+	def get_fintech_license(self, data: Dict) -> Dict:
+		return {"licensee_name": "Mock Licensee", "license_key": "MOCK-LICENSE-KEY"}
+
+	def register_ebics_user(self, data: Dict) -> Dict:
+		return {}
+
+	def remove_ebics_user(self, data: Dict) -> Dict:
+		return {}
+
+	def get_transactions_page(self, account_id: str, offset: Optional[str]) -> Dict:
+		start = int(offset or 0)
+		end = min(start + self.config.page_size, self.config.transactions)
+		result = {
+			"transactions": [
+				get_transaction(account_id, index, self.config.seed) for index in range(start, end)
+			],
+			"pagination": {},
+		}
+		if end < self.config.transactions:
+			result["pagination"] = {
+				"url": f"mock://transactions/{account_id}",
+				"next": {"offset": str(end)},
+			}
+
+		return {"result": result}
+
+
+def get_account(account_id: str) -> Dict:
+	return {
+		"id": account_id,
+		"alias": "Mock account",
+		"account_number": "000000001234567890",
+		"iban": "DE89370400440532013000",
+		"holder_name": "Max Mustermann",
+		"bic": "TESTDE10XXX",
+		"transfer_type": "FULL",
+		"account_type": "DEFAULT",
+	}
+
+
+def get_transaction(account_id: str, index: int, seed: int = 0) -> Dict:
+	"""Return the synthetic transaction `index` of the account, newest first."""
+	rand = random.Random(f"{seed}-{account_id}-{index}")
+	booking_date = (date.today() - timedelta(days=index // 10)).isoformat()
+	return {
+		"transaction_id": hashlib.md5(f"{account_id}-{index}".encode()).hexdigest(),
+		"reference": f"Invoice {index:08d}, Additional information about the payment",
+		"bank_references": {
+			"unstructured": f"Invoice {index:08d}",
+			"additional_information": "Additional information about the payment",
+			"end_to_end": f"E2E-{index:08d}",
+		},
+		"counter_party": {
+			"holder_name": f"Counter Party {rand.randint(1, 500)}",
+			"iban": "DE18000000006636981175",
+			"account_number": "000000006636981175",
+		},
+		"date": booking_date,
+		"value_date": booking_date,
+		"booking_date": booking_date,
+		"state": "PROCESSED",
+		"type": rand.choice(("CREDIT", "DEBIT")),
+		"method": "TRANSFER",
+		"amount": {"amount": rand.randint(100, 1_000_000), "currency": "EUR"},
+	}
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		self.handle_method()
+
+	def do_POST(self):
+		self.handle_method()
+
+	def handle_method(self):
+		mock: MockAdminServer = self.server.mock
+		body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+		path = self.path.split("?")[0].removeprefix(METHOD_PATH)
+		method = path.rsplit(".", 1)[-1]
+
+		throttle = mock.count(method, len(body))
+		if mock.config.latency:
+			time.sleep(mock.config.latency)
+
+		if path not in API_METHODS:
+			return self.send_json(404, {"exc_type": "DoesNotExistError"})
+
+		if throttle:
+			return self.send_json(
+				503, {"message": {}}, {"Retry-After": str(mock.config.retry_after)}
+			)
+
+		if self.headers.get("Content-Encoding") == "gzip":
+			body = gzip.decompress(body)
+
+		data = json.loads(body) if body else {}
+		self.send_json(200, {"message": getattr(mock, method)(data)})
+
+	def send_json(self, status: int, value: Dict, headers: Optional[Dict] = None):
+		body = json.dumps(value).encode()
+		headers = dict(headers or {})
+		if len(body) >= COMPRESSION_MIN_SIZE and "gzip" in self.headers.get(
+			"Accept-Encoding", ""
+		):
+			body = gzip.compress(body)
+			headers["Content-Encoding"] = "gzip"
+
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		for key, value in headers.items():
+			self.send_header(key, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+		with self.server.mock.lock:
+			self.server.mock.stats.bytes_sent += len(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8001)
+	for name, default in vars(MockAdminConfig()).items():
+		if isinstance(default, tuple):
+			parser.add_argument(f"--{name.replace('_', '-')}", type=int, nargs="*", default=default)
+		else:
+			parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+
+	args = vars(parser.parse_args())
+	server = MockAdminServer(
+		MockAdminConfig(**{key: args[key] for key in vars(MockAdminConfig())}),
+		host=args["host"],
+		port=args["port"],
+	)
+	print(f"Mock Admin backend listening on {server.url}")
+	server.httpd.serve_forever()
@@ -0,0 +1,211 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+"""Historical EBICS syncs, split into monthly windows.
+
+A long date range is requested as one C53 download per window instead of a single
+huge transfer. The windows are distributed over `BACKFILL_CONCURRENCY` jobs, each of
+which syncs its windows one after another, holding a slot of the EBICS host (see
+`HostSemaphore`) per window. A job without a free slot defers its remaining windows
+instead of waiting in the worker.
+
+Every window is recorded as a Bank Sync Run. Windows with a completed run are skipped,
+so a failed backfill can simply be started again. The download of a window is
+confirmed to the bank only after its transactions have been committed.
+"""
+import contextlib
+import time
+from datetime import date
+
+import frappe
+from frappe import _
+from frappe.utils import add_months, cint, date_diff, get_first_day, get_last_day, getdate
+
+from banking.ebics.scheduling import (
+	MAX_WAIT,
+	RETRY_INTERVAL,
+	SYNC_TIMEOUT,
+	HostSemaphore,
+	defer_ebics_sync,
+	get_ebics_queue,
+)
+from banking.klarna_kosma_integration.doctype.bank_sync_run.bank_sync_run import (
+	start_sync_run,
+)
+
+# Number of jobs per backfill. Override with `banking_ebics_backfill_concurrency`.
+BACKFILL_CONCURRENCY = 2
+
+# Date ranges spanning more days than this are synced as a backfill
+BACKFILL_MIN_DAYS = 31
+
+
+def get_windows(start_date: date | str, end_date: date | str) -> list[tuple[date, date]]:
+	"""Split the date range into calendar months, cut to the range."""
+	start_date, end_date = getdate(start_date), getdate(end_date)
+	windows = []
+	window_start = start_date
+	while window_start <= end_date:
+		window_end = min(get_last_day(window_start), end_date)
+		windows.append((window_start, window_end))
+		window_start = get_first_day(add_months(window_start, 1))
+
+	return windows
+
+
+def is_backfill(start_date: date | str | None, end_date: date | str | None) -> bool:
+	"""Return whether the date range spans more than `BACKFILL_MIN_DAYS` days."""
+	if not (start_date and end_date):
+		return False
+
+	return date_diff(end_date, start_date) + 1 > BACKFILL_MIN_DAYS
+
+
+def enqueue_ebics_backfill(
+	ebics_user: str,
+	start_date: date | str,
+	end_date: date | str,
+	passphrase: str | None = None,
+) -> int:
+	"""Enqueue the sync of all windows that are not completed yet. Return their number."""
+	windows = [
+		window
+		for window in get_windows(start_date, end_date)
+		if not is_window_completed(ebics_user, *window)
+	]
+	bank = frappe.db.get_value("EBICS User", ebics_user, "bank")
+	host_id = frappe.db.get_value("Bank", bank, "ebics_host_id")
+	concurrency = (
+		cint(frappe.conf.get("banking_ebics_backfill_concurrency")) or BACKFILL_CONCURRENCY
+	)
+
+	for lane in range(min(concurrency, len(windows))):
+		enqueue_backfill_windows(
+			ebics_user,
+			host_id,
+			# Every job gets every n-th window, so that older windows do not wait for newer ones
+			[(str(start), str(end)) for start, end in windows[lane::concurrency]],
+			passphrase=passphrase,
+		)
+
+	return len(windows)
+
+
+def enqueue_backfill_windows(
+	ebics_user: str,
+	host_id: str,
+	windows: list[tuple[str, str]],
+	passphrase: str | None = None,
+	waiting_since: float | None = None,
+) -> None:
+	frappe.enqueue(
+		"banking.ebics.backfill.run_ebics_backfill",
+		queue=get_ebics_queue(),
+		timeout=len(windows) * SYNC_TIMEOUT,
+		ebics_user=ebics_user,
+		host_id=host_id,
+		windows=windows,
+		passphrase=passphrase,
+		waiting_since=waiting_since,
+	)
+
+
+def run_ebics_backfill(
+	ebics_user: str,
+	host_id: str,
+	windows: list[tuple[str, str]],
+	passphrase: str | None = None,
+	waiting_since: float | None = None,
+) -> None:
+	"""Sync the windows one after another. A failed window does not stop the others.
+
+	Without a free slot for the host, the remaining windows are tried again later. A
+	window that has waited for `MAX_WAIT` seconds fails.
+	"""
+	for index, (start_date, end_date) in enumerate(windows):
+		if is_window_completed(ebics_user, start_date, end_date):
+			# Completed by an earlier backfill in the meantime
+			continue
+
+		waiting_since = waiting_since or time.time()
+		semaphore = HostSemaphore(host_id)
+		if semaphore.acquire():
+			try:
+				sync_window(ebics_user, start_date, end_date, passphrase)
+			finally:
+				semaphore.release()
+		elif time.time() - waiting_since < MAX_WAIT:
+			defer_ebics_sync(
+				RETRY_INTERVAL,
+				backfill=True,
+				ebics_user=ebics_user,
+				host_id=host_id,
+				windows=windows[index:],
+				passphrase=passphrase,
+				waiting_since=waiting_since,
+			)
+			return
+		else:
+			sync_run = start_sync_run(
+				None, start_date, source="EBICS", ebics_user=ebics_user, end_date=end_date
+			)
+			sync_run.fail(
+				_("No free slot for EBICS host {0} within {1} minutes.").format(
+					host_id, MAX_WAIT // 60
+				)
+			)
+			frappe.db.commit()
+
+		waiting_since = None
+
+
+def sync_window(
+	ebics_user: str,
+	start_date: str,
+	end_date: str,
+	passphrase: str | None = None,
+) -> None:
+	from banking.ebics.utils import get_ebics_manager, sync_ebics_transactions
+
+	sync_run = start_sync_run(
+		None, start_date, source="EBICS", ebics_user=ebics_user, end_date=end_date
+	)
+	client = None
+	try:
+		user = frappe.get_doc("EBICS User", ebics_user)
+		client = get_ebics_manager(user, passphrase=passphrase).get_client()
+		transactions = sync_ebics_transactions(
+			ebics_user,
+			start_date=start_date,
+			end_date=end_date,
+			passphrase=passphrase,
+			client=client,
+		)
+		sync_run.db_set("transactions", transactions or 0)
+		sync_run.complete()
+		frappe.db.commit()
+	except Exception:
+		frappe.db.rollback()
+		sync_run.fail(frappe.get_traceback())
+		frappe.db.commit()
+		if client:
+			# Let the bank know that the data was not processed
+			with contextlib.suppress(Exception):
+				client.confirm_download(success=False)
+		return
+	else:
+		client.confirm_download(success=True)
+
+
+def is_window_completed(ebics_user: str, start_date: date | str, end_date: date | str) -> bool:
+	return bool(
+		frappe.db.exists(
+			"Bank Sync Run",
+			{
+				"source": "EBICS",
+				"ebics_user": ebics_user,
+				"start_date": getdate(start_date),
+				"end_date": getdate(end_date),
+				"status": "Completed",
+			},
+		)
+	)
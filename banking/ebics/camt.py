@@ -0,0 +1,274 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+"""Normalized transactions of camt.052 and camt.053 documents.
+
+Small documents, and documents with camt.054 details for batch bookings, are
+parsed by fintech's CAMTDocument. Larger ones are parsed incrementally with
+`iterparse`: each entry is converted to a `CAMTTransaction` as soon as it has
+been read and then removed from the tree, so memory does not grow with the
+size of the statement.
+"""
+import io
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+from itertools import groupby
+from typing import TYPE_CHECKING, Iterator, Optional
+
+import frappe
+
+if TYPE_CHECKING:
+	from fintech.sepa import CAMTDocument, SEPATransaction
+
+# Documents from this size on (in bytes) are parsed incrementally.
+# Override with `banking_camt_streaming_min_size` in site config.
+STREAMING_MIN_SIZE = 5 * 1024 * 1024
+
+# Elements that contain the entries of one account
+STATEMENT_TAGS = ("Stmt", "Rpt", "Ntfctn")
+
+
+@dataclass
+class CAMTTransaction:
+	"""A booking (camt `Ntry`) or one sub-transaction of a batch booking."""
+
+	date: date
+	amount: Decimal
+	"""Signed, negative for debits."""
+	currency: str
+	transaction_id: Optional[str] = None
+	status: Optional[str] = None
+	purpose: list[str] = field(default_factory=list)
+	eref: Optional[str] = None
+	iban: Optional[str] = None
+	"""IBAN of the counterparty."""
+	name: Optional[str] = None
+	"""Name of the counterparty."""
+	batch: bool = False
+	sub_transactions: list["CAMTTransaction"] = field(default_factory=list)
+
+	@classmethod
+	def from_sepa_transaction(
+		cls,
+		sepa_transaction: "SEPATransaction",
+		with_sub_transactions: bool = True,
+		is_sub_transaction: bool = False,
+	) -> "CAMTTransaction":
+		"""Normalize a transaction of fintech's CAMTDocument."""
+		# sepa_transaction.bank_reference can be None, but we can still find an ID in the XML
+		# For our test bank, the latter is a timestamp with nanosecond accuracy.
+		transaction_id = (
+			sepa_transaction.bank_reference or sepa_transaction._xmlobj.Refs.TxId.text
+		)
+
+		name = sepa_transaction.name
+		if is_sub_transaction and not name:
+			# Temporary workaround to parse the party name from camt.052.001.08
+			# Can be removed once it's supported by the fintech library
+			name = (
+				sepa_transaction._xmlobj.RltdPties.Dbtr.Pty.Nm._text
+				if sepa_transaction._xmlobj.CdtDbtInd._text == "CRDT"
+				else sepa_transaction._xmlobj.RltdPties.Cdtr.Pty.Nm._text
+			)
+
+		return cls(
+			date=sepa_transaction.date,
+			amount=Decimal(str(sepa_transaction.amount.value)),
+			currency=sepa_transaction.amount.currency,
+			transaction_id=transaction_id,
+			status=sepa_transaction.status,
+			purpose=list(sepa_transaction.purpose),
+			eref=sepa_transaction.eref,
+			iban=sepa_transaction.iban,
+			name=name,
+			batch=bool(sepa_transaction.batch),
+			sub_transactions=(
+				[
+					cls.from_sepa_transaction(sub_transaction, is_sub_transaction=True)
+					for sub_transaction in sepa_transaction
+				]
+				if sepa_transaction.batch and with_sub_transactions and not is_sub_transaction
+				else []
+			),
+		)
+
+
+@dataclass(eq=False)
+class CAMTStatement:
+	"""The entries of one account, read incrementally.
+
+	Has the attributes of fintech's CAMTDocument that the sync uses. The transactions
+	have to be iterated before advancing to the next statement. Compared by identity,
+	so that consecutive statements with the same attributes are not merged.
+	"""
+
+	iban: Optional[str] = None
+	currency: Optional[str] = None
+	date_from: Optional[date] = None
+	date_to: Optional[date] = None
+	transactions: Iterator[CAMTTransaction] = field(default_factory=lambda: iter(()))
+
+	def __iter__(self) -> Iterator[CAMTTransaction]:
+		return self.transactions
+
+
+def parse_camt(
+	xml: bytes | str, camt54: dict | None = None
+) -> "Iterator[CAMTDocument | CAMTStatement]":
+	"""Yield the parsed document, or its statements if it is parsed incrementally."""
+	min_size = frappe.conf.get("banking_camt_streaming_min_size") or STREAMING_MIN_SIZE
+	if camt54 or len(xml) < min_size:
+		from fintech.sepa import CAMTDocument
+
+		yield CAMTDocument(xml=xml, camt54=camt54)
+		return
+
+	yield from iter_statements(io.BytesIO(xml.encode() if isinstance(xml, str) else xml))
+
+
+def get_batch_dates(xml: bytes | str) -> set[date]:
+	"""Return the booking dates of the document's batch bookings."""
+	return {
+		transaction.date
+		for _statement, transaction in _iter_entries(
+			io.BytesIO(xml.encode() if isinstance(xml, str) else xml)
+		)
+		if transaction.batch
+	}
+
+
+def iter_statements(source) -> Iterator[CAMTStatement]:
+	"""Parse a camt.052 or camt.053 file (path or file object) incrementally."""
+	for statement, entries in groupby(_iter_entries(source), key=lambda entry: entry[0]):
+		statement.transactions = (transaction for _statement, transaction in entries)
+		yield statement
+
+
+def _iter_entries(source) -> Iterator[tuple[CAMTStatement, CAMTTransaction]]:
+	statement, stack = None, []
+	for event, element in ET.iterparse(source, events=("start", "end")):
+		tag = _local_name(element.tag)
+		if event == "start":
+			stack.append(element)
+			if tag in STATEMENT_TAGS:
+				statement = CAMTStatement()
+			continue
+
+		stack.pop()
+		if statement is None:
+			continue
+
+		parent = stack[-1] if stack else None
+		in_statement = parent is not None and _local_name(parent.tag) in STATEMENT_TAGS
+		if tag == "Acct" and in_statement:
+			statement.iban = _text(element, "Id/IBAN")
+			statement.currency = _text(element, "Ccy")
+		elif tag == "FrToDt" and in_statement:
+			statement.date_from = _date(_text(element, "FrDtTm"))
+			statement.date_to = _date(_text(element, "ToDtTm"))
+		elif tag == "Ntry" and in_statement:
+			yield statement, _parse_entry(element)
+			parent.remove(element)
+		elif tag in STATEMENT_TAGS:
+			statement = None
+			if parent is not None:
+				parent.remove(element)
+
+
+def _parse_entry(entry: ET.Element) -> CAMTTransaction:
+	indicator = _text(entry, "CdtDbtInd")
+	amount = entry.find(_path("Amt"))
+	details = entry.findall(_path("NtryDtls/TxDtls"))
+	bank_reference = _text(entry, "AcctSvcrRef")
+	batch = len(details) > 1 or entry.find(_path("NtryDtls/Btch")) is not None
+
+	transaction = CAMTTransaction(
+		date=_date(_text(entry, "BookgDt/Dt") or _text(entry, "BookgDt/DtTm")),
+		amount=_signed(amount.text, indicator),
+		currency=amount.get("Ccy"),
+		transaction_id=bank_reference,
+		# camt.052/053.001.02: <Sts>BOOK</Sts>, later versions: <Sts><Cd>BOOK</Cd></Sts>
+		status=_text(entry, "Sts/Cd") or _text(entry, "Sts"),
+		batch=batch,
+	)
+
+	if batch:
+		transaction.sub_transactions = [
+			_parse_details(tx_details, transaction, indicator) for tx_details in details
+		]
+	elif details:
+		_update_from_details(transaction, details[0], indicator)
+		transaction.transaction_id = bank_reference or _text(details[0], "Refs/TxId")
+
+	if not transaction.purpose and (info := _text(entry, "AddtlNtryInf")):
+		transaction.purpose = [info]
+
+	return transaction
+
+
+def _parse_details(
+	tx_details: ET.Element, entry: CAMTTransaction, entry_indicator: str
+) -> CAMTTransaction:
+	"""Return the sub-transaction of a batch booking."""
+	indicator = _text(tx_details, "CdtDbtInd") or entry_indicator
+	amount = tx_details.find(_path("AmtDtls/TxAmt/Amt"))
+	if amount is None:
+		amount = tx_details.find(_path("Amt"))
+
+	transaction = CAMTTransaction(
+		date=entry.date,
+		amount=_signed(amount.text, indicator) if amount is not None else entry.amount,
+		currency=amount.get("Ccy") if amount is not None else entry.currency,
+		transaction_id=_text(tx_details, "Refs/AcctSvcrRef") or _text(tx_details, "Refs/TxId"),
+		status=entry.status,
+	)
+	_update_from_details(transaction, tx_details, indicator)
+	return transaction
+
+
+def _update_from_details(
+	transaction: CAMTTransaction, tx_details: ET.Element, indicator: str
+) -> None:
+	"""Set reference, purpose and counterparty from `TxDtls`."""
+	# The counterparty is the debtor of a credit and the creditor of a debit
+	party = "Dbtr" if indicator == "CRDT" else "Cdtr"
+
+	transaction.eref = _text(tx_details, "Refs/EndToEndId")
+	transaction.iban = _text(tx_details, f"RltdPties/{party}Acct/Id/IBAN")
+	transaction.name = _text(tx_details, f"RltdPties/{party}/Nm") or _text(
+		tx_details, f"RltdPties/{party}/Pty/Nm"
+	)
+	transaction.purpose = [
+		element.text.strip()
+		for element in tx_details.findall(_path("RmtInf/Ustrd"))
+		if element.text and element.text.strip()
+	]
+	if not transaction.purpose and (info := _text(tx_details, "AddtlTxInf")):
+		transaction.purpose = [info]
+
+
+def _local_name(tag: str) -> str:
+	return tag.rsplit("}", 1)[-1]
+
+
+def _path(path: str) -> str:
+	"""Match the path in any namespace."""
+	return "/".join(f"{{*}}{tag}" for tag in path.split("/"))
+
+
+def _text(element: ET.Element, path: str) -> Optional[str]:
+	child = element.find(_path(path))
+	if child is None or child.text is None:
+		return None
+
+	return child.text.strip() or None
+
+
+def _date(value: Optional[str]) -> Optional[date]:
+	return date.fromisoformat(value[:10]) if value else None
+
+
+def _signed(amount: str, indicator: str) -> Decimal:
+	value = Decimal(amount.strip())
+	return -value if indicator == "DBIT" else value
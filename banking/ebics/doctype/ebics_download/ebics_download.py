@@ -0,0 +1,148 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+import gzip
+import hashlib
+import re
+from typing import TYPE_CHECKING
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_days, getdate, now_datetime
+
+if TYPE_CHECKING:
+	from datetime import date
+	from typing import Iterator
+
+# The first MsgId of a camt document is the one of its group header
+MESSAGE_ID = re.compile(rb"<(?:\w+:)?MsgId>([^<]*)</")
+
+
+class EBICSDownload(Document):
+	"""A raw document downloaded via EBICS, stored before it is parsed."""
+
+	def get_xml(self) -> bytes:
+		file = frappe.get_doc("File", {"file_url": self.file, "attached_to_name": self.name})
+		return gzip.decompress(file.get_content())
+
+	def get_transfer_ids(self) -> list[str]:
+		"""Return the IDs of all transfers that contained the document, first one first."""
+		return [self.transfer_id, *(row.transfer_id for row in self.transfers)]
+
+	def link_transfer(self, transfer_id: str) -> None:
+		"""Record that the document was downloaded again in another transfer."""
+		if transfer_id in self.get_transfer_ids():
+			return
+
+		self.append("transfers", {"transfer_id": transfer_id, "downloaded_at": now_datetime()})
+		self.save(ignore_permissions=True)
+
+
+def archive_documents(
+	ebics_user: str,
+	order_type: str,
+	documents: dict,
+	transfer_id: str,
+	start_date: "date | str | None" = None,
+	end_date: "date | str | None" = None,
+) -> None:
+	"""Store the documents of an EBICS download. Documents that have been archived before
+	are linked to the transfer instead, so that they stay paired with its camt.054.
+
+	Commits, so that the documents are archived before the download is confirmed.
+	"""
+	for document_name, xml in documents.items():
+		if isinstance(xml, str):
+			xml = xml.encode()
+
+		content_hash = hashlib.sha256(xml).hexdigest()
+		if frappe.db.exists("EBICS Download", content_hash):
+			frappe.get_doc("EBICS Download", content_hash).link_transfer(transfer_id)
+			continue
+
+		compressed = gzip.compress(xml)
+		message_id = MESSAGE_ID.search(xml)
+		download = frappe.get_doc(
+			{
+				"doctype": "EBICS Download",
+				"content_hash": content_hash,
+				"ebics_user": ebics_user,
+				"order_type": order_type,
+				"transfer_id": transfer_id,
+				"start_date": start_date,
+				"end_date": end_date,
+				"downloaded_at": now_datetime(),
+				"document_name": document_name,
+				"message_id": message_id.group(1).decode() if message_id else None,
+				"size": len(xml),
+				"compressed_size": len(compressed),
+			}
+		).insert(ignore_permissions=True)
+
+		file = frappe.get_doc(
+			{
+				"doctype": "File",
+				"file_name": f"{content_hash}.xml.gz",
+				"attached_to_doctype": "EBICS Download",
+				"attached_to_name": download.name,
+				"is_private": 1,
+				"content": compressed,
+			}
+		).save(ignore_permissions=True)
+		download.db_set("file", file.file_url)
+
+	frappe.db.commit()
+
+
+def get_archived_documents(
+	ebics_user: str,
+	downloaded_from: "date | str | None" = None,
+	downloaded_to: "date | str | None" = None,
+) -> "Iterator[tuple[EBICSDownload, dict[str, bytes]]]":
+	"""Yield the archived C52 and C53 documents of the EBICS User, oldest first.
+
+	Each document comes with the C54 documents of the same transfers, by document name.
+	"""
+	filters = [
+		["ebics_user", "=", ebics_user],
+		["order_type", "in", ("C52", "C53")],
+	]
+	if downloaded_from:
+		filters.append(["downloaded_at", ">=", getdate(downloaded_from)])
+	if downloaded_to:
+		filters.append(["downloaded_at", "<", add_days(getdate(downloaded_to), 1)])
+
+	camt54_by_transfer = {}
+	for name in frappe.get_all(
+		"EBICS Download", filters=filters, pluck="name", order_by="downloaded_at asc"
+	):
+		download = frappe.get_doc("EBICS Download", name)
+		camt54 = {}
+		for transfer_id in download.get_transfer_ids():
+			if transfer_id not in camt54_by_transfer:
+				camt54_by_transfer[transfer_id] = get_camt54_documents(transfer_id)
+
+			camt54.update(camt54_by_transfer[transfer_id])
+
+		yield download, camt54
+
+
+def get_camt54_documents(transfer_id: str) -> dict[str, bytes]:
+	"""Return the C54 documents of the transfer, including ones archived in earlier ones."""
+	names = frappe.get_all(
+		"EBICS Download",
+		filters={"transfer_id": transfer_id, "order_type": "C54"},
+		pluck="name",
+	)
+	names += frappe.get_all(
+		"EBICS Download",
+		filters=[
+			["order_type", "=", "C54"],
+			["EBICS Download Transfer", "transfer_id", "=", transfer_id],
+		],
+		pluck="name",
+		distinct=True,
+	)
+	return {
+		download.document_name: download.get_xml()
+		for download in (frappe.get_doc("EBICS Download", name) for name in names)
+	}
@@ -0,0 +1,67 @@
+# Copyright (c) 2025, ALYF GmbH and Contributors
+# See license.txt
+
+import hashlib
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from banking.ebics.doctype.ebics_download.ebics_download import (
+	archive_documents,
+	get_camt54_documents,
+)
+
+CAMT_053 = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.08">
+	<BkToCstmrStmt>
+		<GrpHdr><MsgId>MSG-TEST-0001</MsgId></GrpHdr>
+		<Stmt><Id>STMT-1</Id></Stmt>
+	</BkToCstmrStmt>
+</Document>
+"""
+
+
+class TestEBICSDownload(FrappeTestCase):
+	def setUp(self):
+		# Archiving commits, keep the test data in the test's transaction
+		commit = patch.object(frappe.db, "commit")
+		commit.start()
+		self.addCleanup(commit.stop)
+
+	def test_archive_documents(self):
+		camt_053 = CAMT_053
+		camt_054 = camt_053.replace(b"camt.053", b"camt.054")
+		other_camt_053 = camt_053.replace(b"STMT-1", b"STMT-2")
+		self.addCleanup(delete_downloads, camt_053, camt_054, other_camt_053)
+
+		transfer_id = "TRANSFER-1"
+		archive_documents(None, "C53", {"statement.xml": camt_053}, transfer_id)
+		archive_documents(None, "C54", {"notification.xml": camt_054.decode()}, transfer_id)
+
+		# Archived only once, but linked to the later transfer
+		later_transfer_id = "TRANSFER-2"
+		archive_documents(None, "C53", {"again.xml": camt_053}, later_transfer_id)
+		archive_documents(None, "C53", {"statement.xml": other_camt_053}, later_transfer_id)
+		archive_documents(None, "C54", {"notification.xml": camt_054}, later_transfer_id)
+
+		download = frappe.get_doc("EBICS Download", hashlib.sha256(camt_053).hexdigest())
+		self.assertEqual(download.transfer_id, transfer_id)
+		self.assertEqual(download.document_name, "statement.xml")
+		self.assertEqual(download.message_id, "MSG-TEST-0001")
+		self.assertEqual(download.size, len(camt_053))
+		self.assertEqual(download.get_xml(), camt_053)
+		self.assertEqual(download.get_transfer_ids(), [transfer_id, later_transfer_id])
+
+		self.assertEqual(get_camt54_documents(transfer_id), {"notification.xml": camt_054})
+		self.assertEqual(
+			get_camt54_documents(later_transfer_id), {"notification.xml": camt_054}
+		)
+
+
+def delete_downloads(*documents: bytes) -> None:
+	"""Delete the archived documents, including their files on disk."""
+	for xml in documents:
+		frappe.delete_doc(
+			"EBICS Download", hashlib.sha256(xml).hexdigest(), force=True, ignore_missing=True
+		)
@@ -8,6 +8,7 @@ from frappe.model.document import Document
 from frappe.utils import get_link_to_form
 from frappe.utils.data import getdate
 
+from banking.ebics.backfill import enqueue_ebics_backfill, is_backfill
 from banking.ebics.utils import get_ebics_manager, sync_ebics_transactions
 from banking.klarna_kosma_integration.admin import Admin
 from requests import HTTPError
@@ -189,6 +190,11 @@ def download_bank_statements(
 	user = frappe.get_doc("EBICS User", ebics_user)
 	user.check_permission("read")
 
+	if is_backfill(from_date, to_date):
+		# Historical sync, one download per month
+		enqueue_ebics_backfill(ebics_user, from_date, to_date, passphrase=passphrase)
+		return
+
 	frappe.enqueue(
 		sync_ebics_transactions,
 		ebics_user=ebics_user,
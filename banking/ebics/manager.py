@@ -10,6 +10,30 @@ if TYPE_CHECKING:
 		EbicsClient,
 		CAMTDocument,
 	)
+	from banking.ebics.camt import CAMTStatement
+
+
+_license_registered = False
+
+
+def register_license(license_name: str, license_key: str) -> None:
+	"""Register the fintech license, which can be done only once per process."""
+	global _license_registered
+
+	try:
+		fintech.register(
+			name=license_name,
+			keycode=license_key,
+		)
+	except RuntimeError as e:
+		if e.args[0] != "'register' can be called only once":
+			raise e
+
+	_license_registered = True
+
+
+def is_license_registered() -> bool:
+	return _license_registered
 
 
 class EBICSManager:
@@ -17,17 +41,11 @@ class EBICSManager:
 
 	def __init__(
 		self,
-		license_name: str,
-		license_key: str,
+		license_name: str | None = None,
+		license_key: str | None = None,
 	):
-		try:
-			fintech.register(
-				name=license_name,
-				keycode=license_key,
-			)
-		except RuntimeError as e:
-			if e.args[0] != "'register' can be called only once":
-				raise e
+		if license_key and not is_license_registered():
+			register_license(license_name, license_key)
 
 	def set_keyring(
 		self, keys: dict, save_to_db: "Callable", sig_passphrase: str, passphrase: str | None
@@ -118,27 +136,60 @@ class EBICSManager:
 		start_date: str | None = None,
 		end_date: str | None = None,
 		with_c54: bool = False,
-	) -> "Iterator[CAMTDocument]":
-		"""Yield an iterator over CAMTDocument objects for the given date range."""
-		from fintech.sepa import CAMTDocument
-
-		client = self.get_client()
+		on_download: "Callable[[str, dict], None] | None" = None,
+		client: "EbicsClient | None" = None,
+	) -> "Iterator[CAMTDocument | CAMTStatement]":
+		"""Yield an iterator over CAMTDocument objects for the given date range.
+
+		Large documents are parsed incrementally and yield CAMTStatement objects instead.
+		`on_download` is called with the order type and the raw documents (by name)
+		before they are parsed.
+		Downloads of a `client` passed by the caller are not confirmed, the caller has
+		to call `client.confirm_download()` once the transactions are saved.
+		"""
+		from banking.ebics.camt import get_batch_dates, parse_camt
+
+		confirm = client is None
+		client = client or self.get_client()
 
 		try:
 			camt53 = client.C53(start_date, end_date)
 		except fintech.ebics.EbicsNoDataAvailable:
 			return
 
-		camt54 = client.C54(start_date, end_date) if with_c54 else None
+		camt54 = None
+		if with_c54:
+			# Request camt.054 only for the days with batch bookings, if there are any
+			batch_dates = sorted(
+				{batch_date for xml in camt53.values() for batch_date in get_batch_dates(xml)}
+			)
+			if batch_dates:
+				try:
+					camt54 = client.C54(batch_dates[0], batch_dates[-1])
+				except fintech.ebics.EbicsNoDataAvailable:
+					pass
+
+		if on_download:
+			on_download("C53", camt53)
+			if camt54:
+				on_download("C54", camt54)
 
 		for name in sorted(camt53):
-			yield CAMTDocument(xml=camt53[name], camt54=camt54)
+			yield from parse_camt(camt53[name], camt54=camt54)
 
-		client.confirm_download(success=True)
+		if confirm:
+			client.confirm_download(success=True)
 
-	def download_intraday_transactions(self) -> "Iterator[CAMTDocument]":
-		"""Yield an iterator over CAMTDocument objects."""
-		from fintech.sepa import CAMTDocument
+	def download_intraday_transactions(
+		self, on_download: "Callable[[str, dict], None] | None" = None
+	) -> "Iterator[CAMTDocument | CAMTStatement]":
+		"""Yield an iterator over CAMTDocument objects.
+
+		Large documents are parsed incrementally and yield CAMTStatement objects instead.
+		`on_download` is called with the order type and the raw documents (by name)
+		before they are parsed.
+		"""
+		from banking.ebics.camt import parse_camt
 
 		client = self.get_client()
 
@@ -147,7 +198,10 @@ class EBICSManager:
 		except fintech.ebics.EbicsNoDataAvailable:
 			return
 
+		if on_download:
+			on_download("C52", camt52)
+
 		for name in sorted(camt52):
-			yield CAMTDocument(xml=camt52[name])
+			yield from parse_camt(camt52[name])
 
 		client.confirm_download(success=True)
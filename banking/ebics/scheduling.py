@@ -0,0 +1,222 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+"""Scheduled EBICS syncs of all users, with a limited number of concurrent syncs per bank.
+
+Syncs run on the "ebics" queue if the bench has workers for it (`workers` in
+common_site_config.json), else on "long".
+Each EBICS host (`ebics_host_id` of the Bank) allows `HOST_CONCURRENCY` concurrent
+syncs across all workers and sites. A sync (or backfill, see `banking.ebics.backfill`)
+without a free slot does not wait in the worker, it is deferred and enqueued again by
+`enqueue_deferred_ebics_syncs`, which runs every minute. Every scheduled sync is recorded as a Bank Sync Run.
+"""
+import json
+import time
+from collections import defaultdict
+from itertools import zip_longest
+from typing import Iterator
+
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+from banking.klarna_kosma_integration.doctype.bank_sync_run.bank_sync_run import (
+	start_sync_run,
+)
+
+EBICS_QUEUE = "ebics"
+FALLBACK_QUEUE = "long"
+
+# Concurrent syncs per EBICS host. Override with `banking_ebics_host_concurrency`.
+HOST_CONCURRENCY = 2
+
+# Slots of killed workers are released after this many seconds
+SLOT_TTL = 60 * 60
+
+# Wait at most this long for a free slot, polling every `POLL_INTERVAL` seconds
+MAX_WAIT = 30 * 60
+POLL_INTERVAL = 5
+
+# Job timeout of a scheduled sync, shorter than `SLOT_TTL`
+SYNC_TIMEOUT = 30 * 60
+
+# A scheduled sync without a free slot is tried again after this many seconds
+RETRY_INTERVAL = 60
+
+# Take a slot, unless `limit` slots are taken. Expired slots are removed first.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now - tonumber(ARGV[3]))
+if redis.call("ZCARD", KEYS[1]) >= tonumber(ARGV[2]) then
+	return 0
+end
+
+redis.call("ZADD", KEYS[1], now, ARGV[4])
+redis.call("EXPIRE", KEYS[1], ARGV[3])
+return 1
+"""
+
+RELEASE_SCRIPT = """
+return redis.call("ZREM", KEYS[1], ARGV[1])
+"""
+
+
+class HostSemaphore:
+	"""Counting semaphore in Redis, shared by all workers and sites that sync with a host."""
+
+	def __init__(self, host_id: str) -> None:
+		self.cache = frappe.cache()
+		self.key = self.cache.make_key(f"banking_ebics_host|{host_id}", shared=True)
+		self.limit = cint(frappe.conf.get("banking_ebics_host_concurrency")) or HOST_CONCURRENCY
+		self.token = frappe.generate_hash()
+
+	def acquire(self, timeout: float = 0) -> bool:
+		"""Take a free slot, waiting at most `timeout` seconds for one. Return whether one
+		was taken."""
+		deadline = time.time() + timeout
+		while True:
+			acquired = self.cache.register_script(ACQUIRE_SCRIPT)(
+				keys=[self.key], args=[time.time(), self.limit, SLOT_TTL, self.token]
+			)
+			if acquired:
+				return True
+
+			if time.time() >= deadline:
+				return False
+
+			time.sleep(POLL_INTERVAL)
+
+	def release(self) -> None:
+		self.cache.register_script(RELEASE_SCRIPT)(keys=[self.key], args=[self.token])
+
+
+def enqueue_ebics_syncs(intraday: bool = False) -> None:
+	"""Enqueue a sync for every EBICS User that is ready, interleaved by host.
+
+	The syncs are not spread over time here, `HostSemaphore` limits how many run at once.
+	"""
+	filters = {
+		"initialized": 1,
+		"bank_keys_activated": 1,
+		"passphrase": ("is", "set"),
+		"keyring": ("is", "set"),
+	}
+	if intraday:
+		filters["intraday_sync"] = 1
+
+	users_by_host = defaultdict(list)
+	host_ids = {}
+	for user in frappe.get_all("EBICS User", filters=filters, fields=["name", "bank"]):
+		if user.bank not in host_ids:
+			host_ids[user.bank] = frappe.db.get_value("Bank", user.bank, "ebics_host_id")
+
+		users_by_host[host_ids[user.bank]].append(user.name)
+
+	for host_id, ebics_user in interleave(users_by_host):
+		enqueue_ebics_sync(ebics_user, host_id, intraday=intraday)
+
+
+def defer_ebics_sync(delay: float, backfill: bool = False, **kwargs) -> None:
+	"""Enqueue `run_ebics_sync`, or `run_ebics_backfill` if `backfill`, with the kwargs in
+	`delay` seconds (at the next full minute)."""
+	if backfill:
+		kwargs["backfill"] = True
+
+	cache = frappe.cache()
+	cache.zadd(get_deferred_syncs_key(), {json.dumps(kwargs, sort_keys=True): time.time() + delay})
+
+
+def enqueue_deferred_ebics_syncs() -> None:
+	"""Enqueue the deferred syncs that are due."""
+	cache = frappe.cache()
+	key = get_deferred_syncs_key()
+	for member in cache.zrangebyscore(key, "-inf", time.time()):
+		# Not taken by a concurrent call
+		if not cache.zrem(key, member):
+			continue
+
+		kwargs = json.loads(member)
+		if kwargs.pop("backfill", False):
+			from banking.ebics.backfill import enqueue_backfill_windows
+
+			enqueue_backfill_windows(**kwargs)
+		else:
+			enqueue_ebics_sync(**kwargs)
+
+
+def enqueue_ebics_sync(
+	ebics_user: str, host_id: str, intraday: bool = False, waiting_since: float | None = None
+) -> None:
+	frappe.enqueue(
+		"banking.ebics.scheduling.run_ebics_sync",
+		queue=get_ebics_queue(),
+		timeout=SYNC_TIMEOUT,
+		job_id=f"ebics_sync|{frappe.local.site}|{ebics_user}|{int(intraday)}",
+		deduplicate=True,
+		ebics_user=ebics_user,
+		host_id=host_id,
+		intraday=intraday,
+		waiting_since=waiting_since,
+	)
+
+
+def get_deferred_syncs_key() -> str:
+	return frappe.cache().make_key("banking_ebics_deferred_syncs")
+
+
+def interleave(users_by_host: dict) -> Iterator[tuple[str, str]]:
+	"""Yield (host_id, user) pairs round robin over the hosts, so that no host has to
+	wait for all users of another one."""
+	per_host = [[(host_id, user) for user in users] for host_id, users in users_by_host.items()]
+	for pairs in zip_longest(*per_host):
+		yield from filter(None, pairs)
+
+
+def run_ebics_sync(
+	ebics_user: str, host_id: str, intraday: bool = False, waiting_since: float | None = None
+):
+	"""Sync the EBICS User if a slot for the host is free, else try again later.
+
+	Recorded as a Bank Sync Run.
+	"""
+	from banking.ebics.utils import sync_ebics_transactions
+
+	waiting_since = waiting_since or time.time()
+	semaphore = HostSemaphore(host_id)
+	if not semaphore.acquire():
+		if time.time() - waiting_since < MAX_WAIT:
+			defer_ebics_sync(
+				RETRY_INTERVAL,
+				ebics_user=ebics_user,
+				host_id=host_id,
+				intraday=intraday,
+				waiting_since=waiting_since,
+			)
+			return
+
+		sync_run = start_sync_run(None, None, source="EBICS", ebics_user=ebics_user)
+		sync_run.fail(
+			_("No free slot for EBICS host {0} within {1} minutes.").format(
+				host_id, MAX_WAIT // 60
+			)
+		)
+		frappe.db.commit()
+		return
+
+	sync_run = start_sync_run(None, None, source="EBICS", ebics_user=ebics_user)
+	try:
+		transactions = sync_ebics_transactions(ebics_user, intraday=intraday)
+		sync_run.db_set("transactions", transactions or 0)
+		sync_run.complete()
+		frappe.db.commit()
+	except Exception:
+		frappe.db.rollback()
+		sync_run.fail(frappe.get_traceback())
+		frappe.db.commit()
+		raise
+	finally:
+		semaphore.release()
+
+
+def get_ebics_queue() -> str:
+	"""Return the dedicated EBICS queue if the bench has workers for it."""
+	return EBICS_QUEUE if EBICS_QUEUE in (frappe.conf.get("workers") or {}) else FALLBACK_QUEUE
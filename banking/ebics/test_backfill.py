@@ -0,0 +1,57 @@
+# Copyright (c) 2025, ALYF GmbH and Contributors
+# See license.txt
+from datetime import date
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from banking.ebics.backfill import get_windows, is_backfill, run_ebics_backfill
+from banking.ebics.scheduling import (
+	HostSemaphore,
+	defer_ebics_sync,
+	enqueue_deferred_ebics_syncs,
+	get_deferred_syncs_key,
+)
+
+
+class TestBackfill(FrappeTestCase):
+	def test_get_windows(self):
+		self.assertEqual(
+			get_windows("2024-12-15", "2025-02-10"),
+			[
+				(date(2024, 12, 15), date(2024, 12, 31)),
+				(date(2025, 1, 1), date(2025, 1, 31)),
+				(date(2025, 2, 1), date(2025, 2, 10)),
+			],
+		)
+		self.assertEqual(
+			get_windows("2025-01-01", "2025-01-01"), [(date(2025, 1, 1), date(2025, 1, 1))]
+		)
+
+	def test_is_backfill(self):
+		self.assertFalse(is_backfill("2025-01-31", "2025-02-01"))
+		self.assertFalse(is_backfill("2025-01-01", "2025-01-31"))
+		self.assertTrue(is_backfill("2025-01-01", "2025-02-01"))
+		self.assertFalse(is_backfill("2024-01-01", None))
+
+	def test_deferred_backfill(self):
+		windows = [["2025-01-01", "2025-01-31"], ["2025-02-01", "2025-02-28"]]
+		with patch.object(HostSemaphore, "acquire", return_value=False), patch(
+			"banking.ebics.backfill.defer_ebics_sync"
+		) as defer:
+			run_ebics_backfill("Backfill User", "TEST", windows)
+
+		# The remaining windows wait for a free slot outside of the worker
+		defer.assert_called_once()
+		self.assertTrue(defer.call_args.kwargs["backfill"])
+		self.assertEqual(defer.call_args.kwargs["windows"], windows)
+
+		self.addCleanup(frappe.cache().delete, get_deferred_syncs_key())
+		with patch("banking.ebics.backfill.enqueue_backfill_windows") as enqueue_backfill_windows:
+			defer_ebics_sync(0, backfill=True, ebics_user="Backfill User", windows=windows)
+			enqueue_deferred_ebics_syncs()
+
+		enqueue_backfill_windows.assert_called_once_with(
+			ebics_user="Backfill User", windows=windows
+		)
@@ -0,0 +1,103 @@
+# Copyright (c) 2025, ALYF GmbH and Contributors
+# See license.txt
+import io
+from datetime import date
+from decimal import Decimal
+
+from frappe.tests.utils import FrappeTestCase
+
+from banking.ebics.camt import get_batch_dates, iter_statements
+
+CAMT_053 = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.08">
+<BkToCstmrStmt>
+	<GrpHdr><MsgId>MSG-1</MsgId></GrpHdr>
+	<Stmt>
+		<Id>STMT-1</Id>
+		<FrToDt>
+			<FrDtTm>2025-01-01T00:00:00.000+01:00</FrDtTm>
+			<ToDtTm>2025-01-31T23:59:59.999+01:00</ToDtTm>
+		</FrToDt>
+		<Acct><Id><IBAN>DE89370400440532013000</IBAN></Id><Ccy>EUR</Ccy></Acct>
+		<Ntry>
+			<Amt Ccy="EUR">100.50</Amt>
+			<CdtDbtInd>CRDT</CdtDbtInd>
+			<Sts><Cd>BOOK</Cd></Sts>
+			<BookgDt><Dt>2025-01-02</Dt></BookgDt>
+			<AcctSvcrRef>REF-1</AcctSvcrRef>
+			<NtryDtls><TxDtls>
+				<Refs><EndToEndId>E2E-1</EndToEndId><TxId>TX-1</TxId></Refs>
+				<RltdPties>
+					<Dbtr><Pty><Nm>Max Mustermann</Nm></Pty></Dbtr>
+					<DbtrAcct><Id><IBAN>DE18000000006636981175</IBAN></Id></DbtrAcct>
+				</RltdPties>
+				<RmtInf><Ustrd>Invoice 1</Ustrd><Ustrd>Thank you</Ustrd></RmtInf>
+			</TxDtls></NtryDtls>
+		</Ntry>
+		<Ntry>
+			<Amt Ccy="EUR">30.00</Amt>
+			<CdtDbtInd>DBIT</CdtDbtInd>
+			<Sts><Cd>BOOK</Cd></Sts>
+			<BookgDt><Dt>2025-01-03</Dt></BookgDt>
+			<NtryDtls>
+				<Btch><NbOfTxs>2</NbOfTxs></Btch>
+				<TxDtls>
+					<Refs><TxId>TX-2</TxId></Refs>
+					<Amt Ccy="EUR">10.00</Amt>
+					<RltdPties><Cdtr><Pty><Nm>Supplier A</Nm></Pty></Cdtr></RltdPties>
+				</TxDtls>
+				<TxDtls>
+					<Refs><TxId>TX-3</TxId></Refs>
+					<Amt Ccy="EUR">20.00</Amt>
+					<RltdPties><Cdtr><Nm>Supplier B</Nm></Cdtr></RltdPties>
+				</TxDtls>
+			</NtryDtls>
+		</Ntry>
+	</Stmt>
+</BkToCstmrStmt>
+</Document>
+"""
+
+
+class TestCAMT(FrappeTestCase):
+	def test_iter_statements(self):
+		statements = []
+		for statement in iter_statements(io.BytesIO(CAMT_053)):
+			statements.append((statement, list(statement)))
+
+		self.assertEqual(len(statements), 1)
+		statement, (credit, batch) = statements[0]
+		self.assertEqual(statement.iban, "DE89370400440532013000")
+		self.assertEqual(statement.date_from, date(2025, 1, 1))
+		self.assertEqual(statement.date_to, date(2025, 1, 31))
+
+		self.assertEqual(credit.date, date(2025, 1, 2))
+		self.assertEqual(credit.amount, Decimal("100.50"))
+		self.assertEqual(credit.status, "BOOK")
+		self.assertEqual(credit.transaction_id, "REF-1")
+		self.assertEqual(credit.eref, "E2E-1")
+		self.assertEqual(credit.name, "Max Mustermann")
+		self.assertEqual(credit.iban, "DE18000000006636981175")
+		self.assertEqual(credit.purpose, ["Invoice 1", "Thank you"])
+		self.assertFalse(credit.batch)
+
+		self.assertTrue(batch.batch)
+		self.assertEqual(batch.amount, Decimal("-30.00"))
+		self.assertEqual(
+			[(sub.transaction_id, sub.amount, sub.name) for sub in batch.sub_transactions],
+			[
+				("TX-2", Decimal("-10.00"), "Supplier A"),
+				("TX-3", Decimal("-20.00"), "Supplier B"),
+			],
+		)
+
+	def test_iter_equal_statements(self):
+		start, end = CAMT_053.index(b"\t<Stmt>"), CAMT_053.index(b"</Stmt>\n") + 8
+		camt_053 = CAMT_053[:end] + CAMT_053[start:end] + CAMT_053[end:]
+
+		statements = [len(list(statement)) for statement in iter_statements(io.BytesIO(camt_053))]
+		self.assertEqual(statements, [2, 2])
+
+	def test_get_batch_dates(self):
+		self.assertEqual(get_batch_dates(CAMT_053), {date(2025, 1, 3)})
+		self.assertEqual(get_batch_dates(CAMT_053.decode()), {date(2025, 1, 3)})
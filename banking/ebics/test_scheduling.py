@@ -0,0 +1,50 @@
+# Copyright (c) 2025, ALYF GmbH and Contributors
+# See license.txt
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from banking.ebics.scheduling import (
+	HostSemaphore,
+	defer_ebics_sync,
+	enqueue_deferred_ebics_syncs,
+	get_deferred_syncs_key,
+	interleave,
+)
+
+
+class TestScheduling(FrappeTestCase):
+	def test_host_semaphore(self):
+		host_id = f"TEST{frappe.generate_hash(length=8)}"
+		semaphores = [HostSemaphore(host_id) for _ in range(3)]
+		for semaphore in semaphores:
+			semaphore.limit = 2
+
+		self.assertTrue(semaphores[0].acquire())
+		self.assertTrue(semaphores[1].acquire())
+		self.assertFalse(semaphores[2].acquire())
+
+		semaphores[0].release()
+		self.assertTrue(semaphores[2].acquire())
+
+		for semaphore in semaphores:
+			semaphore.release()
+
+	def test_deferred_syncs(self):
+		self.addCleanup(frappe.cache().delete, get_deferred_syncs_key())
+
+		with patch("banking.ebics.scheduling.enqueue_ebics_sync") as enqueue_ebics_sync:
+			defer_ebics_sync(0, ebics_user="Due", host_id="TEST")
+			defer_ebics_sync(0, ebics_user="Due", host_id="TEST")
+			defer_ebics_sync(60, ebics_user="Later", host_id="TEST")
+			enqueue_deferred_ebics_syncs()
+			enqueue_deferred_ebics_syncs()
+
+		enqueue_ebics_sync.assert_called_once_with(ebics_user="Due", host_id="TEST")
+
+	def test_interleave(self):
+		self.assertEqual(
+			list(interleave({"A": ["a1", "a2", "a3"], "B": ["b1"]})),
+			[("A", "a1"), ("B", "b1"), ("A", "a2"), ("A", "a3")],
+		)
@@ -0,0 +1,118 @@
+# Copyright (c) 2025, ALYF GmbH and Contributors
+# See license.txt
+from collections import Counter
+from dataclasses import replace
+from datetime import date
+from decimal import Decimal
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from erpnext.accounts.doctype.bank_transaction.test_bank_transaction import (
+	create_gl_account,
+)
+
+from banking.ebics.camt import CAMTStatement, CAMTTransaction
+from banking.ebics.utils import (
+	_create_bank_transaction,
+	_get_bank_transaction_data,
+	get_booking_fingerprint,
+	process_camt_documents,
+)
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.test_bank_reconciliation_tool_beta import (
+	create_bank,
+	create_bank_account,
+)
+
+
+class TestUtils(FrappeTestCase):
+	def test_booking_fingerprint(self):
+		intraday = {
+			"bank_account": "Test Account",
+			"date": "2025-01-02",
+			"deposit": 0,
+			"withdrawal": 30.0,
+			"reference_number": "E2E-1",
+			"bank_party_iban": "DE18 0000 0000 6636 9811 75",
+			"transaction_id": "2025-01-02-10.15.30.123456",
+			"description": "Invoice 1",
+		}
+		booked = intraday | {
+			"date": date(2025, 1, 2),
+			"bank_party_iban": "DE18000000006636981175",
+			"transaction_id": "REF-1",
+			"description": "Invoice 1\nThank you",
+		}
+		self.assertEqual(get_booking_fingerprint(intraday), get_booking_fingerprint(booked))
+		self.assertNotEqual(
+			get_booking_fingerprint(intraday),
+			get_booking_fingerprint(intraday | {"deposit": 30.0, "withdrawal": 0}),
+		)
+
+	def test_upgrade_provisional_transaction(self):
+		frappe.db.set_single_value("Banking Settings", "stage_bank_transactions", 0)
+		create_bank()
+		bank_account = create_bank_account(
+			gl_account=create_gl_account("_Test Bank EBICS"),
+			bank_account_name="EBICS Account",
+		)
+		frappe.db.set_value("Bank Account", bank_account, "iban", "DE02120300000000202051")
+		user = frappe._dict(
+			name="Test EBICS User",
+			bank="Citi Bank",
+			company="_Test Company",
+			start_date=None,
+			split_batch_transactions=0,
+		)
+		transaction = CAMTTransaction(
+			date=date(2025, 1, 2),
+			amount=Decimal("-30.00"),
+			currency="INR",
+			transaction_id="REF-1",
+			purpose=["Invoice 1"],
+			eref="E2E-1",
+			iban="DE18000000006636981175",
+			name="Max Mustermann",
+		)
+
+		def process(transaction: CAMTTransaction, provisional: bool) -> int:
+			statement = CAMTStatement(
+				iban="DE02120300000000202051",
+				date_from=transaction.date,
+				date_to=transaction.date,
+				transactions=iter([transaction]),
+			)
+			return process_camt_documents(user, [statement], provisional=provisional)
+
+		self.assertEqual(process(transaction, provisional=True), 1)
+		# The booked transaction has the same bank reference as the intraday one
+		booked = replace(transaction, purpose=["Invoice 1", "Thanks"])
+		self.assertEqual(process(booked, provisional=False), 1)
+		self.assertEqual(process(booked, provisional=False), 0)
+
+		transactions = frappe.get_all(
+			"Bank Transaction",
+			filters={"bank_account": bank_account},
+			fields=["provisional", "transaction_fingerprint", "description"],
+		)
+		self.assertEqual(len(transactions), 1)
+		self.assertEqual(transactions[0].provisional, 0)
+		self.assertTrue(transactions[0].transaction_fingerprint)
+		self.assertEqual(transactions[0].description, "Invoice 1\nThanks")
+
+		# The booking was imported by Kosma in the meantime, the intraday one is merged
+		other = replace(transaction, amount=Decimal("-40.00"), transaction_id="REF-2")
+		self.assertEqual(process(other, provisional=True), 1)
+		data = _get_bank_transaction_data(
+			bank_account, user.company, other, occurrences=Counter()
+		)
+		self.assertTrue(_create_bank_transaction(data | {"transaction_id": "KOSMA-2"}))
+		self.assertFalse(_create_bank_transaction(data | {"transaction_id": "KOSMA-3"}))
+		self.assertEqual(process(other, provisional=False), 0)
+
+		transactions = frappe.get_all(
+			"Bank Transaction",
+			filters={"bank_account": bank_account, "withdrawal": 40},
+			fields=["provisional", "transaction_id"],
+		)
+		self.assertEqual(transactions, [{"provisional": 0, "transaction_id": "KOSMA-2"}])
@@ -1,17 +1,51 @@
-import contextlib
+import hashlib
+import json
+import threading
+from collections import Counter, OrderedDict
+from functools import partial
 from typing import TYPE_CHECKING
 
 import frappe
 from frappe import _
+from frappe.utils import add_to_date, flt, get_datetime, getdate, now_datetime
 from frappe.utils.data import get_link_to_form
 
-from banking.ebics.manager import EBICSManager
+from banking.ebics.camt import CAMTTransaction, parse_camt
+from banking.ebics.doctype.ebics_download.ebics_download import (
+	archive_documents,
+	get_archived_documents,
+)
+from banking.ebics.manager import EBICSManager, is_license_registered, register_license
+from banking.fingerprint import get_existing_fingerprints, get_transaction_fingerprint
+from banking.instrumentation import add_rows, instrument
+from banking.klarna_kosma_integration.doctype.bank_transaction_staging.bank_transaction_staging import (
+	enqueue_staged_transactions,
+	stage_bank_transactions,
+)
 
 if TYPE_CHECKING:
 	from datetime import date
-	from .types import SEPATransaction
+	from typing import Iterator
+	from fintech.sepa import CAMTDocument
+	from banking.ebics.types import EbicsClient
+	from banking.ebics.camt import CAMTStatement
 	from banking.ebics.doctype.ebics_user.ebics_user import EBICSUser
 
+# Hours after which the stored HTD result of an EBICS User is refreshed
+PERMITTED_ORDER_TYPES_TTL = 24
+
+# EBICS return codes for order types the user is not (or no longer) permitted to use
+ORDER_TYPE_ERROR_CODES = (
+	"090003",  # EBICS_AUTHORISATION_ORDER_TYPE_FAILED
+	"091005",  # EBICS_INVALID_ORDER_TYPE
+	"091006",  # EBICS_UNSUPPORTED_ORDER_TYPE
+)
+
+# EBICSManagers of this worker process, least recently used first
+MANAGER_CACHE_SIZE = 32
+_managers: "OrderedDict[tuple, EBICSManager]" = OrderedDict()
+_managers_lock = threading.Lock()
+
 
 def get_ebics_manager(
 	ebics_user: "EBICSUser",
@@ -20,9 +54,54 @@ def get_ebics_manager(
 ) -> "EBICSManager":
 	"""Get an EBICSManager instance for the given EBICS User.
 
+	Managers are cached per worker process, by EBICS User, bank and keyring version,
+	so that the keys are loaded and decrypted only once.
+
 	:param ebics_user: The EBICS User record.
 	:param passphrase: The secret passphrase for uploads to the bank.
 	"""
+	if not is_license_registered():
+		register_license(*get_fintech_license())
+
+	passphrase = passphrase or ebics_user.get_password("passphrase")
+	host_id, url = frappe.db.get_value(
+		"Bank", ebics_user.bank, ["ebics_host_id", "ebics_url"]
+	)
+	cache_key = (
+		frappe.local.site,
+		ebics_user.name,
+		ebics_user.partner_id,
+		ebics_user.user_id,
+		host_id,
+		url,
+		get_keyring_version(ebics_user.keyring, passphrase, sig_passphrase),
+	)
+
+	with _managers_lock:
+		if cache_key in _managers:
+			_managers.move_to_end(cache_key)
+			return _managers[cache_key]
+
+	manager = EBICSManager()
+	manager.set_keyring(
+		keys=ebics_user.get_keyring(),
+		save_to_db=ebics_user.store_keyring,
+		sig_passphrase=sig_passphrase,
+		passphrase=passphrase,
+	)
+	manager.set_user(ebics_user.partner_id, ebics_user.user_id)
+	manager.set_bank(host_id, url)
+
+	with _managers_lock:
+		_managers[cache_key] = manager
+		while len(_managers) > MANAGER_CACHE_SIZE:
+			_managers.popitem(last=False)
+
+	return manager
+
+
+def get_fintech_license() -> tuple[str, str]:
+	"""Return the licensee name and the decrypted license key from Banking Settings."""
 	banking_settings = frappe.get_single("Banking Settings")
 
 	license_key = None
@@ -35,41 +114,34 @@ def get_ebics_manager(
 			).format(get_link_to_form("Banking Settings", "Banking Settings"))
 		)
 
-	manager = EBICSManager(
-		license_name=banking_settings.fintech_licensee_name,
-		license_key=license_key,
-	)
-
-	manager.set_keyring(
-		keys=ebics_user.get_keyring(),
-		save_to_db=ebics_user.store_keyring,
-		sig_passphrase=sig_passphrase,
-		passphrase=passphrase or ebics_user.get_password("passphrase"),
-	)
+	return banking_settings.fintech_licensee_name, license_key
 
-	manager.set_user(ebics_user.partner_id, ebics_user.user_id)
 
-	host_id, url = frappe.db.get_value(
-		"Bank", ebics_user.bank, ["ebics_host_id", "ebics_url"]
-	)
-	manager.set_bank(host_id, url)
-
-	return manager
+def get_keyring_version(keyring: str | None, *passphrases: str | None) -> str:
+	"""Changes whenever the stored keys or the passphrases used to decrypt them change."""
+	return hashlib.sha256(json.dumps([keyring, *passphrases]).encode()).hexdigest()
 
 
+@instrument()
 def sync_ebics_transactions(
 	ebics_user: str,
 	start_date: str | None = None,
 	end_date: str | None = None,
 	passphrase: str | None = None,
 	intraday: bool = False,
+	client: "EbicsClient | None" = None,
 ):
+	"""Download and process the statements of the date range, or the intraday transactions.
+
+	If a `client` is passed, booked statements are downloaded with it and not confirmed,
+	see `banking.ebics.backfill`.
+	"""
 	user = frappe.get_doc("EBICS User", ebics_user)
 	manager = get_ebics_manager(ebics_user=user, passphrase=passphrase)
 
 	# Not sure yet, how reliable permitted types are. For now, we just log an error
 	# instead of raising an exception or returning.
-	permitted_types = manager.get_permitted_order_types()
+	permitted_types = get_permitted_order_types(user, manager)
 	if intraday and "C52" not in permitted_types:
 		frappe.log_error(
 			title=_("Banking Error"),
@@ -84,7 +156,7 @@ def sync_ebics_transactions(
 		frappe.log_error(
 			title=_("Banking Error"),
 			message=_(
-				"It seems like EBICS User {0} lacks permission 'C52' for downloading booked bank statements. The permitted types are: {1}."
+				"It seems like EBICS User {0} lacks permission 'C53' for downloading booked bank statements. The permitted types are: {1}."
 			).format(ebics_user, ", ".join(permitted_types)),
 			reference_doctype="EBICS User",
 			reference_name=ebics_user,
@@ -100,14 +172,25 @@ def sync_ebics_transactions(
 			reference_name=ebics_user,
 		)
 
+	# Archive the raw documents before parsing, see `replay_ebics_downloads`
+	on_download = partial(
+		archive_documents,
+		ebics_user,
+		transfer_id=frappe.generate_hash(),
+		start_date=start_date,
+		end_date=end_date,
+	)
+
 	try:
 		camt_documents = (
-			manager.download_intraday_transactions()
+			manager.download_intraday_transactions(on_download=on_download)
 			if intraday
 			else manager.download_bank_statements(
 				start_date,
 				end_date,
 				with_c54=user.split_batch_transactions and "C54" in permitted_types,
+				on_download=on_download,
+				client=client,
 			)
 		)
 	except Exception:
@@ -118,17 +201,68 @@ def sync_ebics_transactions(
 		)
 		return
 
-	for camt_document in camt_documents:
-		bank_account = frappe.db.get_value(
-			"Bank Account",
-			{
-				"iban": camt_document.iban,
-				"disabled": 0,
-				"bank": user.bank,
-				"is_company_account": 1,
-				"company": user.company,
-			},
+	return process_camt_documents(
+		user, refresh_permissions_on_error(user, camt_documents), provisional=intraday
+	)
+
+
+def replay_ebics_downloads(
+	ebics_user: str,
+	downloaded_from: str | None = None,
+	downloaded_to: str | None = None,
+) -> int:
+	"""Create the Bank Transactions of archived EBICS downloads, without contacting the bank.
+
+	Transactions that exist already are skipped, like in a regular sync.
+	"""
+	user = frappe.get_doc("EBICS User", ebics_user)
+	# Parsing needs the fintech license, but no passphrase or keys of the user
+	if not is_license_registered():
+		register_license(*get_fintech_license())
+
+	transactions = 0
+	for download, camt54 in get_archived_documents(ebics_user, downloaded_from, downloaded_to):
+		transactions += process_camt_documents(
+			user,
+			parse_camt(download.get_xml(), camt54=camt54 or None),
+			provisional=download.order_type == "C52",
 		)
+
+	return transactions
+
+
+def process_camt_documents(
+	user: "EBICSUser",
+	camt_documents: "Iterator[CAMTDocument | CAMTStatement]",
+	provisional: bool = False,
+) -> int:
+	"""Create (or stage) the Bank Transactions of the documents. Return their number.
+
+	Intraday transactions (camt.052) are `provisional`. When the booked statement
+	(camt.053) arrives, each provisional Bank Transaction is upgraded with the booked
+	values instead of creating a second one, matched by their booking fingerprint. This
+	happens even if both have the same transaction ID. Other transactions with a known
+	transaction ID or fingerprint are skipped. Upgraded transactions are included in the
+	returned number.
+	"""
+	ebics_user = user.name
+	staging = frappe.db.get_single_value("Banking Settings", "stage_bank_transactions")
+	transactions = 0
+	bank_accounts = {}  # IBAN -> Bank Account, for the whole run
+	for camt_document in camt_documents:
+		if camt_document.iban not in bank_accounts:
+			bank_accounts[camt_document.iban] = frappe.db.get_value(
+				"Bank Account",
+				{
+					"iban": camt_document.iban,
+					"disabled": 0,
+					"bank": user.bank,
+					"is_company_account": 1,
+					"company": user.company,
+				},
+			)
+
+		bank_account = bank_accounts[camt_document.iban]
 		if not bank_account:
 			frappe.log_error(
 				title=_("Banking Error"),
@@ -138,83 +272,328 @@ def sync_ebics_transactions(
 			)
 			continue
 
-		for transaction in camt_document:
+		existing_ids = get_existing_transaction_ids(
+			bank_account, camt_document.date_from, camt_document.date_to
+		)
+		existing_fingerprints = get_existing_fingerprints(
+			bank_account, camt_document.date_from, camt_document.date_to
+		)
+		fingerprints = get_booking_fingerprints(
+			bank_account, camt_document.date_from, camt_document.date_to
+		)
+		# Intraday transactions get their transaction fingerprint once they are booked
+		occurrences = None if provisional else Counter()
+		rows = []
+		for entry in camt_document:
+			transaction = (
+				entry
+				if isinstance(entry, CAMTTransaction)
+				else CAMTTransaction.from_sepa_transaction(
+					entry,
+					with_sub_transactions=user.split_batch_transactions or len(entry) == 1,
+				)
+			)
 			if transaction.status and transaction.status != "BOOK":
 				# Skip PDNG and INFO transactions
 				continue
 
-			if (
-				transaction.batch
-				and (user.split_batch_transactions or len(transaction) == 1)
-				and len(transaction) >= 1
+			sub_transactions = transaction.sub_transactions
+			if transaction.batch and sub_transactions and (
+				user.split_batch_transactions or len(sub_transactions) == 1
 			):
 				# Split batch transactions into sub-transactions, based on info
 				# from camt.054 that is sometimes available.
 				# If that's not possible, create a single transaction
-				for sub_transaction in transaction:
-					_create_bank_transaction(
-						bank_account,
-						user.company,
-						sub_transaction,
-						user.start_date,
-						is_sub_transaction=True,
-					)
+				camt_transactions = sub_transactions
 			else:
-				_create_bank_transaction(bank_account, user.company, transaction, user.start_date)
+				camt_transactions = [transaction]
 
+			for camt_transaction in camt_transactions:
+				data = _get_bank_transaction_data(
+					bank_account,
+					user.company,
+					camt_transaction,
+					user.start_date,
+					occurrences=occurrences,
+				)
+				if not data:
+					continue
 
-def _create_bank_transaction(
-	bank_account: str,
-	company: str,
-	sepa_transaction: "SEPATransaction",
-	start_date: "date" = None,
-	is_sub_transaction: bool = False,
-):
-	"""Create an ERPNext Bank Transaction from a given fintech.sepa.SEPATransaction.
+				data["provisional"] = int(provisional)
+				data["booking_fingerprint"] = get_booking_fingerprint(data)
+
+				# An intraday transaction matches a booked one and vice versa
+				matches = fingerprints.setdefault(data["booking_fingerprint"], [])
+				match = next((m for m in matches if bool(m.provisional) != provisional), None)
+
+				transaction_id = data["transaction_id"]
+				fingerprint = data.get("transaction_fingerprint")
+				if match and not provisional:
+					# Also if the booking was imported otherwise, e.g. by Kosma, so that the
+					# intraday transaction does not stay provisional
+					matches.remove(match)
+					existing_ids.add(transaction_id)
+					existing_fingerprints.add(fingerprint)
+					if upgrade_provisional_transaction(match.name, data):
+						add_rows(1)
+						transactions += 1
+
+					continue
+
+				if (fingerprint and fingerprint in existing_fingerprints) or (
+					transaction_id and transaction_id in existing_ids
+				):
+					continue
 
-	https://www.joonis.de/en/fintech/doc/sepa/#fintech.sepa.SEPATransaction
+				existing_ids.add(transaction_id)
+				existing_fingerprints.add(fingerprint)
+				if match:
+					# Booked already
+					matches.remove(match)
+					continue
+
+				if staging:
+					rows.append(data)
+				elif not _create_bank_transaction(data):
+					continue
+
+				add_rows(1)
+				transactions += 1
+
+		if rows:
+			# Bulk write the whole document, Bank Transactions are created by a separate job
+			stage_bank_transactions("EBICS", rows)
+
+	if staging:
+		enqueue_staged_transactions()
+
+	return transactions
+
+
+def get_permitted_order_types(user: "EBICSUser", manager: "EBICSManager") -> list[str]:
+	"""Return the order types permitted for the user, as stored on the EBICS User.
+
+	Fetched via HTD on first use. Once older than `PERMITTED_ORDER_TYPES_TTL` hours,
+	the stored value is still used but refreshed in the background.
 	"""
-	# sepa_transaction.bank_reference can be None, but we can still find an ID in the XML
-	# For our test bank, the latter is a timestamp with nanosecond accuracy.
-	transaction_id = (
-		sepa_transaction.bank_reference or sepa_transaction._xmlobj.Refs.TxId.text
+	if not user.permitted_order_types_updated_at:
+		return update_permitted_order_types(user, manager)
+
+	if get_datetime(user.permitted_order_types_updated_at) < add_to_date(
+		now_datetime(), hours=-PERMITTED_ORDER_TYPES_TTL
+	):
+		enqueue_permitted_order_types_update(user)
+
+	return (user.permitted_order_types or "").split()
+
+
+def update_permitted_order_types(
+	user: "EBICSUser", manager: "EBICSManager | None" = None
+) -> list[str]:
+	"""Fetch the permitted order types via HTD and store them on the EBICS User."""
+	manager = manager or get_ebics_manager(ebics_user=user)
+	permitted_types = manager.get_permitted_order_types()
+	user.db_set(
+		{
+			"permitted_order_types": " ".join(permitted_types),
+			"permitted_order_types_updated_at": now_datetime(),
+		},
+		update_modified=False,
 	)
+	return permitted_types
 
-	# NOTE: This does not work for old data, this ID is different from Kosma's
-	if transaction_id and frappe.db.exists(
+
+def enqueue_permitted_order_types_update(user: "EBICSUser") -> None:
+	if not user.get_password("passphrase", raise_exception=False):
+		# Background jobs cannot decrypt the keys without a stored passphrase
+		return
+
+	frappe.enqueue(
+		"banking.ebics.utils.refresh_permitted_order_types",
+		ebics_user=user.name,
+		job_id=f"ebics_permitted_order_types|{user.name}",
+		deduplicate=True,
+	)
+
+
+def refresh_permitted_order_types(ebics_user: str) -> None:
+	update_permitted_order_types(frappe.get_doc("EBICS User", ebics_user))
+
+
+def refresh_permissions_on_error(
+	user: "EBICSUser", camt_documents: "Iterator[CAMTDocument | CAMTStatement]"
+) -> "Iterator[CAMTDocument | CAMTStatement]":
+	"""Pass through the documents. Refresh the stored order types if the bank rejects the order type."""
+	try:
+		yield from camt_documents
+	except Exception as e:
+		if getattr(e, "code", None) in ORDER_TYPE_ERROR_CODES:
+			enqueue_permitted_order_types_update(user)
+		raise
+
+
+def get_existing_transaction_ids(
+	bank_account: str, from_date: "date | str | None", to_date: "date | str | None"
+) -> set[str]:
+	"""Return the transaction IDs of the bank account's Bank Transactions in the date range."""
+	filters = [
+		["bank_account", "=", bank_account],
+		["transaction_id", "is", "set"],
+	]
+	if from_date:
+		filters.append(["date", ">=", getdate(from_date)])
+	if to_date:
+		filters.append(["date", "<=", getdate(to_date)])
+
+	return set(frappe.get_all("Bank Transaction", filters=filters, pluck="transaction_id"))
+
+
+def get_booking_fingerprints(
+	bank_account: str, from_date: "date | str | None", to_date: "date | str | None"
+) -> dict[str, list[frappe._dict]]:
+	"""Return the bank account's Bank Transactions in the date range by booking fingerprint."""
+	filters = [
+		["bank_account", "=", bank_account],
+		["booking_fingerprint", "is", "set"],
+		["docstatus", "<", 2],
+	]
+	if from_date:
+		filters.append(["date", ">=", getdate(from_date)])
+	if to_date:
+		filters.append(["date", "<=", getdate(to_date)])
+
+	fingerprints = {}
+	for transaction in frappe.get_all(
 		"Bank Transaction",
-		{"transaction_id": transaction_id, "bank_account": bank_account},
+		filters=filters,
+		fields=["name", "booking_fingerprint", "provisional"],
 	):
-		return
+		fingerprints.setdefault(transaction.booking_fingerprint, []).append(transaction)
+
+	return fingerprints
+
+
+def get_booking_fingerprint(data: dict) -> str:
+	"""Identify a booking by values that camt.052 and camt.053 have in common.
+
+	Bank references (transaction ID) and purpose can differ between the two.
+	"""
+	amount = flt(data.get("deposit")) - flt(data.get("withdrawal"))
+	values = (
+		data["bank_account"],
+		str(getdate(data["date"])),
+		f"{amount:.2f}",
+		(data.get("reference_number") or "").strip(),
+		(data.get("bank_party_iban") or "").replace(" ", "").upper(),
+	)
+	return hashlib.sha256("|".join(values).encode()).hexdigest()[:32]
+
+
+def upgrade_provisional_transaction(name: str, data: dict) -> bool:
+	"""Replace the intraday values of a Bank Transaction with the booked ones.
+
+	Keeps the name and the reconciliation of the Bank Transaction. If the booking exists
+	already, e.g. imported by Kosma, the two are merged by deleting the unreconciled one,
+	preferably the intraday one. Return whether the Bank Transaction was upgraded.
+	"""
+	booked = frappe.db.get_value(
+		"Bank Transaction",
+		{"transaction_fingerprint": data["transaction_fingerprint"], "name": ("!=", name)},
+	)
+	if booked:
+		if not is_reconciled(name):
+			delete_bank_transaction(name)
+			return False
+
+		if is_reconciled(booked):
+			frappe.log_error(
+				title=_("Banking Error"),
+				message=_(
+					"Bank Transactions {0} and {1} are the same booking, but both are reconciled."
+				).format(name, booked),
+				reference_doctype="Bank Transaction",
+				reference_name=name,
+			)
+			return False
+
+		delete_bank_transaction(booked)
+
+	frappe.db.set_value(
+		"Bank Transaction",
+		name,
+		{
+			"provisional": 0,
+			"transaction_id": data["transaction_id"],
+			"transaction_fingerprint": data["transaction_fingerprint"],
+			"description": data["description"],
+			"reference_number": data["reference_number"],
+			"bank_party_name": data["bank_party_name"],
+			"bank_party_iban": data["bank_party_iban"],
+		},
+	)
+	return True
+
+
+def is_reconciled(bank_transaction: str) -> bool:
+	return flt(frappe.db.get_value("Bank Transaction", bank_transaction, "allocated_amount")) > 0
 
-	if start_date and sepa_transaction.date < start_date:
-		return
 
+def delete_bank_transaction(bank_transaction: str) -> None:
+	"""Cancel and delete an unreconciled Bank Transaction, freeing its fingerprint."""
+	doc = frappe.get_doc("Bank Transaction", bank_transaction)
+	if doc.docstatus == 1:
+		doc.cancel()
+
+	frappe.delete_doc("Bank Transaction", bank_transaction, ignore_permissions=True)
+
+
+def _get_bank_transaction_data(
+	bank_account: str,
+	company: str,
+	transaction: CAMTTransaction,
+	start_date: "date" = None,
+	occurrences: Counter | None = None,
+) -> dict | None:
+	"""Map a normalized camt transaction to the values of an ERPNext Bank Transaction.
+
+	Returns `None` if the transaction is older than `start_date`. The transaction
+	fingerprint is set only if `occurrences` are passed, see `get_transaction_fingerprint`.
+	"""
+	if start_date and transaction.date < start_date:
+		return None
+
+	amount = float(transaction.amount)
+	data = {
+		"date": transaction.date,
+		"bank_account": bank_account,
+		"company": company,
+		"deposit": max(amount, 0),
+		"withdrawal": abs(min(amount, 0)),
+		"currency": transaction.currency,
+		"description": "\n".join(transaction.purpose),
+		"reference_number": transaction.eref,
+		"transaction_id": transaction.transaction_id,
+		"bank_party_iban": transaction.iban,
+		"bank_party_name": transaction.name,
+	}
+	if occurrences is not None:
+		data["transaction_fingerprint"] = get_transaction_fingerprint(data, occurrences)
+
+	return data
+
+
+def _create_bank_transaction(data: dict) -> bool:
+	"""Create and submit an ERPNext Bank Transaction from the given values.
+
+	Return whether it was created, i.e. it is not a duplicate.
+	"""
 	bt = frappe.new_doc("Bank Transaction")
-	bt.date = sepa_transaction.date
-	bt.bank_account = bank_account
-	bt.company = company
-
-	amount = float(sepa_transaction.amount.value)
-	bt.deposit = max(amount, 0)
-	bt.withdrawal = abs(min(amount, 0))
-	bt.currency = sepa_transaction.amount.currency
-
-	bt.description = "\n".join(sepa_transaction.purpose)
-	bt.reference_number = sepa_transaction.eref
-	bt.transaction_id = transaction_id
-	bt.bank_party_iban = sepa_transaction.iban
-	bt.bank_party_name = sepa_transaction.name
-
-	if is_sub_transaction and not bt.bank_party_name:
-		# Temporary workaround to parse the party name from camt.052.001.08
-		# Can be removed once it's supported by the fintech library
-		bt.bank_party_name = (
-			sepa_transaction._xmlobj.RltdPties.Dbtr.Pty.Nm._text
-			if sepa_transaction._xmlobj.CdtDbtInd._text == "CRDT"
-			else sepa_transaction._xmlobj.RltdPties.Cdtr.Pty.Nm._text
-		)
+	bt.update(data)
 
-	with contextlib.suppress(frappe.exceptions.UniqueValidationError):
+	try:
 		bt.insert()
 		bt.submit()
+	except frappe.exceptions.UniqueValidationError:
+		return False
+
+	return True
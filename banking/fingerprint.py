@@ -0,0 +1,67 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+"""Source independent identity of Bank Transactions.
+
+Transaction IDs differ between Kosma and EBICS (and are missing for some banks), so
+every imported Bank Transaction also gets a `transaction_fingerprint`: a hash of the
+values that both sources deliver for the same booking. The column has a unique index,
+which makes the lookup cheap and prevents duplicates of concurrent imports.
+"""
+import hashlib
+import re
+from collections import Counter
+from datetime import date
+
+import frappe
+from frappe.utils import flt, getdate
+
+NON_ALPHANUMERIC = re.compile(r"[\W_]+")
+
+
+def get_transaction_fingerprint(data: dict, occurrences: Counter | None = None) -> str:
+	"""Return the fingerprint of the Bank Transaction values.
+
+	The purpose is used only if there is no end-to-end reference, ignoring case,
+	whitespace and punctuation. Identical transactions within one download are told
+	apart by passing the same `occurrences` for all of them: the n-th one gets a
+	different fingerprint than the first.
+	"""
+	amount = flt(data.get("deposit")) - flt(data.get("withdrawal"))
+	reference = data.get("reference_number") or data.get("description") or ""
+	values = (
+		data["bank_account"],
+		str(getdate(data["date"])),
+		f"{amount:.2f}",
+		(data.get("currency") or "").upper(),
+		(data.get("bank_party_iban") or "").replace(" ", "").upper(),
+		NON_ALPHANUMERIC.sub("", reference).lower(),
+	)
+	fingerprint = hash_values(values)
+	if occurrences is None:
+		return fingerprint
+
+	occurrence = occurrences[fingerprint]
+	occurrences[fingerprint] += 1
+	return hash_values((fingerprint, str(occurrence))) if occurrence else fingerprint
+
+
+def hash_values(values: tuple) -> str:
+	return hashlib.sha256("|".join(values).encode()).hexdigest()[:32]
+
+
+def get_existing_fingerprints(
+	bank_account: str, from_date: date | str | None, to_date: date | str | None
+) -> set[str]:
+	"""Return the fingerprints of the bank account's Bank Transactions in the date range."""
+	filters = [
+		["bank_account", "=", bank_account],
+		["transaction_fingerprint", "is", "set"],
+	]
+	if from_date:
+		filters.append(["date", ">=", getdate(from_date)])
+	if to_date:
+		filters.append(["date", "<=", getdate(to_date)])
+
+	return set(
+		frappe.get_all("Bank Transaction", filters=filters, pluck="transaction_fingerprint")
+	)
@@ -66,6 +66,7 @@ app_include_css = "bank_reconciliation_beta.bundle.css"
 
 # before_install = "banking.install.before_install"
 after_install = "banking.install.after_install"
+after_migrate = "banking.indexes.create_indexes"
 
 # Uninstallation
 # ------------
@@ -114,6 +115,12 @@ doc_events = {
 
 scheduler_events = {
 	"cron": {
+		"* * * * *": [
+			"banking.ebics.scheduling.enqueue_deferred_ebics_syncs",
+		],
+		"*/5 * * * *": [
+			"banking.klarna_kosma_integration.doctype.banking_slow_query.banking_slow_query.flush_slow_queries",
+		],
 		"30 6,10,14,18 * * *": [  # at 6:30, 10:30, 14:30, 18:30
 			"banking.klarna_kosma_integration.doctype.banking_settings.banking_settings.intraday_sync_ebics",
 		],
@@ -121,6 +128,14 @@ scheduler_events = {
 			"banking.klarna_kosma_integration.doctype.banking_settings.banking_settings.sync_all_accounts_and_transactions",
 		],
 	},
+	"hourly_long": [
+		"banking.klarna_kosma_integration.doctype.bank_transaction_staging.bank_transaction_staging.process_pending_staged_transactions",
+	],
+}
+
+# Cleared via Log Settings, after the given number of days
+default_log_clearing_doctypes = {
+	"Banking Call Log": 30,
 }
 
 # Testing
@@ -179,6 +194,38 @@ before_tests = "banking.utils.before_tests"
 # ]
 
 kosma_custom_fields = {
+	"Bank Transaction": [
+		dict(
+			fieldname="provisional",
+			label="Provisional",
+			fieldtype="Check",
+			insert_after="transaction_id",
+			read_only=1,
+			no_copy=1,
+			description="Intraday transaction, updated once the booked statement has been downloaded",
+		),
+		dict(
+			fieldname="booking_fingerprint",
+			label="Booking Fingerprint",
+			fieldtype="Data",
+			insert_after="provisional",
+			read_only=1,
+			hidden=1,
+			no_copy=1,
+			translatable=0,
+		),
+		dict(
+			fieldname="transaction_fingerprint",
+			label="Transaction Fingerprint",
+			fieldtype="Data",
+			insert_after="booking_fingerprint",
+			read_only=1,
+			hidden=1,
+			no_copy=1,
+			unique=1,
+			translatable=0,
+		),
+	],
 	"Bank Account": [
 		dict(
 			owner="Administrator",
@@ -232,4 +279,54 @@ kosma_property_setters = {
 	]
 }
 
+# Composite indexes for the matching queries, see banking.indexes
+banking_indexes = {
+	"Payment Entry": {
+		"banking_paid_to_matching": [
+			"paid_to",
+			"docstatus",
+			"clearance_date",
+			"posting_date",
+			"paid_amount",
+		],
+		"banking_paid_from_matching": [
+			"paid_from",
+			"docstatus",
+			"clearance_date",
+			"posting_date",
+			"paid_amount",
+		],
+	},
+	"Journal Entry Account": {
+		"banking_account_parent": ["account", "parent"],
+	},
+	"Sales Invoice": {
+		"banking_outstanding_matching": [
+			"company",
+			"docstatus",
+			"currency",
+			"outstanding_amount",
+		],
+	},
+	"Purchase Invoice": {
+		"banking_outstanding_matching": [
+			"company",
+			"docstatus",
+			"currency",
+			"outstanding_amount",
+		],
+	},
+	"Bank Transaction": {
+		"banking_unallocated_matching": [
+			"bank_account",
+			"docstatus",
+			"unallocated_amount",
+			"date",
+		],
+		"banking_modified": ["bank_account", "modified"],
+		"banking_account_date": ["bank_account", "date", "transaction_id"],
+		"banking_booking_fingerprint": ["bank_account", "booking_fingerprint"],
+	},
+}
+
 get_matching_queries = "banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.bank_reconciliation_tool_beta.get_matching_queries"
@@ -0,0 +1,68 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+"""Composite indexes for the matching queries of the Bank Reconciliation Tool Beta.
+
+The indexes are defined in the `banking_indexes` hook. Most of the tables belong to
+ERPNext, so they are created after install and after every migrate instead of via
+`on_doctype_update`. This also restores them if a table has been rebuilt.
+"""
+from typing import Dict, Iterator, List, Tuple
+
+import frappe
+
+
+def create_indexes() -> None:
+	"""Create the missing indexes of the `banking_indexes` hook."""
+	for doctype, index_name, fields in get_index_definitions():
+		if is_applicable(doctype, fields) and not has_index(doctype, index_name):
+			frappe.db.add_index(doctype, fields, index_name)
+
+
+def get_index_report() -> List[Dict]:
+	"""Return the state of every managed index and the estimated rows of its table.
+
+	The estimated rows are what a query has to scan if the index is missing.
+	"""
+	report = []
+	for doctype, index_name, fields in get_index_definitions():
+		applicable = is_applicable(doctype, fields)
+		report.append(
+			{
+				"doctype": doctype,
+				"index": index_name,
+				"fields": fields,
+				"status": (
+					("Present" if has_index(doctype, index_name) else "Missing")
+					if applicable
+					else "Not Applicable"
+				),
+				"estimated_rows": estimate_count(doctype) if applicable else None,
+			}
+		)
+
+	return report
+
+
+def estimate_count(doctype: str) -> int:
+	"""Return the table statistics' row count, or the exact count on Frappe v14."""
+	if hasattr(frappe.db, "estimate_count"):
+		return frappe.db.estimate_count(doctype)
+
+	return frappe.db.count(doctype)
+
+
+def get_index_definitions() -> Iterator[Tuple[str, str, List[str]]]:
+	for doctype, indexes in frappe.get_hooks("banking_indexes", {}).items():
+		for index_name, fields in indexes.items():
+			yield doctype, index_name, fields
+
+
+def is_applicable(doctype: str, fields: List[str]) -> bool:
+	"""Whether the table and all columns exist, e.g. not if an app is missing."""
+	return frappe.db.table_exists(doctype) and all(
+		frappe.db.has_column(doctype, fieldname) for fieldname in fields
+	)
+
+
+def has_index(doctype: str, index_name: str) -> bool:
+	return bool(frappe.db.has_index(f"tab{doctype}", index_name))
@@ -3,12 +3,15 @@ import frappe
 from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
 from frappe.custom.doctype.property_setter.property_setter import make_property_setter
 
+from banking.indexes import create_indexes
+
 
 def after_install():
 	click.echo("Installing Banking Customizations ...")
 
 	create_custom_fields(frappe.get_hooks("kosma_custom_fields"))
 	make_property_setters()
+	create_indexes()
 
 
 def make_property_setters():
@@ -0,0 +1,174 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+"""Opt-in timings of banking entry points.
+
+Enabled via Banking Settings > Enable Instrumentation. Every call of a function
+decorated with `instrument` is then written to the Banking Call Log, with its wall
+time, SQL queries, HTTP requests and rows processed. Logs are inserted in the
+background (`frappe.deferred_insert`), so that the call itself is not slowed down.
+"""
+import time
+from functools import wraps
+from typing import Callable, List, Optional
+
+import frappe
+import requests
+from frappe.deferred_insert import deferred_insert
+from frappe.utils import now_datetime
+
+
+class CallStats:
+	__slots__ = ("sql_count", "sql_time", "http_count", "http_time", "rows")
+
+	def __init__(self) -> None:
+		self.sql_count = 0
+		self.sql_time = 0.0
+		self.http_count = 0
+		self.http_time = 0.0
+		self.rows = None
+
+
+def instrument(endpoint: Optional[str] = None) -> Callable:
+	"""Decorator that records each call of the function, if instrumentation is enabled.
+
+	:param endpoint: name in the Banking Call Log, defaults to the function's dotted path.
+
+	Rows processed default to the length (or value) of the return value, see `add_rows`.
+	"""
+
+	def decorator(function: Callable) -> Callable:
+		name = endpoint or f"{function.__module__}.{function.__qualname__}"
+
+		@wraps(function)
+		def wrapper(*args, **kwargs):
+			if not is_enabled():
+				return function(*args, **kwargs)
+
+			stack = get_active_calls()
+			if not stack:
+				patch_sql()
+				patch_requests()
+
+			stats = CallStats()
+			stack.append(stats)
+			started_at = now_datetime()
+			start = time.perf_counter()
+			status = "Error"
+			try:
+				result = function(*args, **kwargs)
+				status = "Success"
+				if stats.rows is None:
+					stats.rows = count_rows(result)
+				return result
+			finally:
+				duration = time.perf_counter() - start
+				stack.pop()
+				if not stack:
+					unpatch_sql()
+
+				log_call(name, status, started_at, duration, stats)
+
+		return wrapper
+
+	return decorator
+
+
+def add_rows(count: int) -> None:
+	"""Add to the rows processed by the current instrumented calls."""
+	for stats in get_active_calls():
+		stats.rows = (stats.rows or 0) + count
+
+
+def is_enabled() -> bool:
+	try:
+		return bool(frappe.db.get_single_value("Banking Settings", "enable_instrumentation"))
+	except Exception:
+		# e.g. before the field exists during migration
+		return False
+
+
+def get_active_calls() -> List[CallStats]:
+	if not hasattr(frappe.local, "banking_active_calls"):
+		frappe.local.banking_active_calls = []
+
+	return frappe.local.banking_active_calls
+
+
+def count_rows(result) -> Optional[int]:
+	if isinstance(result, bool):
+		return None
+	if isinstance(result, int):
+		return result
+	if isinstance(result, (list, tuple, set, dict)):
+		return len(result)
+
+	return None
+
+
+def patch_sql() -> None:
+	"""Time the queries of the current connection while instrumented calls are active."""
+	original_sql = frappe.db.sql
+
+	def sql(*args, **kwargs):
+		start = time.perf_counter()
+		try:
+			return original_sql(*args, **kwargs)
+		finally:
+			elapsed = time.perf_counter() - start
+			for stats in get_active_calls():
+				stats.sql_count += 1
+				stats.sql_time += elapsed
+
+	frappe.db.sql = sql
+
+
+def unpatch_sql() -> None:
+	frappe.db.__dict__.pop("sql", None)
+
+
+def patch_requests() -> None:
+	"""Time HTTP requests made via `requests` during instrumented calls. Once per process."""
+	if getattr(requests.Session.send, "banking_instrumented", False):
+		return
+
+	original_send = requests.Session.send
+
+	@wraps(original_send)
+	def send(self, request, **kwargs):
+		calls = get_active_calls()
+		if not calls:
+			return original_send(self, request, **kwargs)
+
+		start = time.perf_counter()
+		try:
+			return original_send(self, request, **kwargs)
+		finally:
+			elapsed = time.perf_counter() - start
+			for stats in calls:
+				stats.http_count += 1
+				stats.http_time += elapsed
+
+	send.banking_instrumented = True
+	requests.Session.send = send
+
+
+def log_call(
+	endpoint: str, status: str, started_at, duration: float, stats: CallStats
+) -> None:
+	deferred_insert(
+		"Banking Call Log",
+		[
+			{
+				"endpoint": endpoint,
+				"status": status,
+				"started_at": str(started_at),
+				"duration": duration,
+				"rows": stats.rows,
+				"user": frappe.session.user,
+				"sql_count": stats.sql_count,
+				"sql_time": stats.sql_time,
+				"http_count": stats.http_count,
+				"http_time": stats.http_time,
+			}
+		],
+	)
@@ -1,11 +1,18 @@
 # Copyright (c) 2023, ALYF GmbH and contributors
 # For license information, please see license.txt
-from typing import Dict, Optional
+from collections import Counter
+from functools import cached_property
+from typing import Dict, Optional, Tuple
 
 import frappe
+from frappe.utils import formatdate, now_datetime
 
-from banking.connectors.admin_request import AdminRequest
-from banking.connectors.admin_transaction import AdminTransaction
+from banking.connectors.admin_request import AdminRequest, log_transfer
+from banking.connectors.admin_transaction import StreamedAdminTransaction
+from banking.klarna_kosma_integration.doctype.bank_sync_run.bank_sync_run import (
+	get_resumable_sync_run,
+	start_sync_run,
+)
 from banking.klarna_kosma_integration.exception_handler import ExceptionHandler
 from banking.klarna_kosma_integration.utils import (
 	account_last_sync_date,
@@ -20,11 +27,23 @@ from banking.klarna_kosma_integration.utils import (
 	get_current_ip,
 	get_from_to_date,
 	get_session_flow_ids,
+	persist_consent_token,
 	set_session_state,
 	to_json,
 )
 
 
+# Decrypted Banking Settings per site, cached in the worker's memory.
+# Saving Banking Settings changes the version in Redis, which invalidates the
+# cache in all workers.
+ADMIN_SETTINGS_VERSION_KEY = "banking_admin_settings_version"
+
+# Reload the settings after this many seconds, in case an invalidation was missed
+ADMIN_SETTINGS_TTL = 10 * 60
+
+_admin_settings_cache: Dict[str, Tuple[str, frappe._dict]] = {}
+
+
 class Admin:
 	"""A class that directly communicates with the Banking Admin App."""
 
@@ -36,13 +55,13 @@ class Admin:
 		self.ip_address = get_current_ip()
 		self.user_agent = frappe.get_request_header("User-Agent") if frappe.request else None
 
-		settings = settings or frappe.get_single("Banking Settings")
-		self.use_test_environment = settings.use_test_environment
-		self.api_token = settings.get_password("api_token")
-		self.customer_id = settings.customer_id
-		self.url = settings.admin_endpoint + "/api/method/"
+		admin_settings = get_admin_settings(settings) if settings else get_cached_admin_settings()
+		self.use_test_environment = admin_settings.use_test_environment
+		self.api_token = admin_settings.api_token
+		self.customer_id = admin_settings.customer_id
+		self.url = admin_settings.url
 
-	@property
+	@cached_property
 	def request(self):
 		return AdminRequest(
 			ip_address=self.ip_address,
@@ -51,6 +70,7 @@ class Admin:
 			url=self.url,
 			customer_id=self.customer_id,
 			use_test_environment=self.use_test_environment,
+			compress_requests=bool(frappe.conf.get("banking_compress_requests")),
 		)
 
 	def get_client_token(
@@ -115,21 +135,29 @@ class Admin:
 
 	def flow_transactions(self, account: str, session_id_short: str):
 		next_page, url, offset, transactions_value = True, None, None, None
+		occurrences = Counter()
 		try:
 			session_id, flow_id = get_session_flow_ids(session_id_short)
 			while next_page:
-				response = self.request.flow_transactions(session_id, flow_id, url, offset)
-				response.raise_for_status()
-				transactions_value = response.json().get("message", {})
+				with self.request.flow_transactions(session_id, flow_id, url, offset) as response:
+					# Reads the body of error responses, for ExceptionHandler
+					transaction = StreamedAdminTransaction.from_response(response)
+					response.raise_for_status()
+
+					# Insert while the page is still being received
+					create_bank_transactions(
+						account,
+						transaction.transaction_list,
+						via_flow_api=True,
+						occurrences=occurrences,
+					)
+					transactions_value = transaction.message
+
+				log_transfer(response)
 
-				# Process Request Response
-				transaction = AdminTransaction(transactions_value)
 				next_page = transaction.is_next_page()
 				if next_page:
 					url, offset = transaction.next_page_request()
-
-				if transaction.transaction_list:
-					create_bank_transactions(account, transaction.transaction_list, via_flow_api=True)
 		except Exception as exc:
 			ExceptionHandler(exc)
 		finally:
@@ -142,7 +170,9 @@ class Admin:
 			accounts_response = self.request.consent_accounts(consent_id, consent_token)
 			accounts_response_value = to_json(accounts_response).get("message", {})
 
-			exchange_consent_token(accounts_response_value, bank, company)
+			new_consent_token = exchange_consent_token(accounts_response_value, bank, company)
+			persist_consent_token(bank, company, new_consent_token)
+			frappe.db.commit()
 			accounts_response.raise_for_status()
 
 			return accounts_response_value.get("result", {}).get("accounts", [])
@@ -150,31 +180,76 @@ class Admin:
 			ExceptionHandler(exc)
 
 	def consent_transactions(self, account: str, start_date: str):
+		"""Sync all pages of transactions since `start_date` via the consent API.
+
+		Every page is committed together with the consent token of its response and a
+		checkpoint in a Bank Sync Run. If a previous run of this account failed, it is
+		resumed from its last checkpoint instead.
+		"""
 		next_page, url, offset = True, None, None
+		bank, company, unsaved_token = None, None, None
+		sync_run = get_resumable_sync_run(account)
+		if sync_run:
+			start_date = formatdate(sync_run.start_date, "YYYY-MM-dd")
+			url, offset = sync_run.next_url, sync_run.next_offset
+		else:
+			sync_run = start_sync_run(account, start_date)
+
+		# Per run, identical transactions can be on different pages
+		occurrences = sync_run.get_occurrences()
+
 		try:
 			account_id, bank, company = frappe.db.get_value(
 				"Bank Account", account, ["kosma_account_id", "bank", "company"]
 			)
 			consent_id, consent_token = get_consent_data(bank, company)
 			while next_page:
-				response = self.request.consent_transactions(
+				page_started_at = now_datetime()
+				with self.request.consent_transactions(
 					account_id, start_date, consent_id, consent_token, url, offset
-				)
-				transactions_value = to_json(response).get("message", {})
+				) as response:
+					# Spooled, so that the consent token is read before any transaction
+					transaction = StreamedAdminTransaction.from_response(response, spool=True)
+
+				log_transfer(response)
+
+				# The previous token is invalid now. The new one is written with the
+				# page's checkpoint, or with the failed run.
+				new_consent_token = exchange_consent_token(transaction.message, bank, company)
+				if new_consent_token:
+					consent_token = unsaved_token = new_consent_token
 
-				new_consent_token = exchange_consent_token(transactions_value, bank, company)
 				response.raise_for_status()
 
 				# Process Request Response
-				transaction = AdminTransaction(transactions_value)
 				next_page = transaction.is_next_page()
 				if next_page:
 					url, offset = transaction.next_page_request()
-					consent_token = new_consent_token
 
-				if transaction.transaction_list:
-					create_bank_transactions(account, transaction.transaction_list)
+				created = create_bank_transactions(
+					account, transaction.transaction_list, occurrences=occurrences
+				)
+
+				# Checkpoint: commit the page
+				persist_consent_token(bank, company, unsaved_token)
+				sync_run.add_checkpoint(
+					url if next_page else None,
+					offset if next_page else None,
+					created,
+					page_started_at,
+					occurrences,
+				)
+				frappe.db.commit()
+				unsaved_token = None
+
+			sync_run.complete()
+			frappe.db.commit()
 		except Exception as exc:
+			# Discard the incomplete page, keep the checkpoints of the committed ones
+			frappe.db.rollback()
+			persist_consent_token(bank, company, unsaved_token)
+			sync_run.fail(frappe.get_traceback())
+			frappe.db.commit()
 			ExceptionHandler(exc)
 
 	def end_session(self, session_id: str, session_id_short: str) -> None:
@@ -221,6 +296,42 @@ class Admin:
 		bank_consent.save()
 
 
+def get_admin_settings(settings) -> frappe._dict:
+	"""Return the values of the Banking Settings that are needed to talk to the Admin App."""
+	return frappe._dict(
+		use_test_environment=settings.use_test_environment,
+		api_token=settings.get_password("api_token"),
+		customer_id=settings.customer_id,
+		url=settings.admin_endpoint + "/api/method/",
+	)
+
+
+def get_cached_admin_settings() -> frappe._dict:
+	"""Return the Admin settings of the current site, loading and decrypting them only once per worker."""
+	cache = frappe.cache()
+	version = cache.get_value(ADMIN_SETTINGS_VERSION_KEY)
+	cached = _admin_settings_cache.get(frappe.local.site)
+	if version and cached and cached[0] == version:
+		return cached[1]
+
+	if not version:
+		# Set before loading: if the settings are saved while they are loaded, the
+		# version is deleted again and the stale values are not used for long.
+		version = frappe.generate_hash(length=10)
+		cache.set_value(
+			ADMIN_SETTINGS_VERSION_KEY, version, expires_in_sec=ADMIN_SETTINGS_TTL
+		)
+
+	admin_settings = get_admin_settings(frappe.get_single("Banking Settings"))
+	_admin_settings_cache[frappe.local.site] = (version, admin_settings)
+	return admin_settings
+
+
+def clear_admin_settings_cache() -> None:
+	"""Make all workers reload the Admin settings on their next use."""
+	frappe.cache().delete_value(ADMIN_SETTINGS_VERSION_KEY)
+
+
 @frappe.whitelist()
 def sync_kosma_transactions(account: str, session_id_short: Optional[str] = None):
 	"""Fetch and insert paginated Kosma transactions"""
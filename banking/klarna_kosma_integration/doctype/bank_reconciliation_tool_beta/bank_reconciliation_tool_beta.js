@@ -66,7 +66,11 @@ frappe.ui.form.on('Bank Reconciliation Tool Beta', {
 						freeze: true,
 						freeze_message: __("Auto Reconciling ..."),
 						callback: (r) => {
-							if (!r.exc) {
+							if (r.exc) return;
+
+							if (frm.panel_manager) {
+								frm.panel_manager.refresh_changes();
+							} else {
 								frm.refresh();
 							}
 						},
@@ -8,7 +8,7 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 from frappe.query_builder.custom import ConstantColumn
-from frappe.utils import cint, flt, sbool
+from frappe.utils import add_to_date, cint, flt, getdate, now, sbool
 from frappe.query_builder.functions import Cast, Coalesce
 
 from erpnext import get_company_currency, get_default_cost_center
@@ -17,6 +17,10 @@ from erpnext.accounts.doctype.bank_transaction.bank_transaction import (
 	get_total_allocated_amount,
 )
 from erpnext.accounts.utils import get_account_currency
+from banking.instrumentation import add_rows, instrument
+from banking.klarna_kosma_integration.doctype.banking_slow_query.banking_slow_query import (
+	run_query,
+)
 from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.utils import (
 	amount_rank_condition,
 	get_description_match_condition,
@@ -28,12 +32,41 @@ from pypika import Order
 
 MAX_QUERY_RESULTS = 150
 
+# Transactions per page of the Bank Reconciliation Tool Beta's list
+PAGE_LENGTH = 100
+MAX_PAGE_LENGTH = 1000
+
+# Changes are looked up this many seconds before the client's version, so that
+# transactions committed late by a long-running sync are not missed
+CHANGES_OVERLAP = 10 * 60
+
+SORT_FIELDS = ("date", "withdrawal", "deposit", "unallocated_amount")
+
+BANK_TRANSACTION_FIELDS = [
+	"date",
+	"deposit",
+	"withdrawal",
+	"currency",
+	"description",
+	"name",
+	"bank_account",
+	"company",
+	"unallocated_amount",
+	"reference_number",
+	"party_type",
+	"party",
+	"bank_party_name",
+	"bank_party_account_number",
+	"bank_party_iban",
+]
+
 
 class BankReconciliationToolBeta(Document):
 	pass
 
 
 @frappe.whitelist()
+@instrument()
 def get_bank_transactions(
 	bank_account: str,
 	from_date: str | datetime.date = None,
@@ -41,6 +74,133 @@ def get_bank_transactions(
 	order_by: str | datetime.date = "date asc",
 ):
 	"""Return bank transactions for a bank account"""
+	return frappe.get_list(
+		"Bank Transaction",
+		fields=BANK_TRANSACTION_FIELDS,
+		filters=get_bank_transaction_filters(bank_account, from_date, to_date),
+		order_by=order_by,
+	)
+
+
+@frappe.whitelist()
+@instrument()
+def get_bank_transactions_page(
+	bank_account: str,
+	from_date: str | datetime.date = None,
+	to_date: str | datetime.date = None,
+	order_by: str = "date asc",
+	cursor: str | list = None,
+	page_length: int = PAGE_LENGTH,
+) -> dict:
+	"""Return a page of bank transactions for a bank account, sorted by `order_by` and name.
+
+	`cursor` is the `cursor` of the previous page: the sort value and name of its last
+	transaction. It is None on the last page. The total count and the `version` for
+	`get_bank_transaction_changes` are only returned for the first page (without `cursor`).
+	"""
+	sort_field, sort_order = parse_order_by(order_by)
+	filters = get_bank_transaction_filters(bank_account, from_date, to_date)
+	page_length = min(cint(page_length) or PAGE_LENGTH, MAX_PAGE_LENGTH)
+
+	total_count, version, or_filters = None, None, None
+	if cursor:
+		# (sort_field, name) > (value, name), for ascending order
+		value, name = frappe.parse_json(cursor)
+		operator = ">" if sort_order == "asc" else "<"
+		filters.append([sort_field, f"{operator}=", value])
+		or_filters = [[sort_field, operator, value], ["name", operator, name]]
+	else:
+		version = now()
+		total_count = get_bank_transaction_count(filters)
+
+	transactions = frappe.get_list(
+		"Bank Transaction",
+		fields=BANK_TRANSACTION_FIELDS,
+		filters=filters,
+		or_filters=or_filters,
+		order_by=f"{sort_field} {sort_order}, name {sort_order}",
+		limit_page_length=page_length + 1,
+	)
+
+	next_cursor = None
+	if len(transactions) > page_length:
+		transactions = transactions[:page_length]
+		next_cursor = [transactions[-1][sort_field], transactions[-1].name]
+
+	add_rows(len(transactions))
+	return {
+		"transactions": transactions,
+		"cursor": next_cursor,
+		"total_count": total_count,
+		"version": version,
+	}
+
+
+@frappe.whitelist()
+@instrument()
+def get_bank_transaction_changes(
+	bank_account: str,
+	since: str,
+	from_date: str | datetime.date = None,
+	to_date: str | datetime.date = None,
+) -> dict:
+	"""Return the bank transactions of a bank account that changed since the `since` version.
+
+	`changed` are new or updated transactions that belong in the list, `removed` are the
+	names of changed transactions that don't (anymore), e.g. because they were reconciled.
+	Both include transactions changed up to `CHANGES_OVERLAP` seconds before `since`, and
+	transactions that the client has not loaded. `total_count` is the current number of
+	transactions in the list. Pass the returned `version` as `since` to the next call.
+	"""
+	# Taken before the query, so that no change is missed. Overlaps are harmless.
+	version = now()
+	from_date = getdate(from_date) if from_date else None
+	to_date = getdate(to_date) if to_date else None
+
+	changed, removed = [], []
+	for transaction in frappe.get_list(
+		"Bank Transaction",
+		fields=[*BANK_TRANSACTION_FIELDS, "docstatus"],
+		filters=[
+			["bank_account", "=", bank_account],
+			["modified", ">=", add_to_date(since, seconds=-CHANGES_OVERLAP)],
+		],
+		order_by="modified asc",
+	):
+		is_listed = (
+			transaction.docstatus == 1
+			and flt(transaction.unallocated_amount) > 0.001
+			and (not from_date or getdate(transaction.date) >= from_date)
+			and (not to_date or getdate(transaction.date) <= to_date)
+		)
+		if is_listed:
+			transaction.pop("docstatus")
+			changed.append(transaction)
+		else:
+			removed.append(transaction.name)
+
+	add_rows(len(changed) + len(removed))
+	return {
+		"changed": changed,
+		"removed": removed,
+		"total_count": get_bank_transaction_count(
+			get_bank_transaction_filters(bank_account, from_date, to_date)
+		),
+		"version": version,
+	}
+
+
+def get_bank_transaction_count(filters: list) -> int:
+	return frappe.get_list(
+		"Bank Transaction", fields=["count(name) as total_count"], filters=filters
+	)[0].total_count
+
+
+def get_bank_transaction_filters(
+	bank_account: str,
+	from_date: str | datetime.date = None,
+	to_date: str | datetime.date = None,
+) -> list:
 	filters = [
 		["bank_account", "=", bank_account],
 		["docstatus", "=", 1],
@@ -53,28 +213,17 @@ def get_bank_transactions(
 	if from_date:
 		filters.append(["date", ">=", from_date])
 
-	return frappe.get_list(
-		"Bank Transaction",
-		fields=[
-			"date",
-			"deposit",
-			"withdrawal",
-			"currency",
-			"description",
-			"name",
-			"bank_account",
-			"company",
-			"unallocated_amount",
-			"reference_number",
-			"party_type",
-			"party",
-			"bank_party_name",
-			"bank_party_account_number",
-			"bank_party_iban",
-		],
-		filters=filters,
-		order_by=order_by,
-	)
+	return filters
+
+
+def parse_order_by(order_by: str) -> tuple[str, str]:
+	"""Validate `order_by` ("<fieldname> <asc|desc>") and return its parts."""
+	sort_field, _sep, sort_order = (order_by or "date asc").strip().partition(" ")
+	sort_order = sort_order.strip().lower() or "asc"
+	if sort_field not in SORT_FIELDS or sort_order not in ("asc", "desc"):
+		frappe.throw(_("Cannot sort Bank Transactions by {0}").format(order_by))
+
+	return sort_field, sort_order
 
 
 @frappe.whitelist()
@@ -251,6 +400,7 @@ def create_payment_entry_bts(
 
 
 @frappe.whitelist()
+@instrument()
 def bulk_reconcile_vouchers(
 	bank_transaction_name: str,
 	vouchers: str | list[dict],
@@ -324,6 +474,7 @@ def upload_bank_statement(**args):
 
 
 @frappe.whitelist()
+@instrument()
 def auto_reconcile_vouchers(
 	bank_account: str,
 	from_date: str | datetime.date = None,
@@ -399,6 +550,7 @@ def auto_reconcile_vouchers(
 
 
 @frappe.whitelist()
+@instrument()
 def get_linked_payments(
 	bank_transaction_name: str,
 	document_types: str | list,
@@ -463,6 +615,7 @@ def subtract_allocations(gl_account, vouchers):
 					voucher["paid_amount"] -= value["total"]
 
 
+@instrument()
 def check_matching(
 	bank_account: str,
 	company: str,
@@ -500,7 +653,7 @@ def check_matching(
 
 	matching_vouchers = []
 	for query in queries:
-		matching_vouchers.extend(query.run(as_dict=True))
+		matching_vouchers.extend(run_query(query, as_dict=True))
 
 	if not matching_vouchers:
 		return []
@@ -0,0 +1,422 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+"""Synthetic data and timings for the hot paths of the Bank Reconciliation Tool Beta.
+
+Run via `bench --site <site> banking-benchmark-reconciliation`, see `banking.commands`.
+"""
+import json
+import random
+import statistics
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, flt, getdate, nowdate
+
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.bank_reconciliation_tool_beta import (
+	auto_reconcile_vouchers,
+	bulk_reconcile_vouchers,
+	get_bank_transactions,
+	get_linked_payments,
+)
+
+PREFIX = "Banking Benchmark"
+DOCUMENT_TYPES = [
+	"payment_entry",
+	"journal_entry",
+	"sales_invoice",
+	"purchase_invoice",
+	"expense_claim",
+	"unpaid_sales_invoice",
+	"unpaid_purchase_invoice",
+	"unpaid_expense_claim",
+]
+PURPOSES = (
+	"Invoice",
+	"Rechnung",
+	"Order",
+	"Payment for",
+	"SEPA-Gutschrift",
+	"SEPA-Lastschrift",
+)
+
+
+class Benchmark:
+	"""Seed one company with matching vouchers and Bank Transactions, then time the tool."""
+
+	def __init__(
+		self,
+		company: str,
+		transactions: int = 1000,
+		payments: int = 500,
+		invoices: int = 100,
+		sample: int = 50,
+		seed: int = 0,
+	) -> None:
+		self.company = frappe.get_doc("Company", company)
+		self.transactions = transactions
+		self.payments = payments
+		self.invoices = invoices
+		self.sample = sample
+		self.seed = seed
+		self.random = random.Random(seed)
+		self.from_date = add_days(nowdate(), -365)
+		self.timings: Dict[str, List[float]] = defaultdict(list)
+		self.vouchers: List[Dict] = []
+
+	def run(self) -> Dict:
+		started = time.perf_counter()
+		self.setup_masters()
+		self.seed_vouchers()
+		self.seed_bank_transactions()
+		seed_seconds = time.perf_counter() - started
+
+		self.time_reconciliation()
+
+		return {
+			"parameters": {
+				"company": self.company.name,
+				"transactions": self.transactions,
+				"payments": self.payments,
+				"invoices": self.invoices,
+				"sample": self.sample,
+				"seed": self.seed,
+			},
+			"seed_seconds": round(seed_seconds, 3),
+			"timings": {name: summarize(values) for name, values in self.timings.items()},
+		}
+
+	def setup_masters(self) -> None:
+		self.bank_account = get_or_insert(
+			"Bank Account",
+			{
+				"account_name": PREFIX,
+				"bank": get_or_insert("Bank", {"bank_name": PREFIX}),
+				"account": self.company.default_bank_account,
+				"company": self.company.name,
+				"is_company_account": 1,
+			},
+		)
+		self.item = get_or_insert(
+			"Item",
+			{
+				"item_code": PREFIX,
+				"item_group": "All Item Groups",
+				"stock_uom": "Nos",
+				"is_stock_item": 0,
+			},
+		)
+		self.customers = [
+			get_or_insert(
+				"Customer",
+				{
+					"customer_name": f"{PREFIX} Customer {i}",
+					"customer_group": "All Customer Groups",
+					"territory": "All Territories",
+				},
+			)
+			for i in range(1, 21)
+		]
+		self.suppliers = [
+			get_or_insert(
+				"Supplier",
+				{
+					"supplier_name": f"{PREFIX} Supplier {i}",
+					"supplier_group": "All Supplier Groups",
+				},
+			)
+			for i in range(1, 21)
+		]
+
+		self.with_expense_claims = "hrms" in frappe.get_installed_apps()
+		if self.with_expense_claims:
+			self.employee = get_or_insert(
+				"Employee",
+				{
+					"first_name": PREFIX,
+					"gender": "Other",
+					"date_of_birth": "1990-01-01",
+					"date_of_joining": "2020-01-01",
+					"company": self.company.name,
+				},
+			)
+			self.expense_claim_type = get_or_insert(
+				"Expense Claim Type",
+				{
+					"expense_type": PREFIX,
+					"accounts": [
+						{
+							"company": self.company.name,
+							"default_account": self.company.default_expense_account,
+						}
+					],
+				},
+			)
+
+	def seed_vouchers(self) -> None:
+		for i in range(self.payments):
+			seeder = (self.insert_payment_entry, self.insert_journal_entry)[i % 2]
+			self.vouchers.append(seeder(i))
+
+		for i in range(self.invoices):
+			self.vouchers.append(self.insert_sales_invoice(i))
+			self.vouchers.append(self.insert_purchase_invoice(i))
+			if self.with_expense_claims:
+				self.vouchers.append(self.insert_expense_claim(i))
+
+	def seed_bank_transactions(self) -> None:
+		self.random.shuffle(self.vouchers)
+		for i in range(self.transactions):
+			if i < len(self.vouchers):
+				voucher = self.vouchers[i]
+			else:
+				# Noise: no voucher to match
+				voucher = {
+					"amount": self.get_amount(),
+					"is_deposit": self.random.random() < 0.5,
+					"reference": f"NOTPROVIDED {self.random.randint(10**7, 10**8)}",
+					"party_name": f"{PREFIX} Unknown {self.random.randint(1, 1000)}",
+				}
+
+			frappe.get_doc(
+				{
+					"doctype": "Bank Transaction",
+					"company": self.company.name,
+					"bank_account": self.bank_account,
+					"date": self.get_date(),
+					"deposit": voucher["amount"] if voucher["is_deposit"] else 0,
+					"withdrawal": 0 if voucher["is_deposit"] else voucher["amount"],
+					"currency": self.company.default_currency,
+					"reference_number": voucher["reference"] if i % 3 else None,
+					"description": self.get_description(voucher),
+					"bank_party_name": voucher["party_name"],
+				}
+			).insert().submit()
+
+	def time_reconciliation(self) -> None:
+		transactions = self.timed(
+			"get_bank_transactions", get_bank_transactions, self.bank_account, self.from_date
+		)
+		sample = self.random.sample(transactions, min(self.sample, len(transactions)))
+
+		# Reconcile the sample manually, leave the rest for auto reconciliation
+		for transaction in sample:
+			matches = self.timed(
+				"get_linked_payments",
+				get_linked_payments,
+				transaction.name,
+				DOCUMENT_TYPES,
+				self.from_date,
+			)
+			if not matches:
+				continue
+
+			match = matches[0]
+			self.timed(
+				"bulk_reconcile_vouchers",
+				bulk_reconcile_vouchers,
+				transaction.name,
+				json.dumps(
+					[
+						{
+							"payment_doctype": match.get("doctype"),
+							"payment_name": match.get("name"),
+							"amount": match.get("paid_amount"),
+							"party": match.get("party"),
+						}
+					]
+				),
+			)
+
+		self.timed(
+			"auto_reconcile_vouchers", auto_reconcile_vouchers, self.bank_account, self.from_date
+		)
+
+	def timed(self, name: str, function: Callable, *args, **kwargs):
+		started = time.perf_counter()
+		result = function(*args, **kwargs)
+		self.timings[name].append(time.perf_counter() - started)
+		return result
+
+	def insert_payment_entry(self, i: int) -> Dict:
+		is_deposit = i % 4 == 0
+		party_type, party = (
+			("Customer", self.random.choice(self.customers))
+			if is_deposit
+			else ("Supplier", self.random.choice(self.suppliers))
+		)
+		amount = self.get_amount()
+		reference = f"PAY-{self.get_date().year}-{i:06d}"
+		doc = frappe.get_doc(
+			{
+				"doctype": "Payment Entry",
+				"payment_type": "Receive" if is_deposit else "Pay",
+				"company": self.company.name,
+				"posting_date": self.get_date(),
+				"party_type": party_type,
+				"party": party,
+				"paid_from": self.company.default_receivable_account
+				if is_deposit
+				else self.company.default_bank_account,
+				"paid_to": self.company.default_bank_account
+				if is_deposit
+				else self.company.default_payable_account,
+				"paid_amount": amount,
+				"received_amount": amount,
+				"source_exchange_rate": 1,
+				"target_exchange_rate": 1,
+				"reference_no": reference,
+				"reference_date": self.get_date(),
+			}
+		).insert()
+		doc.submit()
+		return make_voucher(amount, is_deposit, reference, party)
+
+	def insert_journal_entry(self, i: int) -> Dict:
+		amount = self.get_amount()
+		reference = f"JV-{i:06d}/{self.random.randint(100, 999)}"
+		doc = frappe.get_doc(
+			{
+				"doctype": "Journal Entry",
+				"company": self.company.name,
+				"posting_date": self.get_date(),
+				"cheque_no": reference,
+				"cheque_date": self.get_date(),
+				"accounts": [
+					{
+						"account": self.company.default_bank_account,
+						"debit_in_account_currency": amount,
+					},
+					{
+						"account": self.company.default_income_account,
+						"cost_center": self.company.cost_center,
+						"credit_in_account_currency": amount,
+					},
+				],
+			}
+		).insert()
+		doc.submit()
+		return make_voucher(amount, True, reference, PREFIX)
+
+	def insert_sales_invoice(self, i: int) -> Dict:
+		customer = self.random.choice(self.customers)
+		doc = self.insert_invoice("Sales Invoice", {"customer": customer})
+		return make_voucher(doc.grand_total, True, doc.name, customer)
+
+	def insert_purchase_invoice(self, i: int) -> Dict:
+		supplier = self.random.choice(self.suppliers)
+		doc = self.insert_invoice(
+			"Purchase Invoice", {"supplier": supplier, "bill_no": f"BILL-{i:06d}"}
+		)
+		return make_voucher(doc.grand_total, False, doc.bill_no, supplier)
+
+	def insert_invoice(self, doctype: str, values: Dict) -> "frappe.model.document.Document":
+		posting_date = self.get_date()
+		doc = frappe.get_doc(
+			{
+				"doctype": doctype,
+				"company": self.company.name,
+				"set_posting_time": 1,
+				"posting_date": posting_date,
+				"due_date": add_days(posting_date, 30),
+				"items": [{"item_code": self.item, "qty": 1, "rate": self.get_amount()}],
+				**values,
+			}
+		).insert()
+		doc.submit()
+		return doc
+
+	def insert_expense_claim(self, i: int) -> Dict:
+		amount = self.get_amount()
+		doc = frappe.get_doc(
+			{
+				"doctype": "Expense Claim",
+				"company": self.company.name,
+				"employee": self.employee,
+				"posting_date": self.get_date(),
+				"approval_status": "Approved",
+				"payable_account": self.company.default_expense_claim_payable_account
+				or self.company.default_payable_account,
+				"cost_center": self.company.cost_center,
+				"expenses": [
+					{
+						"expense_type": self.expense_claim_type,
+						"expense_date": self.get_date(),
+						"amount": amount,
+						"sanctioned_amount": amount,
+					}
+				],
+			}
+		).insert()
+		doc.submit()
+		return make_voucher(amount, False, doc.name, PREFIX)
+
+	def get_amount(self) -> float:
+		return flt(self.random.lognormvariate(5, 1.2), 2) or 1.0
+
+	def get_date(self):
+		return getdate(add_days(self.from_date, self.random.randint(0, 364)))
+
+	def get_description(self, voucher: Dict) -> str:
+		return " ".join(
+			(
+				self.random.choice(PURPOSES),
+				voucher["reference"],
+				voucher["party_name"],
+				f"EREF+{self.random.randint(10**9, 10**10)}",
+			)
+		)
+
+
+def run_benchmark(company: Optional[str] = None, keep: bool = False, **kwargs) -> Dict:
+	"""Seed and time, then roll back all generated data unless `keep` is set."""
+	company = company or frappe.defaults.get_global_default("company")
+	if not company:
+		frappe.throw(_("Please pass a company, there is no default company on this site."))
+
+	frappe.flags.mute_messages = True
+	if keep:
+		frappe.db.auto_commit_on_many_writes = True
+	else:
+		frappe.db.MAX_WRITES_PER_TRANSACTION = float("inf")
+
+	try:
+		results = Benchmark(company, **kwargs).run()
+	finally:
+		frappe.flags.mute_messages = False
+		if keep:
+			frappe.db.commit()
+		else:
+			frappe.db.rollback()
+
+	return results
+
+
+def get_or_insert(doctype: str, values: Dict) -> str:
+	filters = {key: value for key, value in values.items() if not isinstance(value, list)}
+	return frappe.db.exists(doctype, filters) or frappe.get_doc(
+		{"doctype": doctype, **values}
+	).insert().name
+
+
+def make_voucher(amount: float, is_deposit: bool, reference: str, party_name: str) -> Dict:
+	return {
+		"amount": amount,
+		"is_deposit": is_deposit,
+		"reference": reference,
+		"party_name": party_name,
+	}
+
+
+def summarize(values: List[float]) -> Dict:
+	values = sorted(values)
+	return {
+		"calls": len(values),
+		"total": round(sum(values), 4),
+		"mean": round(statistics.fmean(values), 4),
+		"median": round(statistics.median(values), 4),
+		"p95": round(values[int(0.95 * (len(values) - 1))], 4),
+		"max": round(values[-1], 4),
+	}
@@ -4,7 +4,7 @@ import json
 
 import frappe
 from frappe.custom.doctype.custom_field.custom_field import create_custom_field
-from frappe.utils import add_days, getdate
+from frappe.utils import add_days, add_to_date, getdate, now
 from frappe.tests.utils import FrappeTestCase
 
 
@@ -25,6 +25,9 @@ from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.bank
 	bulk_reconcile_vouchers,
 	create_journal_entry_bts,
 	create_payment_entry_bts,
+	get_bank_transaction_changes,
+	get_bank_transactions,
+	get_bank_transactions_page,
 	get_linked_payments,
 )
 
@@ -492,6 +495,77 @@ class TestBankReconciliationToolBeta(AccountsTestMixin, FrappeTestCase):
 		self.assertEqual(bt.status, "Unreconciled")
 		self.assertEqual(bt.unallocated_amount, 50)
 
+	def test_bank_transactions_page(self):
+		"""
+		Test that paging with the cursor returns all transactions exactly once, in order.
+		"""
+		bank_account = create_bank_account(
+			gl_account=self.gl_account, bank_account_name="Paging Account"
+		)
+		for days in (-3, -2, -2, -2, -1):
+			create_bank_transaction(
+				date=add_days(getdate(), days), deposit=100, bank_account=bank_account
+			)
+
+		expected = [
+			transaction.name
+			for transaction in get_bank_transactions(bank_account, order_by="date desc, name desc")
+		]
+
+		names, cursor, total_count = [], None, None
+		while True:
+			page = get_bank_transactions_page(
+				bank_account, order_by="date desc", cursor=cursor, page_length=2
+			)
+			total_count = page["total_count"] if cursor is None else total_count
+			names.extend(transaction.name for transaction in page["transactions"])
+			cursor = page["cursor"]
+			if not cursor:
+				break
+
+		self.assertEqual(total_count, 5)
+		self.assertEqual(names, expected)
+
+		with self.assertRaises(frappe.ValidationError):
+			get_bank_transactions_page(bank_account, order_by="name; drop table")
+
+	def test_bank_transaction_changes(self):
+		"""
+		Test that only transactions changed since the version are returned.
+		"""
+		bank_account = create_bank_account(
+			gl_account=self.gl_account, bank_account_name="Changes Account"
+		)
+		unchanged = create_bank_transaction(deposit=100, bank_account=bank_account)
+		# Outside of the overlap margin
+		unchanged.db_set("modified", add_to_date(now(), hours=-1), update_modified=False)
+		updated = create_bank_transaction(deposit=200, bank_account=bank_account)
+		cancelled = create_bank_transaction(deposit=300, bank_account=bank_account)
+
+		version = get_bank_transactions_page(bank_account)["version"]
+
+		updated.db_set("reference_number", "Delta001")
+		cancelled.cancel()
+		new = create_bank_transaction(deposit=400, bank_account=bank_account)
+		# Never part of the list
+		never_listed = create_bank_transaction(deposit=500, bank_account=bank_account)
+		never_listed.cancel()
+
+		changes = get_bank_transaction_changes(bank_account, since=version)
+
+		changed = {transaction.name: transaction for transaction in changes["changed"]}
+		self.assertNotIn(unchanged.name, changed)
+		self.assertEqual(changed[updated.name].reference_number, "Delta001")
+		self.assertIn(new.name, changed)
+		self.assertCountEqual(changes["removed"], [cancelled.name, never_listed.name])
+		# unchanged, updated and new
+		self.assertEqual(changes["total_count"], 3)
+
+		# Changes are returned again if they overlap, the total count stays the same
+		changes = get_bank_transaction_changes(bank_account, since=changes["version"])
+		self.assertIn(updated.name, [transaction.name for transaction in changes["changed"]])
+		self.assertEqual(changes["total_count"], 3)
+
 	def test_multi_party_reconciliation(self):
 		bt = create_bank_transaction(
 			deposit=150,
@@ -0,0 +1,131 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+import json
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_to_date, now_datetime, time_diff_in_seconds
+
+# A run that has been "Running" for longer than this was interrupted (e.g. the
+# worker was killed) and may be resumed.
+STALE_RUN_MINUTES = 60
+
+
+class BankSyncRun(Document):
+	"""Tracks a paginated bank sync so that it can be resumed after a failure.
+
+	Checkpoints are written with `db_insert`/`db_set` and become durable with the
+	caller's next commit, i.e. together with the page they describe.
+	"""
+
+	def add_checkpoint(
+		self,
+		next_url: Optional[str],
+		next_offset: Optional[str],
+		transactions: int,
+		page_started_at: datetime,
+		occurrences: Optional[Counter] = None,
+	) -> None:
+		"""Record a processed page and where to continue from. Does not commit.
+
+		Pass the `occurrences` of the transaction fingerprints, so that a resumed run
+		continues counting them, see `get_occurrences`.
+		"""
+		now = now_datetime()
+		checkpoint = self.append(
+			"checkpoints",
+			{
+				"page": len(self.checkpoints) + 1,
+				"offset": next_offset,
+				"transactions": transactions,
+				"duration": time_diff_in_seconds(now, page_started_at),
+				"committed_at": now,
+			},
+		)
+		checkpoint.db_insert()
+
+		values = {
+			"next_url": next_url,
+			"next_offset": next_offset,
+			"pages": len(self.checkpoints),
+			"transactions": (self.transactions or 0) + transactions,
+			"duration": time_diff_in_seconds(now, self.started_at),
+		}
+		if occurrences is not None:
+			values["occurrences"] = json.dumps(occurrences)
+
+		self.db_set(values)
+
+	def get_occurrences(self) -> Counter:
+		"""Return the occurrences of the transaction fingerprints of the committed pages."""
+		return Counter(json.loads(self.occurrences or "{}"))
+
+	def complete(self) -> None:
+		self.finish("Completed")
+
+	def fail(self, error: Optional[str] = None) -> None:
+		self.finish("Failed", error=error)
+
+	def finish(self, status: str, error: Optional[str] = None) -> None:
+		now = now_datetime()
+		values = {
+			"status": status,
+			"finished_at": now,
+			"duration": time_diff_in_seconds(now, self.started_at),
+			"error": error,
+		}
+		if status == "Completed":
+			values.update({"next_url": None, "next_offset": None, "occurrences": None})
+
+		self.db_set(values)
+
+
+def start_sync_run(
+	bank_account: Optional[str],
+	start_date: Optional[str],
+	source: str = "Kosma",
+	ebics_user: Optional[str] = None,
+	end_date: Optional[str] = None,
+) -> BankSyncRun:
+	"""Insert and commit a new run, so that it survives a crash of the sync."""
+	sync_run = frappe.get_doc(
+		{
+			"doctype": "Bank Sync Run",
+			"bank_account": bank_account,
+			"source": source,
+			"ebics_user": ebics_user,
+			"status": "Running",
+			"start_date": start_date,
+			"end_date": end_date,
+			"started_at": now_datetime(),
+		}
+	).insert(ignore_permissions=True)
+	frappe.db.commit()
+	return sync_run
+
+
+def get_resumable_sync_run(bank_account: str, source: str = "Kosma") -> Optional[BankSyncRun]:
+	"""Return the latest failed (or stale) run of the account that has pages left to sync."""
+	last_run = frappe.db.get_value(
+		"Bank Sync Run",
+		{"bank_account": bank_account, "source": source},
+		["name", "status", "next_url", "modified"],
+		order_by="creation desc",
+		as_dict=True,
+	)
+	if not last_run or not last_run.next_url:
+		return None
+
+	is_stale = last_run.status == "Running" and last_run.modified < add_to_date(
+		now_datetime(), minutes=-STALE_RUN_MINUTES
+	)
+	if last_run.status != "Failed" and not is_stale:
+		return None
+
+	sync_run = frappe.get_doc("Bank Sync Run", last_run.name)
+	sync_run.db_set({"status": "Running", "error": None, "finished_at": None})
+	frappe.db.commit()
+	return sync_run
@@ -0,0 +1,133 @@
+# Copyright (c) 2025, ALYF GmbH and Contributors
+# See license.txt
+from collections import Counter
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now_datetime
+
+from banking.klarna_kosma_integration.doctype.bank_sync_run.bank_sync_run import (
+	STALE_RUN_MINUTES,
+	get_resumable_sync_run,
+	start_sync_run,
+)
+
+
+class TestBankSyncRun(FrappeTestCase):
+	def setUp(self):
+		# Runs commit on their own, keep the test data in the test's transaction
+		commit = patch.object(frappe.db, "commit")
+		commit.start()
+		self.addCleanup(commit.stop)
+
+		if not frappe.db.exists("Bank", "Sync Run Bank"):
+			frappe.get_doc({"doctype": "Bank", "bank_name": "Sync Run Bank"}).insert()
+
+		self.bank_account = frappe.db.get_value(
+			"Bank Account", {"account_name": "Sync Run Account", "bank": "Sync Run Bank"}
+		) or (
+			frappe.get_doc(
+				{
+					"doctype": "Bank Account",
+					"account_name": "Sync Run Account",
+					"bank": "Sync Run Bank",
+				}
+			)
+			.insert()
+			.name
+		)
+
+	def test_checkpoints(self):
+		sync_run = start_sync_run(self.bank_account, "2025-01-01")
+		self.assertEqual(sync_run.status, "Running")
+
+		sync_run.add_checkpoint("https://next.page", "50", 50, now_datetime())
+		sync_run.add_checkpoint("https://next.page", "100", 30, now_datetime())
+
+		sync_run.reload()
+		self.assertEqual(sync_run.pages, 2)
+		self.assertEqual(sync_run.transactions, 80)
+		self.assertEqual(sync_run.next_offset, "100")
+		self.assertEqual([row.offset for row in sync_run.checkpoints], ["50", "100"])
+
+		sync_run.complete()
+		sync_run.reload()
+		self.assertEqual(sync_run.status, "Completed")
+		self.assertIsNone(sync_run.next_url)
+		self.assertIsNone(sync_run.next_offset)
+		self.assertIsNone(get_resumable_sync_run(self.bank_account))
+
+	def test_resume_failed_run(self):
+		sync_run = start_sync_run(self.bank_account, "2025-01-01")
+		sync_run.add_checkpoint("https://next.page", "50", 50, now_datetime())
+		sync_run.fail("Connection reset")
+
+		sync_run.reload()
+		self.assertEqual(sync_run.status, "Failed")
+		self.assertEqual(sync_run.error, "Connection reset")
+
+		resumed = get_resumable_sync_run(self.bank_account)
+		self.assertEqual(resumed.name, sync_run.name)
+		self.assertEqual(resumed.status, "Running")
+		self.assertIsNone(resumed.error)
+		self.assertEqual((resumed.next_url, resumed.next_offset), ("https://next.page", "50"))
+		self.assertEqual(len(resumed.checkpoints), 1)
+
+	def test_resume_occurrences(self):
+		sync_run = start_sync_run(self.bank_account, "2025-01-01")
+		self.assertEqual(sync_run.get_occurrences(), Counter())
+
+		occurrences = Counter({"a1b2c3": 2})
+		sync_run.add_checkpoint("https://next.page", "50", 50, now_datetime(), occurrences)
+		sync_run.fail()
+
+		# Identical transactions on later pages get the next fingerprints
+		resumed = get_resumable_sync_run(self.bank_account)
+		self.assertEqual(resumed.get_occurrences(), occurrences)
+
+		resumed.complete()
+		resumed.reload()
+		self.assertIsNone(resumed.occurrences)
+
+	def test_no_resume_without_next_page(self):
+		sync_run = start_sync_run(self.bank_account, "2025-01-01")
+		sync_run.fail("Failed on the first page")
+
+		self.assertIsNone(get_resumable_sync_run(self.bank_account))
+
+	def test_resume_stale_run(self):
+		sync_run = start_sync_run(self.bank_account, "2025-01-01")
+		sync_run.add_checkpoint("https://next.page", "50", 50, now_datetime())
+
+		# Still running
+		self.assertIsNone(get_resumable_sync_run(self.bank_account))
+
+		# Interrupted, e.g. the worker was killed
+		frappe.db.set_value(
+			"Bank Sync Run",
+			sync_run.name,
+			"modified",
+			add_to_date(now_datetime(), minutes=-STALE_RUN_MINUTES - 1),
+			update_modified=False,
+		)
+		resumed = get_resumable_sync_run(self.bank_account)
+		self.assertEqual(resumed.name, sync_run.name)
+		self.assertEqual(resumed.next_offset, "50")
+
+	def test_resume_latest_run_only(self):
+		failed_run = start_sync_run(self.bank_account, "2025-01-01")
+		failed_run.add_checkpoint("https://next.page", "50", 50, now_datetime())
+		failed_run.fail()
+
+		# A later run supersedes the failed one
+		frappe.db.set_value(
+			"Bank Sync Run",
+			failed_run.name,
+			"creation",
+			add_to_date(now_datetime(), minutes=-1),
+			update_modified=False,
+		)
+		start_sync_run(self.bank_account, "2025-01-01").complete()
+
+		self.assertIsNone(get_resumable_sync_run(self.bank_account))
@@ -0,0 +1,8 @@
+// Copyright (c) 2025, ALYF GmbH and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("Bank Transaction Staging", {
+	// refresh(frm) {
+
+	// },
+});
@@ -0,0 +1,303 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+import datetime
+import json
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import cint, getdate, now_datetime
+
+STAGING_JOB_ID = "process_staged_bank_transactions"
+DEFAULT_BATCH_SIZE = 500
+
+# Key of staged values: set the Bank Account's last integration date once created
+UPDATE_INTEGRATION_DATE = "update_last_integration_date"
+
+
+class BankTransactionStaging(Document):
+	"""Raw, normalized bank transactions as downloaded from the bank.
+
+	Downloading (Kosma/EBICS) only writes to this table. Bank Transactions are
+	created from it by a separate job, see `process_staged_transactions`.
+	"""
+
+
+def stage_bank_transactions(source: str, rows: List[Dict]) -> None:
+	"""Bulk insert normalized Bank Transaction values into the staging table.
+
+	:param source: "Kosma" or "EBICS"
+	:param rows: values of the Bank Transactions to be created, in booking order
+	"""
+	if not rows:
+		return
+
+	now = now_datetime()
+	user = frappe.session.user
+	fields = [
+		"name",
+		"creation",
+		"modified",
+		"owner",
+		"modified_by",
+		"docstatus",
+		"idx",
+		"source",
+		"status",
+		"bank_account",
+		"transaction_id",
+		"date",
+		"data",
+	]
+	values = [
+		(
+			frappe.generate_hash(length=10),
+			now,
+			now,
+			user,
+			user,
+			0,
+			idx,
+			source,
+			"Pending",
+			row.get("bank_account"),
+			row.get("transaction_id"),
+			row.get("date"),
+			frappe.as_json(row, indent=None),
+		)
+		for idx, row in enumerate(rows, start=1)
+	]
+	frappe.db.bulk_insert("Bank Transaction Staging", fields, values)
+
+
+def enqueue_staged_transactions() -> None:
+	"""Enqueue the consumer job, unless it is queued or running already."""
+	frappe.enqueue(
+		process_staged_transactions,
+		queue="long",
+		job_id=STAGING_JOB_ID,
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
+
+
+def process_pending_staged_transactions() -> None:
+	"""Pick up rows left behind by an interrupted consumer. Called via hooks."""
+	if not frappe.db.get_single_value("Banking Settings", "stage_bank_transactions"):
+		return
+
+	if frappe.db.exists("Bank Transaction Staging", {"status": "Pending"}):
+		enqueue_staged_transactions()
+
+
+def process_staged_transactions(batch_size: Optional[int] = None) -> None:
+	"""Create Bank Transactions from pending staged rows, one committed batch at a time."""
+	batch_size = (
+		batch_size
+		or cint(frappe.db.get_single_value("Banking Settings", "staging_batch_size"))
+		or DEFAULT_BATCH_SIZE
+	)
+
+	while True:
+		batch = frappe.get_all(
+			"Bank Transaction Staging",
+			filters={"status": "Pending"},
+			fields=["name", "bank_account", "transaction_id", "data"],
+			order_by="creation asc, idx asc",
+			limit=batch_size,
+		)
+		if not batch:
+			break
+
+		process_batch(batch)
+		frappe.db.commit()
+
+		if len(batch) < batch_size:
+			break
+
+
+def process_batch(batch: List[Dict]) -> None:
+	"""Dedupe, map and insert one batch of staged rows.
+
+	Like a direct EBICS sync, booked rows upgrade a matching provisional Bank
+	Transaction and provisional rows of bookings that exist already are skipped,
+	see `process_camt_documents`.
+
+	Afterwards, the last integration date of the Bank Accounts is moved forward, if
+	requested by the staged values. Failed rows are kept, to be retried.
+	"""
+	from banking.ebics.utils import upgrade_provisional_transaction
+
+	existing = get_existing_transaction_ids(batch)
+	values = {row.name: json.loads(row.data) for row in batch}
+	fingerprints = get_existing_fingerprints(values.values())
+	bookings = get_existing_bookings(values.values())
+	integration_dates = {}
+
+	for row in batch:
+		data = values[row.name]
+		if data.pop(UPDATE_INTEGRATION_DATE, None):
+			date = getdate(data["date"])
+			integration_dates[row.bank_account] = max(
+				integration_dates.get(row.bank_account, date), date
+			)
+
+		key = (row.bank_account, row.transaction_id)
+		fingerprint = data.get("transaction_fingerprint")
+		provisional = bool(data.get("provisional"))
+		matches = bookings.setdefault((row.bank_account, data.get("booking_fingerprint")), [])
+		match = data.get("booking_fingerprint") and next(
+			(m for m in matches if bool(m.provisional) != provisional), None
+		)
+		if match and not provisional:
+			# Also if the booking was imported otherwise, see `upgrade_provisional_transaction`
+			matches.remove(match)
+			if upgrade_provisional_transaction(match.name, data):
+				set_staging_status(row.name, "Processed", bank_transaction=match.name)
+				matches.append(frappe._dict(name=match.name, provisional=0))
+			else:
+				set_staging_status(row.name, "Duplicate")
+
+			existing.add(key)
+			fingerprints.add(fingerprint)
+			continue
+
+		if (row.transaction_id and key in existing) or (fingerprint and fingerprint in fingerprints):
+			set_staging_status(row.name, "Duplicate")
+			continue
+
+		if match:
+			# Booked already
+			matches.remove(match)
+			set_staging_status(row.name, "Duplicate")
+			existing.add(key)
+			continue
+
+		frappe.db.savepoint("staged_bank_transaction")
+		try:
+			bank_transaction = frappe.get_doc({"doctype": "Bank Transaction", **data})
+			bank_transaction.insert()
+			bank_transaction.submit()
+		except frappe.UniqueValidationError:
+			frappe.db.rollback(save_point="staged_bank_transaction")
+			set_staging_status(row.name, "Duplicate")
+		except Exception:
+			frappe.db.rollback(save_point="staged_bank_transaction")
+			set_staging_status(row.name, "Failed", error=frappe.get_traceback())
+		else:
+			set_staging_status(row.name, "Processed", bank_transaction=bank_transaction.name)
+			if data.get("booking_fingerprint"):
+				matches.append(frappe._dict(name=bank_transaction.name, provisional=provisional))
+
+		existing.add(key)
+		fingerprints.add(fingerprint)
+
+	for bank_account, date in integration_dates.items():
+		set_last_integration_date(bank_account, date)
+
+
+def set_last_integration_date(bank_account: str, date: datetime.date) -> None:
+	"""Move the Bank Account's last integration date forward to `date`."""
+	last_date = frappe.db.get_value("Bank Account", bank_account, "last_integration_date")
+	if not last_date or getdate(last_date) < date:
+		frappe.db.set_value("Bank Account", bank_account, "last_integration_date", date)
+
+
+def get_existing_fingerprints(values: Iterable[Dict]) -> Set[str]:
+	"""Return the transaction fingerprints of the staged values that exist already."""
+	fingerprints = [
+		data["transaction_fingerprint"] for data in values if data.get("transaction_fingerprint")
+	]
+	if not fingerprints:
+		return set()
+
+	return set(
+		frappe.get_all(
+			"Bank Transaction",
+			filters={"transaction_fingerprint": ("in", fingerprints)},
+			pluck="transaction_fingerprint",
+		)
+	)
+
+
+def get_existing_bookings(
+	values: Iterable[Dict],
+) -> Dict[Tuple[str, str], List[frappe._dict]]:
+	"""Return the Bank Transactions with the booking fingerprints of the staged values,
+	by bank account and fingerprint."""
+	fingerprints_by_account = defaultdict(set)
+	for data in values:
+		if data.get("booking_fingerprint"):
+			fingerprints_by_account[data["bank_account"]].add(data["booking_fingerprint"])
+
+	bookings = {}
+	for bank_account, fingerprints in fingerprints_by_account.items():
+		for transaction in frappe.get_all(
+			"Bank Transaction",
+			filters={
+				"bank_account": bank_account,
+				"booking_fingerprint": ("in", list(fingerprints)),
+				"docstatus": ("<", 2),
+			},
+			fields=["name", "booking_fingerprint", "provisional"],
+		):
+			bookings.setdefault((bank_account, transaction.booking_fingerprint), []).append(
+				transaction
+			)
+
+	return bookings
+
+
+def get_existing_transaction_ids(batch: List[Dict]) -> Set[Tuple[str, str]]:
+	"""Return the (bank account, transaction ID) pairs of the batch that exist already."""
+	ids_by_account = defaultdict(set)
+	for row in batch:
+		if row.transaction_id:
+			ids_by_account[row.bank_account].add(row.transaction_id)
+
+	existing = set()
+	for bank_account, transaction_ids in ids_by_account.items():
+		existing.update(
+			(bank_account, transaction_id)
+			for transaction_id in frappe.get_all(
+				"Bank Transaction",
+				filters={
+					"bank_account": bank_account,
+					"transaction_id": ("in", list(transaction_ids)),
+				},
+				pluck="transaction_id",
+			)
+		)
+
+	return existing
+
+
+def set_staging_status(
+	name: str,
+	status: str,
+	bank_transaction: Optional[str] = None,
+	error: Optional[str] = None,
+) -> None:
+	frappe.db.set_value(
+		"Bank Transaction Staging",
+		name,
+		{"status": status, "bank_transaction": bank_transaction, "error": error},
+		update_modified=False,
+	)
+
+
+@frappe.whitelist()
+def retry_failed_staged_transactions() -> None:
+	"""Reprocess failed rows without downloading them from the bank again."""
+	frappe.only_for("System Manager")
+
+	staging = frappe.qb.DocType("Bank Transaction Staging")
+	(
+		frappe.qb.update(staging)
+		.set(staging.status, "Pending")
+		.set(staging.error, None)
+		.where(staging.status == "Failed")
+	).run()
+
+	enqueue_staged_transactions()
@@ -0,0 +1,29 @@
+// Copyright (c) 2025, ALYF GmbH and contributors
+// For license information, please see license.txt
+
+frappe.listview_settings["Bank Transaction Staging"] = {
+	get_indicator(doc) {
+		const colors = {
+			Pending: "orange",
+			Processed: "green",
+			Duplicate: "gray",
+			Failed: "red",
+		};
+		return [__(doc.status), colors[doc.status], "status,=," + doc.status];
+	},
+
+	onload(listview) {
+		listview.page.add_inner_button(__("Retry Failed"), () => {
+			frappe.call({
+				method: "banking.klarna_kosma_integration.doctype.bank_transaction_staging.bank_transaction_staging.retry_failed_staged_transactions",
+				callback: () => {
+					frappe.show_alert({
+						message: __("Failed rows are being processed again in the background."),
+						indicator: "blue",
+					});
+					listview.refresh();
+				},
+			});
+		});
+	},
+};
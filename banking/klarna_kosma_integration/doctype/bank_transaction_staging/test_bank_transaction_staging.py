@@ -0,0 +1,206 @@
+# Copyright (c) 2025, ALYF GmbH and Contributors
+# See license.txt
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import getdate
+
+from erpnext.accounts.doctype.bank_transaction.test_bank_transaction import (
+	create_gl_account,
+)
+
+from banking.ebics.utils import get_booking_fingerprint
+from banking.fingerprint import get_transaction_fingerprint
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.test_bank_reconciliation_tool_beta import (
+	create_bank,
+	create_bank_account,
+)
+from banking.klarna_kosma_integration.doctype.bank_transaction_staging.bank_transaction_staging import (
+	UPDATE_INTEGRATION_DATE,
+	process_batch,
+	retry_failed_staged_transactions,
+	stage_bank_transactions,
+)
+
+
+class TestBankTransactionStaging(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls) -> None:
+		super().setUpClass()
+		create_bank()
+		cls.bank_account = create_bank_account(
+			gl_account=create_gl_account("_Test Bank Staging"),
+			bank_account_name="Staging Account",
+		)
+		frappe.db.savepoint(save_point="bank_transaction_staging_before_tests")
+
+	def tearDown(self) -> None:
+		frappe.db.rollback(save_point="bank_transaction_staging_before_tests")
+
+	def test_dedupe(self):
+		stage_bank_transactions("Kosma", [self.get_values("EXISTING")])
+		self.process()
+
+		stage_bank_transactions(
+			"Kosma",
+			[
+				self.get_values("EXISTING"),
+				self.get_values("NEW", deposit=20),
+				self.get_values("NEW", deposit=20),
+			],
+		)
+		self.process()
+
+		self.assertEqual(
+			self.get_statuses(),
+			[
+				("EXISTING", "Processed"),
+				("EXISTING", "Duplicate"),
+				("NEW", "Processed"),
+				("NEW", "Duplicate"),
+			],
+		)
+		self.assertEqual(
+			frappe.db.count("Bank Transaction", {"bank_account": self.bank_account}), 2
+		)
+
+	def test_fingerprint_dedupe(self):
+		existing = self.get_values("KOSMA-ID")
+		existing["transaction_fingerprint"] = get_transaction_fingerprint(existing)
+		stage_bank_transactions("Kosma", [existing])
+		self.process()
+
+		# The same booking from another source, with another transaction ID
+		stage_bank_transactions("EBICS", [existing | {"transaction_id": "EBICS-ID"}])
+		self.process()
+
+		self.assertEqual(
+			self.get_statuses(), [("KOSMA-ID", "Processed"), ("EBICS-ID", "Duplicate")]
+		)
+
+	def test_last_integration_date(self):
+		frappe.db.set_value("Bank Account", self.bank_account, "last_integration_date", None)
+		stage_bank_transactions(
+			"Kosma",
+			[
+				self.get_values("FIRST", date="2025-01-03", **{UPDATE_INTEGRATION_DATE: 1}),
+				self.get_values("SECOND", date="2025-01-02", **{UPDATE_INTEGRATION_DATE: 1}),
+				# Via Flow API
+				self.get_values("FLOW", date="2025-01-04"),
+			],
+		)
+		self.assertIsNone(
+			frappe.db.get_value("Bank Account", self.bank_account, "last_integration_date")
+		)
+
+		self.process()
+		self.assertEqual(
+			frappe.db.get_value("Bank Account", self.bank_account, "last_integration_date"),
+			getdate("2025-01-03"),
+		)
+
+	def test_failed_row(self):
+		stage_bank_transactions(
+			"Kosma",
+			[
+				self.get_values("VALID"),
+				self.get_values("INVALID", currency="Not A Currency"),
+				self.get_values("AFTER", deposit=20),
+			],
+		)
+		self.process()
+
+		self.assertEqual(
+			self.get_statuses(),
+			[("VALID", "Processed"), ("INVALID", "Failed"), ("AFTER", "Processed")],
+		)
+		# Rolled back to the savepoint, the other rows are kept
+		self.assertFalse(frappe.db.exists("Bank Transaction", {"transaction_id": "INVALID"}))
+		self.assertTrue(frappe.db.exists("Bank Transaction", {"transaction_id": "AFTER"}))
+		self.assertTrue(
+			frappe.db.get_value(
+				"Bank Transaction Staging", {"transaction_id": "INVALID"}, "error"
+			)
+		)
+
+		retry_failed_staged_transactions()
+		self.assertEqual(
+			frappe.db.get_value(
+				"Bank Transaction Staging",
+				{"transaction_id": "INVALID"},
+				["status", "error"],
+			),
+			("Pending", None),
+		)
+
+	def test_provisional_consolidation(self):
+		intraday = self.get_values("INTRADAY", provisional=1)
+		booked = self.get_values("BOOKED", provisional=0, description="Invoice 1\nThank you")
+		booked["transaction_fingerprint"] = get_transaction_fingerprint(booked)
+		stage_bank_transactions("EBICS", [intraday, booked])
+		stage_bank_transactions("EBICS", [self.get_values("INTRADAY-AGAIN", provisional=1)])
+		self.process()
+
+		self.assertEqual(
+			self.get_statuses(),
+			[
+				("INTRADAY", "Processed"),
+				("BOOKED", "Processed"),
+				("INTRADAY-AGAIN", "Duplicate"),
+			],
+		)
+
+		transactions = frappe.get_all(
+			"Bank Transaction",
+			filters={"bank_account": self.bank_account},
+			fields=["name", "transaction_id", "provisional", "description"],
+		)
+		self.assertEqual(len(transactions), 1)
+		self.assertEqual(transactions[0].transaction_id, "BOOKED")
+		self.assertEqual(transactions[0].provisional, 0)
+		self.assertEqual(transactions[0].description, "Invoice 1\nThank you")
+		self.assertEqual(
+			frappe.db.get_value(
+				"Bank Transaction Staging", {"transaction_id": "BOOKED"}, "bank_transaction"
+			),
+			transactions[0].name,
+		)
+
+	def get_values(self, transaction_id: str, **values) -> dict:
+		data = {
+			"date": "2025-01-02",
+			"bank_account": self.bank_account,
+			"company": "_Test Company",
+			"deposit": 10.0,
+			"withdrawal": 0.0,
+			"currency": "INR",
+			"description": "Invoice 1",
+			"reference_number": "E2E-1",
+			"transaction_id": transaction_id,
+			"bank_party_iban": "DE18000000006636981175",
+			"bank_party_name": "Max Mustermann",
+			**values,
+		}
+		if "provisional" in data:
+			data["booking_fingerprint"] = get_booking_fingerprint(data)
+		return data
+
+	def process(self) -> None:
+		process_batch(
+			frappe.get_all(
+				"Bank Transaction Staging",
+				filters={"status": "Pending", "bank_account": self.bank_account},
+				fields=["name", "bank_account", "transaction_id", "data"],
+				order_by="creation asc, idx asc",
+			)
+		)
+
+	def get_statuses(self) -> list[tuple[str, str]]:
+		return [
+			(row.transaction_id, row.status)
+			for row in frappe.get_all(
+				"Bank Transaction Staging",
+				filters={"bank_account": self.bank_account},
+				fields=["transaction_id", "status"],
+				order_by="creation asc, idx asc",
+			)
+		]
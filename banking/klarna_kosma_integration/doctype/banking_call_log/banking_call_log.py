@@ -0,0 +1,15 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+import frappe
+from frappe.model.document import Document
+from frappe.query_builder import Interval
+from frappe.query_builder.functions import Now
+
+
+class BankingCallLog(Document):
+	"""Timings of an instrumented banking API call, see `banking.instrumentation`."""
+
+	@staticmethod
+	def clear_old_logs(days: int = 30) -> None:
+		table = frappe.qb.DocType("Banking Call Log")
+		frappe.db.delete(table, filters=(table.creation < (Now() - Interval(days=days))))
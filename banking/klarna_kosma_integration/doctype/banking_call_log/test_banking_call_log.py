@@ -0,0 +1,29 @@
+# Copyright (c) 2025, ALYF GmbH and Contributors
+# See license.txt
+from unittest.mock import patch
+
+import frappe
+from frappe.deferred_insert import save_to_db
+from frappe.tests.utils import FrappeTestCase
+
+from banking.instrumentation import instrument
+
+
+class TestBankingCallLog(FrappeTestCase):
+	def test_instrumented_call(self):
+		"""Test that an instrumented call is logged with its SQL count and rows"""
+
+		@instrument("test_instrumented_call")
+		def get_users():
+			return frappe.get_all("User", limit=3)
+
+		with patch("banking.instrumentation.is_enabled", return_value=True):
+			users = get_users()
+
+		save_to_db()
+		log = frappe.get_last_doc("Banking Call Log", {"endpoint": "test_instrumented_call"})
+		self.assertEqual(log.status, "Success")
+		self.assertEqual(log.rows, len(users))
+		self.assertGreaterEqual(log.sql_count, 1)
+		self.assertEqual(log.http_count, 0)
+		self.assertFalse("sql" in frappe.db.__dict__)
@@ -9,7 +9,7 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 
-from banking.klarna_kosma_integration.admin import Admin
+from banking.klarna_kosma_integration.admin import Admin, clear_admin_settings_cache
 from banking.klarna_kosma_integration.exception_handler import BankingError
 from banking.klarna_kosma_integration.utils import (
 	create_bank_account,
@@ -23,6 +23,11 @@ class BankingSettings(Document):
 	def before_validate(self):
 		self.update_fintech_license()
 
+	def on_update(self):
+		clear_admin_settings_cache()
+		# Workers may have loaded the old values in the meantime
+		frappe.db.after_commit.add(clear_admin_settings_cache)
+
 	def update_fintech_license(self):
 		if not self.enabled:
 			return self.reset_fintech_license()
@@ -163,47 +168,19 @@ def daily_sync_kosma():
 
 
 def daily_sync_ebics():
-	from banking.ebics.utils import sync_ebics_transactions
-
-	for ebics_user in frappe.get_all(
-		"EBICS User",
-		filters={
-			"initialized": 1,
-			"bank_keys_activated": 1,
-			"passphrase": ("is", "set"),
-			"keyring": ("is", "set"),
-		},
-		pluck="name",
-	):
-		frappe.enqueue(
-			sync_ebics_transactions,
-			ebics_user=ebics_user,
-		)
+	from banking.ebics.scheduling import enqueue_ebics_syncs
+
+	enqueue_ebics_syncs()
 
 
 def intraday_sync_ebics():
-	from banking.ebics.utils import sync_ebics_transactions
+	from banking.ebics.scheduling import enqueue_ebics_syncs
 
 	banking_settings = frappe.get_single("Banking Settings")
 	if not banking_settings.enabled or not banking_settings.enable_ebics:
 		return
 
-	for ebics_user in frappe.get_all(
-		"EBICS User",
-		filters={
-			"initialized": 1,
-			"bank_keys_activated": 1,
-			"passphrase": ("is", "set"),
-			"keyring": ("is", "set"),
-			"intraday_sync": 1,
-		},
-		pluck="name",
-	):
-		frappe.enqueue(
-			sync_ebics_transactions,
-			ebics_user=ebics_user,
-			intraday=True,
-		)
+	enqueue_ebics_syncs(intraday=True)
 
 
 def get_bank_accounts_to_sync(bank: str, company: str) -> list:
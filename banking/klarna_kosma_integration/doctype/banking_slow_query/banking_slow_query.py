@@ -0,0 +1,191 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+import hashlib
+import json
+import re
+import time
+from typing import Optional
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import cint, flt, get_datetime, now_datetime
+
+# EXPLAIN is captured at most once per query shape within this interval (seconds)
+EXPLAIN_INTERVAL = 60 * 60
+
+# Slow queries are counted in Redis, per query shape, and written by
+# `flush_slow_queries` every few minutes
+PENDING_KEY = "banking_slow_queries"
+
+RECORD_SCRIPT = """
+redis.call("HINCRBY", KEYS[1], "occurrences", 1)
+if tonumber(ARGV[1]) > tonumber(redis.call("HGET", KEYS[1], "max_duration") or "0") then
+	redis.call("HSET", KEYS[1], "max_duration", ARGV[1])
+end
+redis.call(
+	"HSET", KEYS[1],
+	"last_duration", ARGV[1], "rows", ARGV[2], "sql", ARGV[3], "parameters", ARGV[4],
+	"last_seen", ARGV[5]
+)
+redis.call("SADD", KEYS[2], ARGV[6])
+"""
+
+# Return the counted values and reset them
+POP_SCRIPT = """
+local values = redis.call("HGETALL", KEYS[1])
+redis.call("DEL", KEYS[1])
+return values
+"""
+
+PARAMETER = re.compile(r"%\(\w+\)s")
+PARAMETER_LIST = re.compile(r"\?(\s*,\s*\?)+")
+WHITESPACE = re.compile(r"\s+")
+
+
+class BankingSlowQuery(Document):
+	"""A matching query shape that exceeded Banking Settings' Slow Query Threshold."""
+
+
+def run_query(query, **kwargs) -> list:
+	"""Run a query builder query and log it if it exceeds the slow query threshold."""
+	threshold = flt(
+		frappe.get_cached_value("Banking Settings", "Banking Settings", "slow_query_threshold")
+	)
+	if not threshold:
+		return query.run(**kwargs)
+
+	start = time.perf_counter()
+	result = query.run(**kwargs)
+	duration = time.perf_counter() - start
+
+	if duration >= threshold:
+		sql, parameters = query.walk()
+		record_slow_query(sql, parameters, duration, len(result))
+
+	return result
+
+
+def record_slow_query(sql: str, parameters: dict, duration: float, rows: int) -> None:
+	"""Count the occurrence in Redis, to be logged by `flush_slow_queries`."""
+	cache = frappe.cache()
+	query_hash = get_query_hash(sql)
+	cache.register_script(RECORD_SCRIPT)(
+		keys=[cache.make_key(f"{PENDING_KEY}|{query_hash}"), cache.make_key(PENDING_KEY)],
+		args=[
+			duration,
+			rows,
+			sql,
+			frappe.as_json(parameters, indent=None),
+			str(now_datetime()),
+			query_hash,
+		],
+	)
+
+
+def flush_slow_queries() -> None:
+	"""Log the slow queries counted since the last flush. Called via hooks.
+
+	EXPLAIN is captured only once per `EXPLAIN_INTERVAL` and query shape.
+	"""
+	cache = frappe.cache()
+	pop_values = cache.register_script(POP_SCRIPT)
+	while query_hash := cache.spop(cache.make_key(PENDING_KEY)):
+		query_hash = frappe.safe_decode(query_hash)
+		values = pop_values(keys=[cache.make_key(f"{PENDING_KEY}|{query_hash}")])
+		if not values:
+			# Flushed with an earlier occurrence
+			continue
+
+		values = [frappe.safe_decode(value) for value in values]
+		values = dict(zip(values[::2], values[1::2]))
+		explain = bool(
+			cache.set(
+				cache.make_key(f"banking_slow_query|{query_hash}"),
+				1,
+				ex=EXPLAIN_INTERVAL,
+				nx=True,
+			)
+		)
+		log_slow_query(
+			query_hash,
+			values["sql"],
+			json.loads(values["parameters"]),
+			flt(values["last_duration"]),
+			cint(values["rows"]),
+			explain,
+			get_datetime(values["last_seen"]),
+			occurrences=cint(values["occurrences"]),
+			max_duration=flt(values["max_duration"]),
+		)
+		frappe.db.commit()
+
+
+def log_slow_query(
+	query_hash: str,
+	sql: str,
+	parameters: dict,
+	duration: float,
+	rows: int,
+	explain: bool,
+	seen_at,
+	occurrences: int = 1,
+	max_duration: Optional[float] = None,
+) -> None:
+	"""Add the `occurrences` of the query shape to its log. `duration` is the last one."""
+	max_duration = max_duration or duration
+	values = {
+		"last_seen": seen_at,
+		"last_duration": duration,
+		"rows": rows,
+	}
+	exists = frappe.db.exists("Banking Slow Query", query_hash)
+	if explain or not exists:
+		values.update(
+			{
+				"query": sql,
+				"parameters": frappe.as_json(parameters),
+				"explain": frappe.as_json(
+					frappe.db.sql(f"EXPLAIN {sql}", parameters, as_dict=True)
+				),
+				"explained_at": now_datetime(),
+			}
+		)
+
+	if not exists:
+		try:
+			frappe.get_doc(
+				{
+					"doctype": "Banking Slow Query",
+					"query_hash": query_hash,
+					"first_seen": seen_at,
+					"occurrences": occurrences,
+					"max_duration": max_duration,
+					**values,
+				}
+			).insert(ignore_permissions=True)
+			return
+		except frappe.DuplicateEntryError:
+			# Inserted by a concurrent job in the meantime
+			pass
+
+	table = frappe.qb.DocType("Banking Slow Query")
+	query = (
+		frappe.qb.update(table)
+		.set(table.occurrences, table.occurrences + occurrences)
+		.where(table.name == query_hash)
+	)
+	for fieldname, value in values.items():
+		query = query.set(table[fieldname], value)
+
+	if max_duration > flt(frappe.db.get_value("Banking Slow Query", query_hash, "max_duration")):
+		query = query.set(table.max_duration, max_duration)
+
+	query.run()
+
+
+def get_query_hash(sql: str) -> str:
+	"""Return a hash of the query's shape, independent of parameter values and list lengths."""
+	shape = PARAMETER.sub("?", sql)
+	shape = PARAMETER_LIST.sub("?", shape)
+	shape = WHITESPACE.sub(" ", shape).strip()
+	return hashlib.sha256(shape.encode()).hexdigest()[:32]
@@ -0,0 +1,71 @@
+# Copyright (c) 2025, ALYF GmbH and Contributors
+# See license.txt
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import now_datetime
+
+from banking.klarna_kosma_integration.doctype.banking_slow_query.banking_slow_query import (
+	flush_slow_queries,
+	get_query_hash,
+	log_slow_query,
+	record_slow_query,
+)
+
+
+class TestBankingSlowQuery(FrappeTestCase):
+	def test_query_hash(self):
+		"""Test that queries of the same shape share a hash"""
+		self.assertEqual(
+			get_query_hash("SELECT `name` FROM `tabUser` WHERE `name` IN (%(param1)s,%(param2)s)"),
+			get_query_hash("SELECT `name`  FROM `tabUser`\nWHERE `name` IN (%(param1)s)"),
+		)
+		self.assertNotEqual(
+			get_query_hash("SELECT `name` FROM `tabUser` WHERE `name`=%(param1)s"),
+			get_query_hash("SELECT `email` FROM `tabUser` WHERE `name`=%(param1)s"),
+		)
+
+	def test_log_slow_query(self):
+		"""Test that occurrences are counted per shape and EXPLAIN is captured"""
+		sql = "SELECT `name` FROM `tabUser` WHERE `name`=%(param1)s"
+		parameters = {"param1": "Administrator"}
+		query_hash = get_query_hash(sql)
+		frappe.delete_doc_if_exists("Banking Slow Query", query_hash)
+
+		log_slow_query(query_hash, sql, parameters, 2.5, 1, True, now_datetime())
+		log_slow_query(query_hash, sql, parameters, 1.5, 1, False, now_datetime())
+
+		log = frappe.get_doc("Banking Slow Query", query_hash)
+		self.assertEqual(log.occurrences, 2)
+		self.assertEqual(log.max_duration, 2.5)
+		self.assertEqual(log.last_duration, 1.5)
+		self.assertEqual(log.query, sql)
+		self.assertTrue(frappe.parse_json(log.explain))
+
+	def test_record_slow_query(self):
+		"""Test that occurrences are counted in Redis and logged once per flush"""
+		# Flushing commits, keep the log in the test's transaction
+		commit = patch.object(frappe.db, "commit")
+		commit.start()
+		self.addCleanup(commit.stop)
+
+		sql = "SELECT `name` FROM `tabUser` WHERE `email`=%(param1)s"
+		query_hash = get_query_hash(sql)
+		frappe.delete_doc_if_exists("Banking Slow Query", query_hash)
+
+		record_slow_query(sql, {"param1": "admin@example.com"}, 2.5, 1)
+		record_slow_query(sql, {"param1": "guest@example.com"}, 1.5, 0)
+		self.assertFalse(frappe.db.exists("Banking Slow Query", query_hash))
+
+		flush_slow_queries()
+		log = frappe.get_doc("Banking Slow Query", query_hash)
+		self.assertEqual(log.occurrences, 2)
+		self.assertEqual(log.max_duration, 2.5)
+		self.assertEqual(log.last_duration, 1.5)
+		self.assertEqual(frappe.parse_json(log.parameters), {"param1": "guest@example.com"})
+
+		# Nothing left to flush
+		flush_slow_queries()
+		log.reload()
+		self.assertEqual(log.occurrences, 2)
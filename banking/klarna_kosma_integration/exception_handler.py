@@ -9,6 +9,10 @@ class BankingError(frappe.ValidationError):
 	pass
 
 
+class BankingRateLimitError(BankingError):
+	pass
+
+
 class ExceptionHandler:
 	"""
 	Log and throw error as received from Admin app.
@@ -24,6 +28,7 @@ class ExceptionHandler:
 			raise
 
 		response = self.exception.response
+		self.handle_rate_limit_error(response)
 		self.handle_auth_error(response)
 		self.handle_authorization_error(response)
 		self.handle_txt_html_error(response)
@@ -32,6 +37,19 @@ class ExceptionHandler:
 		self.handle_frappe_server_error(content, response)
 		self.handle_admin_error(content)
 
+	def handle_rate_limit_error(self, response):
+		"""
+		Throttled even after retrying. Expected under load, so don't log an error.
+		"""
+		if response.status_code not in (429, 503):
+			return
+
+		frappe.throw(
+			title=_("Banking Error"),
+			msg=_("The banking service is busy. Please retry in a while."),
+			exc=BankingRateLimitError,
+		)
+
 	def handle_auth_error(self, response):
 		if not response.status_code == 401:
 			return
@@ -0,0 +1,35 @@
+// Copyright (c) 2025, ALYF GmbH and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Slowest Banking Calls"] = {
+	filters: [
+		{
+			fieldname: "from_date",
+			label: __("From Date"),
+			fieldtype: "Date",
+			default: frappe.datetime.add_days(frappe.datetime.get_today(), -7),
+			reqd: 1,
+		},
+		{
+			fieldname: "to_date",
+			label: __("To Date"),
+			fieldtype: "Date",
+		},
+		{
+			fieldname: "endpoint",
+			label: __("Endpoint"),
+			fieldtype: "Data",
+		},
+		{
+			fieldname: "status",
+			label: __("Status"),
+			fieldtype: "Select",
+			options: ["", "Success", "Error"],
+		},
+		{
+			fieldname: "group_by_endpoint",
+			label: __("Group by Endpoint"),
+			fieldtype: "Check",
+		},
+	],
+};
@@ -0,0 +1,107 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+import frappe
+from frappe import _
+from frappe.query_builder.functions import Avg, Count, Max, Sum
+from frappe.utils import add_to_date, get_datetime
+
+
+def execute(filters=None):
+	filters = frappe._dict(filters or {})
+	if filters.group_by_endpoint:
+		return get_summary_columns(), get_summary_data(filters)
+
+	return get_columns(), get_data(filters)
+
+
+def get_columns():
+	return [
+		column("name", _("Call"), "Link", options="Banking Call Log", width=100),
+		column("endpoint", _("Endpoint"), "Data", width=350),
+		column("status", _("Status"), "Data", width=80),
+		column("started_at", _("Started At"), "Datetime", width=160),
+		column("duration", _("Duration (s)"), "Float", precision=3),
+		column("sql_count", _("SQL Queries"), "Int"),
+		column("sql_time", _("SQL Time (s)"), "Float", precision=3),
+		column("http_count", _("HTTP Requests"), "Int"),
+		column("http_time", _("HTTP Time (s)"), "Float", precision=3),
+		column("rows", _("Rows"), "Int"),
+		column("user", _("User"), "Link", options="User"),
+	]
+
+
+def get_summary_columns():
+	return [
+		column("endpoint", _("Endpoint"), "Data", width=350),
+		column("calls", _("Calls"), "Int"),
+		column("errors", _("Errors"), "Int"),
+		column("avg_duration", _("Avg. Duration (s)"), "Float", precision=3),
+		column("max_duration", _("Max. Duration (s)"), "Float", precision=3),
+		column("avg_sql_count", _("Avg. SQL Queries"), "Float", precision=1),
+		column("avg_sql_time", _("Avg. SQL Time (s)"), "Float", precision=3),
+		column("avg_http_count", _("Avg. HTTP Requests"), "Float", precision=1),
+		column("avg_http_time", _("Avg. HTTP Time (s)"), "Float", precision=3),
+		column("rows", _("Rows"), "Int"),
+	]
+
+
+def column(fieldname: str, label: str, fieldtype: str, **kwargs) -> dict:
+	return {"fieldname": fieldname, "label": label, "fieldtype": fieldtype, "width": 120, **kwargs}
+
+
+def get_data(filters):
+	log = frappe.qb.DocType("Banking Call Log")
+	return (
+		get_query(log, filters)
+		.select(
+			log.name,
+			log.endpoint,
+			log.status,
+			log.started_at,
+			log.duration,
+			log.sql_count,
+			log.sql_time,
+			log.http_count,
+			log.http_time,
+			log.rows,
+			log.user,
+		)
+		.orderby(log.duration, order=frappe.qb.desc)
+		.limit(filters.limit or 500)
+	).run(as_dict=True)
+
+
+def get_summary_data(filters):
+	log = frappe.qb.DocType("Banking Call Log")
+	return (
+		get_query(log, filters)
+		.select(
+			log.endpoint,
+			Count(log.name).as_("calls"),
+			Sum(log.status == "Error").as_("errors"),
+			Avg(log.duration).as_("avg_duration"),
+			Max(log.duration).as_("max_duration"),
+			Avg(log.sql_count).as_("avg_sql_count"),
+			Avg(log.sql_time).as_("avg_sql_time"),
+			Avg(log.http_count).as_("avg_http_count"),
+			Avg(log.http_time).as_("avg_http_time"),
+			Sum(log.rows).as_("rows"),
+		)
+		.groupby(log.endpoint)
+		.orderby(Max(log.duration), order=frappe.qb.desc)
+	).run(as_dict=True)
+
+
+def get_query(log, filters):
+	from_date = get_datetime(filters.from_date or add_to_date(None, days=-7))
+	to_date = add_to_date(get_datetime(filters.to_date), days=1) if filters.to_date else None
+
+	query = frappe.qb.from_(log).where(log.started_at >= from_date)
+	if to_date:
+		query = query.where(log.started_at < to_date)
+	if filters.endpoint:
+		query = query.where(log.endpoint.like(f"%{filters.endpoint}%"))
+	if filters.status:
+		query = query.where(log.status == filters.status)
+
+	return query
@@ -1,11 +1,24 @@
 import json
+import time
+from collections import Counter
+from io import BytesIO
+from unittest.mock import patch
+
 import frappe
 
 from frappe.client import get_count
 from frappe.tests.utils import FrappeTestCase
 from frappe.utils import add_days, getdate, get_datetime, nowdate
 
-from banking.connectors.admin_transaction import AdminTransaction
+from banking.connectors.admin_transaction import (
+	AdminTransaction,
+	StreamedAdminTransaction,
+)
+from banking.demo_responses.mock_admin_server import (
+	MockAdminConfig,
+	MockAdminServer,
+	get_transaction,
+)
 from banking.demo_responses.test_responses import (
 	accounts_response_1,
 	accounts_response_2,
@@ -14,6 +27,7 @@ from banking.demo_responses.test_responses import (
 	session_response,
 	transactions_consent_response,
 )
+from banking.fingerprint import get_transaction_fingerprint
 from banking.klarna_kosma_integration.doctype.banking_settings.banking_settings import (
 	add_bank_account,
 )
@@ -23,6 +37,7 @@ from banking.klarna_kosma_integration.utils import (
 	create_bank_transactions,
 	create_session_doc,
 	get_account_name,
+	get_bank_transaction_data,
 )
 
 from erpnext.accounts.doctype.journal_entry.journal_entry import (
@@ -70,6 +85,70 @@ class TestKosma(FrappeTestCase):
 		self.assertEqual(admin.api_token, "xabsttcpQr5")
 		self.assertEqual(admin.customer_id, "ADCB8A")
 
+	def test_admin_settings_cache(self):
+		"""Test that cached Admin settings are refreshed when Banking Settings are saved"""
+		self.assertEqual(Admin().customer_id, "ADCB8A")
+
+		doc = frappe.get_single("Banking Settings")
+		doc.customer_id = "ADCB8B"
+		doc.save()
+		self.assertEqual(Admin().customer_id, "ADCB8B")
+
+		doc.customer_id = "ADCB8A"
+		doc.save()
+		self.assertEqual(Admin().customer_id, "ADCB8A")
+
+	def test_admin_settings_cache_race(self):
+		"""Test that settings saved while they are being loaded are not kept in the cache"""
+		from banking.klarna_kosma_integration import admin
+
+		get_admin_settings = admin.get_admin_settings
+
+		def load_during_save(settings):
+			values = get_admin_settings(settings)
+			admin.clear_admin_settings_cache()  # Banking Settings saved concurrently
+			return values
+
+		admin.clear_admin_settings_cache()
+		with patch.object(admin, "get_admin_settings", side_effect=load_during_save) as load:
+			Admin()
+			Admin()
+
+		self.assertEqual(load.call_count, 2)
+
+	def test_public_ip_cache(self):
+		"""Test that the public IP is configurable, skippable and served from cache"""
+		from banking.klarna_kosma_integration.utils import (
+			PUBLIC_IP_CACHE_KEY,
+			get_public_ip,
+		)
+
+		with patch.dict(frappe.conf, {"banking_public_ip": "203.0.113.1"}):
+			self.assertEqual(get_public_ip(), "203.0.113.1")
+
+		with patch.dict(frappe.conf, {"banking_skip_ip_lookup": 1}):
+			self.assertIsNone(get_public_ip())
+
+		frappe.cache().set_value(
+			PUBLIC_IP_CACHE_KEY, {"ip": "203.0.113.2", "fetched_at": time.time()}
+		)
+		with patch("banking.klarna_kosma_integration.utils.requests.get") as mock_get:
+			self.assertEqual(get_public_ip(), "203.0.113.2")
+			mock_get.assert_not_called()
+
+		frappe.cache().delete_value(PUBLIC_IP_CACHE_KEY)
+
+	def test_rate_limiter(self):
+		"""Test that the shared rate is halved when throttled and recovers on success"""
+		from banking.connectors.rate_limit import MAX_RATE, RateLimiter
+
+		rate_limiter = RateLimiter("ADCB8A", frappe.generate_hash())
+		rate_limiter.acquire()
+
+		throttled_rate = rate_limiter.on_throttle(retry_after=0)
+		self.assertEqual(throttled_rate, MAX_RATE / 2)
+		self.assertGreater(rate_limiter.on_success(), throttled_rate)
+
 	def test_kosma_session(self):
 		"""Test creation of Kosma session and updation via flow"""
 		session_data = session_response.session_data
@@ -204,6 +283,133 @@ class TestKosma(FrappeTestCase):
 		# Test last sync date correctness
 		self.assertEqual(getdate(last_sync_date), actual_last_sync_date)
 
+	def test_transaction_fingerprint(self):
+		"""Test that the fingerprint is independent of the source's transaction ID"""
+		transaction = get_transaction("mock-account", 1)
+		booking_date = getdate(transaction["date"])
+		transaction["value_date"] = str(add_days(booking_date, 1))
+		kosma_data = get_bank_transaction_data("Test Account", transaction)
+		self.assertEqual(kosma_data["date"], add_days(booking_date, 1))
+
+		# EBICS transactions have the booking date only
+		ebics_data = kosma_data | {
+			"date": booking_date,
+			"transaction_id": "REF-1",
+			"bank_party_iban": "DE18 0000 0000 6636 9811 75",
+		}
+		self.assertEqual(
+			kosma_data["transaction_fingerprint"], get_transaction_fingerprint(ebics_data)
+		)
+
+		# Identical transactions of one sync run are told apart, the same way every time
+		occurrences = Counter()
+		first = get_bank_transaction_data("Test Account", transaction, occurrences)
+		second = get_bank_transaction_data("Test Account", transaction, occurrences)
+		self.assertEqual(first["transaction_fingerprint"], kosma_data["transaction_fingerprint"])
+		self.assertNotEqual(first["transaction_fingerprint"], second["transaction_fingerprint"])
+		occurrences = Counter({first["transaction_fingerprint"]: 1})
+		self.assertEqual(
+			get_transaction_fingerprint(ebics_data, occurrences), second["transaction_fingerprint"]
+		)
+
+	def test_streamed_transactions(self):
+		"""Test that a streamed response yields the same transactions and pagination"""
+		message = {
+			**transactions_consent_response,
+			"consent_token": "streamed-token",
+		}
+		message["result"] = {
+			**message["result"],
+			"pagination": {"url": "https://next.page", "next": {"offset": "abc"}},
+		}
+		body = json.dumps({"message": message}).encode()
+
+		# Spooled: everything but the transactions is available right away
+		transaction = StreamedAdminTransaction(BytesIO(body), seekable=True)
+		self.assertEqual(transaction.consent_token, "streamed-token")
+		self.assertTrue(transaction.is_next_page())
+		self.assertEqual(transaction.next_page_request(), ("https://next.page", "abc"))
+		self.assertEqual(
+			list(transaction.transaction_list), message["result"]["transactions"]
+		)
+
+		# Streamed: pagination is available once the transactions are consumed
+		transaction = StreamedAdminTransaction(BytesIO(body))
+		self.assertFalse(transaction.is_next_page())
+		self.assertEqual(
+			list(transaction.transaction_list), message["result"]["transactions"]
+		)
+		self.assertTrue(transaction.is_next_page())
+
+	def test_streamed_error_response(self):
+		"""Test that the body of an error response can be read after the response is closed"""
+		from requests import Response
+
+		message = {"message": {"consent_token": "error-token", "error": "Not granted"}}
+		response = Response()
+		response.status_code = 403
+		response.headers["Content-Type"] = "application/json"
+		response.raw = BytesIO(json.dumps(message).encode())
+
+		transaction = StreamedAdminTransaction.from_response(response, spool=True)
+		response.close()
+
+		self.assertEqual(transaction.consent_token, "error-token")
+		self.assertEqual(response.json(), message)
+
+	def test_consent_transactions_via_mock_server(self):
+		"""Test a paginated, throttled consent sync over HTTP against a local Admin backend"""
+		from banking.klarna_kosma_integration.utils import get_consent_data
+
+		# The sync commits per page, keep the test data in the test's transaction
+		commit = patch.object(frappe.db, "commit")
+		commit.start()
+		self.addCleanup(commit.stop)
+
+		create_session_doc(session_response.session_data, session_response.flow_data)
+		bank_name = add_bank(bank_data_response)
+		Admin().set_consent(
+			consent=get_formatted_consent(),
+			bank_name=bank_name,
+			session_id_short=session_response.session_data.get("session_id_short"),
+			company="Bolt Trades",
+		)
+		acc = create_account_for_bank_account("Mock Server Account")
+		account_data = accounts_response_1.result["accounts"][3]
+		add_bank_account(
+			account_data=account_data,
+			gl_account=acc,
+			company="Bolt Trades",
+			bank_name=bank_name,
+		)
+		bank_account = frappe.db.get_value("Bank Account", {"account": acc})
+
+		# The fourth request is throttled once and retried
+		config = MockAdminConfig(transactions=200, page_size=50, throttle_requests=(4,))
+		settings = frappe.get_single("Banking Settings")
+		with MockAdminServer(config) as server:
+			settings.admin_endpoint = server.url
+			settings.save()
+			try:
+				Admin().consent_transactions(bank_account, "2020-01-01")
+			finally:
+				settings.admin_endpoint = "http://banking-admin:8000"
+				settings.save()
+
+		self.assertEqual(server.stats.requests["fetch_consent_transactions"], 5)
+		self.assertEqual(server.stats.errors, 1)
+
+		transaction_ids = [
+			get_transaction(account_data["id"], index)["transaction_id"] for index in range(200)
+		]
+		self.assertEqual(
+			get_count("Bank Transaction", {"transaction_id": ("in", transaction_ids)}), 200
+		)
+
+		# The token of the last page was persisted
+		_, consent_token = get_consent_data(bank_name, "Bolt Trades")
+		self.assertEqual(consent_token, "mock-consent-token-4")
+
 	def test_bank_consent_set_get(self):
 		from banking.klarna_kosma_integration.utils import (
 			get_consent_data,
@@ -225,6 +431,39 @@ class TestKosma(FrappeTestCase):
 		self.assertEqual(consent_id, consent_response.get("consent_id"))
 		self.assertEqual(consent_token, consent_response.get("consent_token"))
 
+	def test_consent_token_exchange(self):
+		"""Test that an exchanged consent token is stored in the Bank Consent"""
+		from banking.klarna_kosma_integration.utils import (
+			exchange_consent_token,
+			get_consent_data,
+			persist_consent_token,
+		)
+
+		session_data = session_response.session_data
+		create_session_doc(session_data, session_response.flow_data)
+		bank_name = add_bank(bank_data_response)
+		Admin().set_consent(
+			consent=get_formatted_consent(),
+			bank_name=bank_name,
+			session_id_short=session_data.get("session_id_short"),
+			company="Bolt Trades",
+		)
+
+		self.assertIsNone(exchange_consent_token({}, bank_name, "Bolt Trades"))
+		new_token = exchange_consent_token(
+			{"consent_token": "exchanged-token"}, bank_name, "Bolt Trades"
+		)
+		self.assertEqual(new_token, "exchanged-token")
+
+		persist_consent_token(bank_name, "Bolt Trades", new_token)
+		_, consent_token = get_consent_data(bank_name, "Bolt Trades")
+		self.assertEqual(consent_token, "exchanged-token")
+
+		# Responses without a token keep the current one
+		persist_consent_token(bank_name, "Bolt Trades", None)
+		_, consent_token = get_consent_data(bank_name, "Bolt Trades")
+		self.assertEqual(consent_token, "exchanged-token")
+
 
 def get_formatted_consent():
 	return {
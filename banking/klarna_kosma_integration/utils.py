@@ -1,8 +1,9 @@
 # Copyright (c) 2022, ALYF GmbH and contributors
 # For license information, please see license.txt
 import json
-from typing import TYPE_CHECKING, Dict, List, Optional
-from banking.klarna_kosma_integration.exception_handler import ExceptionHandler
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, Iterable, Optional
 
 import frappe
 import requests
@@ -16,6 +17,17 @@ from frappe.utils import (
 	getdate,
 	nowdate,
 )
+from frappe.utils.password import set_encrypted_password
+
+from banking.fingerprint import get_transaction_fingerprint
+from banking.instrumentation import instrument
+from banking.klarna_kosma_integration.doctype.bank_transaction_staging.bank_transaction_staging import (
+	DEFAULT_BATCH_SIZE as STAGING_CHUNK_SIZE,
+	UPDATE_INTEGRATION_DATE,
+	enqueue_staged_transactions,
+	stage_bank_transactions,
+)
+from banking.klarna_kosma_integration.exception_handler import ExceptionHandler
 
 if TYPE_CHECKING:
 	from frappe.model.document import Document
@@ -52,6 +64,12 @@ SUPPORTED_COUNTRIES = [
 	"United States",
 ]
 
+# Cached public IP of this server, see `get_public_ip`. It is refreshed in the
+# background after PUBLIC_IP_TTL and never used after PUBLIC_IP_MAX_AGE (seconds).
+PUBLIC_IP_CACHE_KEY = "banking_public_ip"
+PUBLIC_IP_TTL = 60 * 60
+PUBLIC_IP_MAX_AGE = 24 * 60 * 60
+
 
 def needs_consent(bank: str, company: str) -> bool:
 	"""Returns False if there is atleast 1 hour before consent expires."""
@@ -86,18 +104,28 @@ def get_consent_data(bank_name: str, company: str):
 
 
 def exchange_consent_token(response: Dict, bank: str, company: str) -> str:
+	"""Return the new consent token from the response, if any."""
 	if (not response) or (not isinstance(response, dict)):
 		return
 
-	new_consent_token = response.get("consent_token")
+	return response.get("consent_token")
 
-	if new_consent_token:
-		bank_consent = frappe.get_doc("Bank Consent", {"bank": bank, "company": company})
-		bank_consent.consent_token = new_consent_token
-		bank_consent.save()
-		frappe.db.commit()
 
-	return new_consent_token
+def persist_consent_token(bank: str, company: str, consent_token: Optional[str]) -> None:
+	"""Store the consent token (encrypted) in the Bank Consent. Does not commit.
+
+	The backend invalidates the previous token as soon as it issues a new one, so
+	callers commit it with the next checkpoint, or after rolling back a failure.
+	"""
+	if not consent_token:
+		return
+
+	bank_consent_name = get_bank_consent_name(bank, company)
+	set_encrypted_password("Bank Consent", bank_consent_name, consent_token, "consent_token")
+
+
+def get_bank_consent_name(bank: str, company: str) -> Optional[str]:
+	return frappe.db.get_value("Bank Consent", {"bank": bank, "company": company})
 
 
 def create_session_doc(session_data: Dict, flow_data: Dict) -> "Document":
@@ -235,30 +263,126 @@ def get_account_name(account: Dict) -> str:
 	return account_name
 
 
+@instrument()
 def create_bank_transactions(
-	account: str, transactions: List[Dict], via_flow_api: bool = False
-) -> None:
+	account: str,
+	transactions: Iterable[Dict],
+	via_flow_api: bool = False,
+	occurrences: Optional[Counter] = None,
+) -> int:
+	"""Insert (or stage) the given Kosma transactions and return their number.
+
+	`transactions` may be a stream (see `StreamedAdminTransaction`), it is consumed
+	only once. A list is processed in reverse, i.e. oldest transaction first.
+	Pass the same `occurrences` for all pages of a sync run, so that identical
+	transactions on different pages are told apart.
+	"""
+	if isinstance(transactions, list):
+		transactions = reversed(transactions)
+
+	if occurrences is None:
+		occurrences = Counter()
+
+	if frappe.db.get_single_value("Banking Settings", "stage_bank_transactions"):
+		return stage_kosma_transactions(account, transactions, via_flow_api, occurrences)
+
 	last_sync_date = None
+	created = 0
 	try:
-		for transaction in reversed(transactions):
-			transaction_created = new_bank_transaction(account, transaction)
+		for transaction in transactions:
+			transaction_created = new_bank_transaction(account, transaction, occurrences)
+			created += transaction_created
 
 			if not transaction_created or via_flow_api:
 				# Don't set last integration date if via Flow API (one time action with arbitrary time period)
 				# or if transaction was not inserted
 				continue
 
-			last_sync_date = transaction.get("value_date") or transaction.get("date")
+			transaction_date = transaction.get("value_date") or transaction.get("date")
+			last_sync_date = max(last_sync_date or transaction_date, transaction_date)
 
 	except Exception:
+		# Streamed pages are not sorted by date. Leave the last integration date (and the
+		# caller's checkpoint) as it is, so that the whole page is synced again.
 		frappe.log_error(title=_("Kosma Transaction Error"), message=frappe.get_traceback())
 		frappe.throw(_("Error creating transactions"))
-	finally:
-		if last_sync_date:
-			frappe.db.set_value("Bank Account", account, "last_integration_date", last_sync_date)
 
+	if last_sync_date:
+		frappe.db.set_value("Bank Account", account, "last_integration_date", last_sync_date)
+
+	return created
+
+
+def stage_kosma_transactions(
+	account: str,
+	transactions: Iterable[Dict],
+	via_flow_api: bool = False,
+	occurrences: Optional[Counter] = None,
+) -> int:
+	"""Write Kosma transactions to the staging table in bulk, one chunk at a time.
+
+	Bank Transactions are created by a separate job, see `process_staged_transactions`.
+	It also sets the last integration date of the Bank Account, once they are created.
+	"""
+	staged, rows = 0, []
+	if occurrences is None:
+		occurrences = Counter()
+
+	for transaction in transactions:
+		data = get_bank_transaction_data(account, transaction, occurrences)
+		if not data:
+			continue
+
+		if not via_flow_api:
+			data[UPDATE_INTEGRATION_DATE] = 1
+
+		rows.append(data)
+		if len(rows) >= STAGING_CHUNK_SIZE:
+			stage_bank_transactions("Kosma", rows)
+			staged += len(rows)
+			rows = []
+
+	stage_bank_transactions("Kosma", rows)
+	staged += len(rows)
+	if staged:
+		enqueue_staged_transactions()
+
+	return staged
+
+
+def new_bank_transaction(
+	account: str, transaction: Dict, occurrences: Optional[Counter] = None
+) -> bool:
+	data = get_bank_transaction_data(account, transaction, occurrences)
+	if (
+		not data
+		or frappe.db.exists("Bank Transaction", {"transaction_id": data["transaction_id"]})
+		# Imported via EBICS, with a different transaction ID
+		or frappe.db.exists(
+			"Bank Transaction", {"transaction_fingerprint": data["transaction_fingerprint"]}
+		)
+	):
+		return False
+
+	new_transaction = frappe.get_doc({"doctype": "Bank Transaction", **data})
+	try:
+		new_transaction.insert()
+	except frappe.UniqueValidationError:
+		# Inserted by a concurrent sync in the meantime
+		return False
+
+	new_transaction.submit()
+	return True
+
+
+def get_bank_transaction_data(
+	account: str, transaction: Dict, occurrences: Optional[Counter] = None
+) -> Optional[Dict]:
+	"""Map a Kosma transaction to the values of an ERPNext Bank Transaction.
 
-def new_bank_transaction(account: str, transaction: Dict) -> bool:
+	Returns `None` if the transaction should not be imported. Pass the same
+	`occurrences` for all transactions of a sync run, see `get_transaction_fingerprint`.
+	"""
 	amount_data = transaction.get("amount", {})
 	amount = (
 		amount_data.get("amount", 0) / 100
@@ -273,32 +397,29 @@ def new_bank_transaction(account: str, transaction: Dict) -> bool:
 	if not transaction_id and transaction.get("state") == "PENDING":
 		# Dont insert pending transactions. transaction_id is absent only for Pending state
 		# Ref: https://docs.openbanking.klarna.com/xs2a/objects/transaction.html
-		return False
-
-	if frappe.db.exists("Bank Transaction", {"transaction_id": transaction_id}):
-		return False
+		return None
 
-	new_transaction = frappe.get_doc(
-		{
-			"doctype": "Bank Transaction",
-			"date": getdate(transaction.get("value_date") or transaction.get("date")),
-			"bank_account": account,
-			"deposit": credit,
-			"withdrawal": debit,
-			"currency": amount_data.get("currency"),
-			"transaction_id": transaction_id,
-			"reference_number": transaction.get("bank_references", {}).get("end_to_end"),
-			"description": transaction.get("reference"),
-			"bank_party_name": transaction.get("counter_party", {}).get("holder_name"),
-			"bank_party_iban": transaction.get("counter_party", {}).get("iban"),
-			"bank_party_account_number": transaction.get("counter_party", {}).get(
-				"account_number"
-			),
-		}
+	data = {
+		"date": getdate(transaction.get("value_date") or transaction.get("date")),
+		"bank_account": account,
+		"deposit": credit,
+		"withdrawal": debit,
+		"currency": amount_data.get("currency"),
+		"transaction_id": transaction_id,
+		"reference_number": transaction.get("bank_references", {}).get("end_to_end"),
+		"description": transaction.get("reference"),
+		"bank_party_name": transaction.get("counter_party", {}).get("holder_name"),
+		"bank_party_iban": transaction.get("counter_party", {}).get("iban"),
+		"bank_party_account_number": transaction.get("counter_party", {}).get(
+			"account_number"
+		),
+	}
+	# Fingerprinted by booking date, the only date of EBICS transactions
+	booking_date = transaction.get("booking_date") or transaction.get("date") or data["date"]
+	data["transaction_fingerprint"] = get_transaction_fingerprint(
+		{**data, "date": booking_date}, occurrences
 	)
-	new_transaction.insert()
-	new_transaction.submit()
-	return True
+	return data
 
 
 def get_from_to_date(from_date: Optional[str] = None, to_date: Optional[str] = None):
@@ -350,21 +471,68 @@ def get_current_ip() -> Optional[str]:
 	"""Return the current IP or `None`.
 
 	- If run outside of a request context, return `None` (e.g. in a background job).
-	- If run on localhost, return the public IP address as queried from AWS checkip.
+	- If run on localhost, return the public IP address, see `get_public_ip`.
 	"""
 	if not frappe.request:
 		return None
 
 	ip_address = frappe.local.request_ip
 	if ip_address == "127.0.0.1":
+		ip_address = get_public_ip() or ip_address
+
+	return ip_address
+
+
+def get_public_ip() -> Optional[str]:
+	"""Return the public IP address of this server.
+
+	- `banking_public_ip` in the site config takes precedence.
+	- With `banking_skip_ip_lookup` in the site config, return `None` (e.g. air-gapped test setups).
+	- Otherwise, return the IP as queried from AWS checkip. The result is cached in
+	Redis and refreshed in the background once it is older than `PUBLIC_IP_TTL`.
+	"""
+	if frappe.conf.get("banking_public_ip"):
+		return frappe.conf.banking_public_ip
+
+	if frappe.conf.get("banking_skip_ip_lookup"):
+		return None
+
+	cached = frappe.cache().get_value(PUBLIC_IP_CACHE_KEY)
+	if not cached:
 		try:
-			ip_address = requests.get("https://checkip.amazonaws.com", timeout=3).text.strip()
+			return fetch_public_ip()
 		except Exception as exc:
 			ExceptionHandler(exc)
 
+	if time.time() - cached["fetched_at"] > PUBLIC_IP_TTL:
+		frappe.enqueue(
+			"banking.klarna_kosma_integration.utils.refresh_public_ip",
+			job_id=PUBLIC_IP_CACHE_KEY,
+			deduplicate=True,
+		)
+
+	return cached["ip"]
+
+
+def fetch_public_ip() -> str:
+	"""Query the public IP address from AWS checkip and cache it."""
+	ip_address = requests.get("https://checkip.amazonaws.com", timeout=3).text.strip()
+	frappe.cache().set_value(
+		PUBLIC_IP_CACHE_KEY,
+		{"ip": ip_address, "fetched_at": time.time()},
+		expires_in_sec=PUBLIC_IP_MAX_AGE,
+	)
 	return ip_address
 
 
+def refresh_public_ip() -> None:
+	"""Background job: refresh the cached public IP, keep the old one on failure."""
+	try:
+		fetch_public_ip()
+	except Exception:
+		frappe.log_error(title=_("Banking Error"), message=frappe.get_traceback())
+
+
 def get_account_data_for_request(account: str):
 	if not account:
 		return {}
@@ -0,0 +1,88 @@
+# Copyright (c) 2025, ALYF GmbH and contributors
+# For license information, please see license.txt
+from collections import Counter
+
+import frappe
+from frappe.query_builder import Case
+
+from banking.fingerprint import get_transaction_fingerprint
+
+BATCH_SIZE = 5000
+
+
+def execute():
+	"""Set the fingerprint of existing Bank Transactions, so that syncs from another
+	source do not import them again. Later duplicates of a fingerprint are left empty."""
+	for bank_account in frappe.get_all(
+		"Bank Transaction", filters={"provisional": 0}, pluck="bank_account", distinct=True
+	):
+		set_fingerprints(bank_account)
+		frappe.db.commit()
+
+
+def set_fingerprints(bank_account: str) -> None:
+	fields = [
+		"name",
+		"bank_account",
+		"date",
+		"deposit",
+		"withdrawal",
+		"currency",
+		"bank_party_iban",
+		"reference_number",
+		"description",
+		"transaction_fingerprint",
+	]
+	existing = set(
+		frappe.get_all(
+			"Bank Transaction",
+			filters={"bank_account": bank_account, "transaction_fingerprint": ("is", "set")},
+			pluck="transaction_fingerprint",
+		)
+	)
+	occurrences, last_date, start = Counter(), None, 0
+	while True:
+		transactions = frappe.get_all(
+			"Bank Transaction",
+			filters={"bank_account": bank_account, "provisional": 0, "docstatus": ("<", 2)},
+			fields=fields,
+			order_by="date asc, creation asc, name asc",
+			limit_start=start,
+			limit_page_length=BATCH_SIZE,
+		)
+		updates = {}
+		for transaction in transactions:
+			if transaction.date != last_date:
+				# The date is part of the fingerprint
+				occurrences, last_date = Counter(), transaction.date
+
+			fingerprint = get_transaction_fingerprint(transaction, occurrences)
+			if transaction.transaction_fingerprint or fingerprint in existing:
+				continue
+
+			updates[transaction.name] = fingerprint
+			existing.add(fingerprint)
+
+		set_fingerprints_in_bulk(updates)
+		if len(transactions) < BATCH_SIZE:
+			break
+
+		start += BATCH_SIZE
+
+
+def set_fingerprints_in_bulk(updates: dict[str, str]) -> None:
+	"""Set the fingerprints by Bank Transaction name with a single UPDATE."""
+	if not updates:
+		return
+
+	table = frappe.qb.DocType("Bank Transaction")
+	fingerprint = Case()
+	for name, value in updates.items():
+		fingerprint = fingerprint.when(table.name == name, value)
+
+	(
+		frappe.qb.update(table)
+		.set(table.transaction_fingerprint, fingerprint)
+		.where(table.name.isin(list(updates)))
+		.run()
+	)
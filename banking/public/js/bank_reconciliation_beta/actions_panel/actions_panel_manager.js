@@ -102,13 +102,16 @@ erpnext.accounts.bank_reconciliation.ActionsPanelManager = class ActionsPanelMan
 				indicator: "blue"
 			});
 			this.panel_manager.refresh_transaction(unallocated_amount);
+			// e.g. a matched Bank Transaction
+			this.panel_manager.refresh_changes();
 		} else {
 			let alert_string = __("Bank Transaction {0} Matched", [this.transaction.name])
 			if (with_new_voucher) {
 				alert_string = __("Bank Transaction {0} reconciled with a new {1}", [this.transaction.name, document_type]);
 			}
 			frappe.show_alert({message: alert_string, indicator: "green"});
-			this.panel_manager.move_to_next_transaction();
+			this.panel_manager.move_to_next_transaction()
+				.then(() => this.panel_manager.refresh_changes());
 		}
 	}
 }
\ No newline at end of file
@@ -1,5 +1,11 @@
 frappe.provide("erpnext.accounts.bank_reconciliation");
 
+// Transactions per request. Rows have a fixed height, so that only the rows in
+// view (plus some overscan) need to be rendered.
+const PAGE_LENGTH = 100;
+const ROW_HEIGHT = 126;
+const OVERSCAN_ROWS = 10;
+
 erpnext.accounts.bank_reconciliation.PanelManager = class PanelManager {
 	constructor(opts) {
 		Object.assign(this, opts);
@@ -11,7 +17,10 @@ erpnext.accounts.bank_reconciliation.PanelManager = class PanelManager {
 	}
 
 	async init_panels() {
-		this.transactions = await this.get_bank_transactions();
+		this.transactions = [];
+		this.cursor = null;
+		this.total_count = 0;
+		await this.get_bank_transactions();
 
 		this.$wrapper.empty();
 		this.$panel_wrapper = this.$wrapper.append(`
@@ -21,20 +30,116 @@ erpnext.accounts.bank_reconciliation.PanelManager = class PanelManager {
 		this.render_panels()
 	}
 
-	async get_bank_transactions() {
-		let transactions = await frappe.call({
+	async get_bank_transactions(page_length=PAGE_LENGTH) {
+		// Fetch the next page and append it to `this.transactions`
+		let first_page = !this.cursor;
+		let page = await frappe.call({
 			method:
-				"banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.bank_reconciliation_tool_beta.get_bank_transactions",
+				"banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.bank_reconciliation_tool_beta.get_bank_transactions_page",
 			args: {
 				bank_account: this.doc.bank_account,
 				from_date: this.doc.bank_statement_from_date,
 				to_date: this.doc.bank_statement_to_date,
 				order_by: this.order || "date asc",
+				cursor: this.cursor,
+				page_length: page_length,
 			},
-			freeze: true,
+			freeze: first_page,
 			freeze_message: __("Fetching Bank Transactions"),
 		}).then(response => response.message);
-		return transactions;
+
+		this.transactions.push(...page.transactions);
+		this.cursor = page.cursor;
+		if (first_page) {
+			this.total_count = page.total_count;
+			this.version = page.version;
+		}
+	}
+
+	async refresh_changes() {
+		// Patch the list with the transactions that changed since it was loaded,
+		// instead of reloading all of them
+		if (!this.version || !this.$list_window) {
+			return this.init_panels();
+		}
+
+		let changes = await frappe.call({
+			method:
+				"banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.bank_reconciliation_tool_beta.get_bank_transaction_changes",
+			args: {
+				bank_account: this.doc.bank_account,
+				since: this.version,
+				from_date: this.doc.bank_statement_from_date,
+				to_date: this.doc.bank_statement_to_date,
+			},
+		}).then(response => response.message);
+		this.version = changes.version;
+
+		let active_name = this.active_transaction && this.active_transaction.name;
+		let active_index = this.transactions.findIndex(({name}) => name === active_name);
+
+		changes.removed.forEach((name) => this.remove_transaction(name));
+		changes.changed.forEach((transaction) => this.upsert_transaction(transaction));
+		this.total_count = changes.total_count;
+
+		if (!this.transactions.length) {
+			this.active_transaction = null;
+			this.render_no_transactions();
+			return;
+		}
+
+		this.render_window(true);
+		if (!this.transactions.find(({name}) => name === active_name)) {
+			let index = Math.min(Math.max(active_index, 0), this.transactions.length - 1);
+			this.select_transaction(this.transactions[index].name);
+		}
+	}
+
+	remove_transaction(name) {
+		// The total count is the server's, see `refresh_changes`
+		let index = this.transactions.findIndex((transaction) => transaction.name === name);
+		if (index === -1) return;
+
+		this.transactions.splice(index, 1);
+	}
+
+	upsert_transaction(transaction) {
+		let index = this.transactions.findIndex(({name}) => name === transaction.name);
+		if (index !== -1) {
+			this.transactions[index] = transaction;
+			return;
+		}
+
+		// Insert it at its sort position, unless it is part of a page that has not
+		// been fetched yet
+		let position = this.transactions.findIndex(
+			(other) => this.compare_transactions(transaction, other) < 0
+		);
+		if (position !== -1) {
+			this.transactions.splice(position, 0, transaction);
+		} else if (!this.cursor) {
+			this.transactions.push(transaction);
+		}
+	}
+
+	compare_transactions(a, b) {
+		// Same order as `get_bank_transactions_page`: sort field, then name
+		let field = this.order_by || "date";
+		let direction = (this.order_direction || "asc") === "asc" ? 1 : -1;
+		let compare = (x, y) => (x < y ? -1 : x > y ? 1 : 0);
+
+		return direction * (compare(a[field], b[field]) || compare(a.name, b.name));
+	}
+
+	async load_more_transactions(count=PAGE_LENGTH) {
+		// Fetch pages on demand, one request at a time
+		if (!this.cursor) return;
+		if (!this.loading) {
+			this.loading = this.get_bank_transactions(Math.max(count, PAGE_LENGTH))
+				.finally(() => this.loading = null);
+		}
+
+		await this.loading;
 	}
 
 	render_panels() {
@@ -44,9 +149,7 @@ erpnext.accounts.bank_reconciliation.PanelManager = class PanelManager {
 			this.render_no_transactions();
 		} else {
 			this.render_list_panel();
-
-			let first_transaction = this.transactions[0];
-			this.$list_container.find("#" + first_transaction.name).click();
+			this.select_transaction(this.transactions[0].name);
 		}
 	}
 
@@ -69,6 +172,7 @@ erpnext.accounts.bank_reconciliation.PanelManager = class PanelManager {
 	}
 
 	render_no_transactions() {
+		this.$list_window = null;
 		this.$panel_wrapper.empty();
 		this.$panel_wrapper.append(`
 			<div class="no-transactions">
@@ -132,71 +236,122 @@ erpnext.accounts.bank_reconciliation.PanelManager = class PanelManager {
 	}
 
 	render_transactions_list() {
+		// Virtual scroll window: the list is as high as all transactions, but only
+		// the visible rows are rendered. Missing pages are fetched while scrolling.
 		this.$list_container = this.$panel_wrapper.find(".list-container");
+		this.$list_window = $(`<div class="list-window"></div>`).appendTo(this.$list_container);
+		this.$list_container.on("scroll", () => this.render_window());
 
-		this.transactions.map(transaction => {
-			let amount = transaction.deposit || transaction.withdrawal;
-			let symbol = transaction.withdrawal ? "-" : "+";
-
-			let $row = this.$list_container.append(`
-				<div id="${transaction.name}" class="transaction-row p-10">
-					<!-- Date & Amount -->
-					<div class="d-flex">
-						<div class="w-50">
-							<span title="${__("Date")}">${frappe.format(transaction.date, {fieldtype: "Date"})}</span>
-						</div>
-
-						<div class="w-50 bt-amount-contianer">
-							<span
-								title="${__("Amount")}"
-								class="bt-amount ${transaction.withdrawal ? 'text-danger' : 'text-success'}"
-							>
-								<b>${symbol} ${format_currency(amount, transaction.currency)}</b>
-							</span>
-						</div>
-					</div>
+		this.window_key = null;
+		this.render_window();
+	}
 
+	async render_window(force=false) {
+		this.$list_window.css("height", this.total_count * ROW_HEIGHT);
 
-					<!-- Description, Reference, Party -->
-					<div
-						title="${__("Account Holder")}"
-						class="account-holder ${transaction.bank_party_name ? '' : 'hide'}"
-					>
-						<span class="account-holder-value">${transaction.bank_party_name}</span>
-					</div>
+		let scroll_top = this.$list_container.scrollTop();
+		let start = Math.max(Math.floor(scroll_top / ROW_HEIGHT) - OVERSCAN_ROWS, 0);
+		let end = Math.min(
+			Math.ceil((scroll_top + this.$list_container.height()) / ROW_HEIGHT) + OVERSCAN_ROWS,
+			this.total_count
+		);
+
+		let window_key = [start, end, this.transactions.length].join();
+		if (!force && window_key === this.window_key) return;
 
-					<div
-						title="${__("Description")}"
-						class="description ${transaction.description ? '' : 'hide'}"
-					>
-						<span class="description-value">${transaction.description}</span>
+		this.window_key = window_key;
+		this.$list_window.empty();
+		this.transactions.slice(start, end).forEach((transaction, offset) => {
+			this.render_transaction_row(transaction, start + offset);
+		});
+
+		if (end > this.transactions.length && this.cursor) {
+			await this.load_more_transactions(end - this.transactions.length);
+			this.render_window();
+		}
+	}
+
+	render_transaction_row(transaction, index) {
+		let amount = transaction.deposit || transaction.withdrawal;
+		let symbol = transaction.withdrawal ? "-" : "+";
+		let active = this.active_transaction && this.active_transaction.name === transaction.name;
+
+		let $row = $(`
+			<div
+				id="${transaction.name}"
+				class="transaction-row p-10 ${active ? 'active' : ''}"
+				style="top: ${index * ROW_HEIGHT}px; height: ${ROW_HEIGHT}px;"
+			>
+				<!-- Date & Amount -->
+				<div class="d-flex">
+					<div class="w-50">
+						<span title="${__("Date")}">${frappe.format(transaction.date, {fieldtype: "Date"})}</span>
 					</div>
 
-					<div
-						title="${__("Reference")}"
-						class="reference ${transaction.reference_number ? '' : 'hide'}"
-					>
-						<span class="reference-value">${transaction.reference_number}</span>
+					<div class="w-50 bt-amount-contianer">
+						<span
+							title="${__("Amount")}"
+							class="bt-amount ${transaction.withdrawal ? 'text-danger' : 'text-success'}"
+						>
+							<b>${symbol} ${format_currency(amount, transaction.currency)}</b>
+						</span>
 					</div>
 				</div>
-			`).find("#" + transaction.name);
 
-			$row.on("click", () => {
-				$row.addClass("active").siblings().removeClass("active");
 
-				// this.transaction's objects get updated, we want the latest values
-				this.active_transaction = this.transactions.find(({name}) => name === transaction.name);
-				this.render_actions_panel();
-			})
-		})
+				<!-- Description, Reference, Party -->
+				<div
+					title="${__("Account Holder")}"
+					class="account-holder ${transaction.bank_party_name ? '' : 'hide'}"
+				>
+					<span class="account-holder-value">${transaction.bank_party_name}</span>
+				</div>
+
+				<div
+					title="${__("Description")}"
+					class="description ${transaction.description ? '' : 'hide'}"
+				>
+					<span class="description-value">${transaction.description}</span>
+				</div>
+
+				<div
+					title="${__("Reference")}"
+					class="reference ${transaction.reference_number ? '' : 'hide'}"
+				>
+					<span class="reference-value">${transaction.reference_number}</span>
+				</div>
+			</div>
+		`).appendTo(this.$list_window);
+
+		$row.on("click", () => this.select_transaction(transaction.name));
+	}
+
+	select_transaction(name) {
+		// this.transaction's objects get updated, we want the latest values
+		this.active_transaction = this.transactions.find((transaction) => transaction.name === name);
+
+		this.$list_window.find(".transaction-row").removeClass("active");
+		this.$list_window.find("#" + name).addClass("active");
+		this.scroll_to_transaction(name);
+		this.render_actions_panel();
+	}
+
+	scroll_to_transaction(name) {
+		let index = this.transactions.findIndex((transaction) => transaction.name === name);
+		let top = index * ROW_HEIGHT;
+		let scroll_top = this.$list_container.scrollTop();
+
+		if (top < scroll_top) {
+			this.$list_container.scrollTop(top);
+		} else if (top + ROW_HEIGHT > scroll_top + this.$list_container.height()) {
+			this.$list_container.scrollTop(top + ROW_HEIGHT - this.$list_container.height());
+		}
 	}
 
 	refresh_transaction(updated_amount=null, reference_number=null, party_type=null, party=null) {
 		// Update the transaction object's & view's unallocated_amount **OR** other details
 		let id = this.active_transaction.name;
 		let current_index = this.transactions.findIndex(({name}) => name === id);
-
-		let $current_transaction = this.$list_container.find("#" + id);
 		let transaction = this.transactions[current_index];
 
 		if (updated_amount) {
@@ -209,40 +364,33 @@ erpnext.accounts.bank_reconciliation.PanelManager = class PanelManager {
 				party_type: party_type,
 				party: party
 			};
-			// Update Reference Number in List
-			$current_transaction.find(".reference").removeClass("hide");
-			$current_transaction.find(".reference-value").text(reference_number || "--");
 		}
 
-		$current_transaction.click();
+		this.render_window(true);
+		this.select_transaction(id);
 	}
 
-	move_to_next_transaction() {
+	async move_to_next_transaction() {
 		// Remove the current transaction from the list and move to the next/previous one
 		let id = this.active_transaction.name;
-		let $current_transaction = this.$list_container.find("#" + id);
 		let current_index = this.transactions.findIndex(({name}) => name === id);
 
-		let next_transaction = this.transactions[current_index + 1];
-		let previous_transaction = this.transactions[current_index - 1];
-
-		if (next_transaction) {
-			this.active_transaction = next_transaction;
-			let $next_transaction = $current_transaction.next();
-			$next_transaction.click();
-		} else if (previous_transaction) {
-			this.active_transaction = previous_transaction;
-			let $previous_transaction = $current_transaction.prev();
-			$previous_transaction.click();
-		}
-
 		this.transactions.splice(current_index, 1);
-		$current_transaction.remove();
+		this.total_count -= 1;
+
+		if (!this.transactions[current_index]) {
+			await this.load_more_transactions();
+		}
 
-		if (!next_transaction && !previous_transaction) {
+		let next_transaction = this.transactions[current_index] || this.transactions[current_index - 1];
+		if (!next_transaction) {
 			this.active_transaction = null;
 			this.render_no_transactions();
+			return;
 		}
 
+		this.active_transaction = next_transaction;
+		this.render_window(true);
+		this.select_transaction(next_transaction.name);
 	}
-}
\ No newline at end of file
+}